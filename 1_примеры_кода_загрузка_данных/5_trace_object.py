@@ -0,0 +1,229 @@
+"""
+Объект Trace хранит время, напряжение и ток одной записи и по запросу вычисляет
+производные каналы: ток в амперах, модуль тока, производную, накопленный заряд, время
+от начала записи в наносекундах, максимум, минимум и среднее по окнам. Вычисленный канал
+запоминается, поэтому несколько детекторов и расчетов статистики на одной записи
+используют один и тот же массив. Для запомненных каналов задается предел памяти:
+при его превышении удаляются каналы, к которым дольше всего не обращались.
+"""
+
+import os
+import re
+import time
+from collections import OrderedDict
+import numpy as np
+from scipy.integrate import cumulative_trapezoid
+
+
+# Производные каналы: имя -> функция(trace, параметры). Функции берут другие каналы через trace.get
+def _current(trace):
+    return trace.i_raw / trace.resistance  # Конвертируем в амперы
+
+
+def _abs_current(trace):
+    return np.abs(trace.get('current'))
+
+
+def _derivative(trace):
+    return np.diff(trace.get('current'))
+
+
+def _charge(trace):
+    """Накопленный заряд: заряд импульса [start, end) равен charge[end - 1] - charge[start]"""
+    return cumulative_trapezoid(trace.get('current'), trace.t, initial=0)
+
+
+def _t_shifted(trace):
+    return trace.t - trace.t[0]
+
+
+def _t_ns(trace):
+    return trace.get('t_shifted') * 1e9
+
+
+def _window_starts(trace, window):
+    return np.arange(0, len(trace.t), window)
+
+
+def _window_max(trace, window, channel='current'):
+    return np.maximum.reduceat(trace.get(channel), _window_starts(trace, window))
+
+
+def _window_min(trace, window, channel='current'):
+    return np.minimum.reduceat(trace.get(channel), _window_starts(trace, window))
+
+
+def _window_mean(trace, window, channel='current'):
+    starts = _window_starts(trace, window)
+    counts = np.diff(np.append(starts, len(trace.t)))
+    return np.add.reduceat(trace.get(channel), starts) / counts
+
+
+derived_channels = {
+    'current': _current,
+    'abs_current': _abs_current,
+    'derivative': _derivative,
+    'charge': _charge,
+    't_shifted': _t_shifted,
+    't_ns': _t_ns,
+    'window_max': _window_max,
+    'window_min': _window_min,
+    'window_mean': _window_mean,
+}
+
+
+class Trace:
+    """
+    Запись с ленивыми производными каналами.
+    trace.get('abs_current') или trace['abs_current'] - канал без параметров,
+    trace.get('window_max', window=10000) - канал с параметрами.
+    Возвращаемые массивы только для чтения: их нельзя случайно испортить в кэше.
+    """
+
+    def __init__(self, t, v, i_raw, resistance=50, memory_budget=64 * 2**20, name=''):
+        self.t = t
+        self.v = v
+        self.i_raw = i_raw
+        self.resistance = resistance
+        self.memory_budget = memory_budget
+        self.name = name
+        self._cache = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    @classmethod
+    def from_file(cls, filepath, **kwargs):
+        with np.load(filepath) as data:
+            raw_data = data['data']
+        match = re.search(r'(\d+)Ohm', os.path.basename(filepath))
+        resistance = int(match.group(1)) if match else 50
+        return cls(raw_data[0], raw_data[1], raw_data[2], resistance=resistance,
+                   name=os.path.basename(filepath), **kwargs)
+
+    def get(self, name, **params):
+        key = (name, tuple(sorted(params.items())))
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.stats['hits'] += 1
+            return self._cache[key]
+
+        if name not in derived_channels:
+            raise KeyError(f"Неизвестный канал: {name}")
+        self.stats['misses'] += 1
+        value = derived_channels[name](self, **params)
+        value.flags.writeable = False
+        self._store(key, value)
+        return value
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def _store(self, key, value):
+        if value.nbytes > self.memory_budget:
+            return  # Канал больше всего бюджета - не запоминаем
+        self._cache[key] = value
+        while self.memory_used > self.memory_budget:
+            self._cache.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    @property
+    def memory_used(self):
+        return sum(value.nbytes for value in self._cache.values())
+
+    def clear(self):
+        self._cache.clear()
+
+
+# Пример использования: несколько проходов по одной записи
+
+def find_impulses(trace, current_threshold=0.001, derivative_threshold=0.0003, noise_threshold=0.0005, min_duration=10, padding=5):
+    """Цикл поиска импульсов из find_and_save_impulses; модуль и производная берутся из записи"""
+    abs_current = trace['abs_current']
+    di_dt = trace['derivative']
+    above_current_threshold = abs_current > current_threshold
+    at_noise_level = abs_current <= noise_threshold
+    impulse_starts = []
+    impulse_ends = []
+    in_impulse = False
+    for idx, (is_above, is_noise) in enumerate(zip(above_current_threshold, at_noise_level)):
+        if is_above and not in_impulse:
+            start_idx = idx
+            while start_idx > 0 and np.abs(di_dt[start_idx-1]) > derivative_threshold:
+                start_idx -= 1
+            impulse_starts.append(start_idx)
+            in_impulse = True
+        elif (not is_above or is_noise) and in_impulse:
+            end_idx = idx
+            while end_idx < len(di_dt) and np.abs(di_dt[end_idx]) > derivative_threshold:
+                end_idx += 1
+            impulse_ends.append(end_idx)
+            in_impulse = False
+
+    return [(max(0, start - padding), min(len(abs_current), end + padding))
+            for start, end in zip(impulse_starts, impulse_ends) if end - start >= min_duration]
+
+
+def passes_with_trace(trace):
+    """Поиск импульсов, заряды, промежутки с большим током и шкала времени для графика"""
+    impulses = find_impulses(trace)
+    charge = trace['charge']
+    charges = [charge[end - 1] - charge[start] for start, end in impulses]
+    loud = np.flatnonzero(trace.get('window_max', window=10000, channel='abs_current') > 0.001)
+    means = trace.get('window_mean', window=10000)
+    t_ns = trace['t_ns']
+    return len(impulses), np.sum(np.abs(charges)), len(loud), means, t_ns[-1]
+
+
+def passes_without_trace(raw_data):
+    """Те же проходы, как они написаны в отдельных скриптах: каждый считает свои массивы"""
+    t = raw_data[0]
+    trace = Trace(t, raw_data[1], raw_data[2], memory_budget=0)  # Ничего не запоминает
+    impulses = find_impulses(trace)
+
+    i = raw_data[2] / 50
+    charges = [np.trapezoid(i[start:end], t[start:end]) for start, end in impulses]
+
+    i = raw_data[2] / 50
+    batches = [np.abs(i[k:k + 10000]) for k in range(0, len(i), 10000)]
+    loud = [n for n, batch in enumerate(batches) if np.max(batch) > 0.001]
+    means = np.array([np.mean(i[k:k + 10000]) for k in range(0, len(i), 10000)])
+    t_ns = (t - t[0]) * 1e9
+    return len(impulses), np.sum(np.abs(charges)), len(loud), means, t_ns[-1]
+
+
+directory = '../sample_data'
+npz_files = [f for f in os.listdir(directory) if f.endswith('.npz')]
+npz_files.sort()
+filepath = os.path.join(directory, npz_files[0])
+
+try:
+    trace = Trace.from_file(filepath)
+    with np.load(filepath) as data:
+        raw_data = data['data']
+except Exception as e:
+    print(f"Ошибка при загрузке файла {filepath}: {e}")
+else:
+    repeats = 3  # Например, три детектора или три набора порогов на одной записи
+
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        expected = passes_without_trace(raw_data)
+    without_trace = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        result = passes_with_trace(trace)
+    with_trace = time.perf_counter() - start_time
+
+    print(f"Запись {trace.name}: импульсов {result[0]}, суммарный заряд {result[1]:.3e} Кл, "
+          f"промежутков с большим током {result[2]}")
+    print(f"Результаты совпадают: импульсы {result[0] == expected[0]}, промежутки {result[2] == expected[2]}, "
+          f"заряд {np.isclose(result[1], expected[1])}, средние {np.allclose(result[3], expected[3])}")
+    print(f"Без кэша: {without_trace:.3f} с, с Trace: {with_trace:.3f} с")
+    print(f"Обращений из кэша: {trace.stats['hits']}, вычислений: {trace.stats['misses']}, "
+          f"занято {trace.memory_used / 2**20:.1f} МБ")
+
+    # С маленьким бюджетом давно не использованные каналы вытесняются
+    small = Trace.from_file(filepath, memory_budget=2 * 2**20)
+    passes_with_trace(small)
+    print(f"Бюджет 2 МБ: занято {small.memory_used / 2**20:.1f} МБ, вытеснено каналов {small.stats['evictions']}, "
+          f"в памяти: {[key[0] for key in small._cache]}")
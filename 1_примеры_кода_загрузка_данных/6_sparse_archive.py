@@ -0,0 +1,224 @@
+"""
+Компактный архив записей: вместо полного массива 4×N сохраняются только окна импульсов,
+найденных детектором из find_and_save_impulses (с тем же отступом padding), а остальная
+запись, где только шум, заменяется статистикой по блокам: среднее, СКО, минимум и
+максимум каждого канала. Окна импульсов хранятся без изменений, поэтому все, что
+считается по импульсам, по архиву получается точно так же, как по исходному файлу.
+Пересекающиеся окна импульсов хранятся одним окном, а границы каждого импульса
+записываются отдельно. Чтение архива дает два представления: список импульсов с их
+данными и сводку по блокам всей записи.
+"""
+
+import os
+import re
+import numpy as np
+
+
+source_directory = '../sample_data'
+archive_directory = '../sample_data/sparse'
+block_size = 1000   # Отсчетов в блоке статистики шума
+
+
+def find_impulses(i, current_threshold=0.001, derivative_threshold=0.0003, noise_threshold=0.0005, min_duration=10, padding=5):
+    """
+    Цикл поиска импульсов из find_and_save_impulses; возвращает окна (начало, конец) с отступом.
+    Повторные срабатывания внутри одного импульса дают то же начало - они отбрасываются
+    """
+    di_dt = np.diff(i)
+    above_current_threshold = np.abs(i) > current_threshold
+    at_noise_level = np.abs(i) <= noise_threshold
+    impulses = []
+    in_impulse = False
+    for idx, (is_above, is_noise) in enumerate(zip(above_current_threshold, at_noise_level)):
+        if is_above and not in_impulse:
+            start_idx = idx
+            while start_idx > 0 and np.abs(di_dt[start_idx-1]) > derivative_threshold:
+                start_idx -= 1
+            in_impulse = True
+        elif (not is_above or is_noise) and in_impulse:
+            end_idx = idx
+            while end_idx < len(di_dt) and np.abs(di_dt[end_idx]) > derivative_threshold:
+                end_idx += 1
+            in_impulse = False
+
+            if end_idx - start_idx >= min_duration:
+                padded_start = max(0, start_idx - padding)
+                if impulses and impulses[-1][0] == padded_start:
+                    continue
+                impulses.append((padded_start, min(len(i), end_idx + padding)))
+    return impulses
+
+
+def merge_windows(windows):
+    """Объединяет пересекающиеся окна, чтобы каждый отсчет хранился один раз"""
+    merged = []
+    for start, end in sorted(windows):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return np.array(merged, dtype=np.int64).reshape(-1, 2)
+
+
+def block_statistics(raw_data):
+    """Среднее, СКО, минимум и максимум каждого канала по блокам: массивы (каналы × блоки)"""
+    starts = np.arange(0, raw_data.shape[1], block_size)
+    counts = np.diff(np.append(starts, raw_data.shape[1]))
+    sums = np.add.reduceat(raw_data, starts, axis=1)
+    squares = np.add.reduceat(raw_data ** 2, starts, axis=1)
+    mean = sums / counts
+    std = np.sqrt(np.maximum(squares / counts - mean ** 2, 0))
+    return {
+        'block_starts': starts,
+        'block_time': raw_data[0][starts],
+        'block_mean': mean[1:],
+        'block_std': std[1:],
+        'block_min': np.minimum.reduceat(raw_data, starts, axis=1)[1:],
+        'block_max': np.maximum.reduceat(raw_data, starts, axis=1)[1:],
+    }
+
+
+def write_sparse_archive(raw_data, archive_path, source_name, resistance=50):
+    """Сохраняет окна импульсов, границы каждого импульса и статистику блоков; возвращает число импульсов"""
+    impulses = find_impulses(raw_data[2] / resistance)
+    windows = merge_windows(impulses)
+    event_data = (np.concatenate([raw_data[:, start:end] for start, end in windows], axis=1)
+                  if len(windows) else np.empty((raw_data.shape[0], 0)))
+    t = raw_data[0]
+    np.savez_compressed(
+        archive_path,
+        source=source_name,
+        n_samples=raw_data.shape[1],
+        t0=t[0],
+        dt=(t[-1] - t[0]) / (len(t) - 1),
+        resistance=resistance,
+        block_size=block_size,
+        event_windows=windows,
+        event_data=event_data,
+        impulse_bounds=np.array(impulses, dtype=np.int64).reshape(-1, 2),
+        **block_statistics(raw_data),
+    )
+    return len(impulses)
+
+
+def read_sparse_archive(archive_path):
+    """Загружает архив целиком в словарь; данные импульсов делятся по окнам без копирования"""
+    with np.load(archive_path) as data:
+        archive = {name: data[name] for name in data.files}
+    windows = archive['event_windows']
+    offsets = np.concatenate(([0], np.cumsum(windows[:, 1] - windows[:, 0])))
+    archive['events'] = [archive['event_data'][:, offsets[k]:offsets[k + 1]] for k in range(len(windows))]
+    return archive
+
+
+def event_view(archive):
+    """
+    Импульсы с границами, как у детектора: положение, время, амплитуда и заряд, а также
+    сами данные (t, v, i в амперах). Данные импульса берутся из окна, в которое он попал
+    """
+    events = []
+    resistance = float(archive['resistance'])
+    windows = archive['event_windows']
+    for start, end in archive['impulse_bounds']:
+        k = np.searchsorted(windows[:, 0], start, side='right') - 1
+        data = archive['events'][k][:, start - windows[k, 0]:end - windows[k, 0]]
+        t, v, i = data[0], data[1], data[2] / resistance
+        peak = np.argmax(np.abs(i))
+        events.append({
+            'start': int(start),
+            'end': int(end),
+            'time': t[0],
+            'amplitude': i[peak],
+            'charge': np.trapezoid(i, t),
+            't': t,
+            'v': v,
+            'i': i,
+        })
+    return events
+
+
+def summary_view(archive):
+    """
+    Сводка по всей записи: для каждого блока время начала, среднее и СКО напряжения и
+    тока, размах тока и число отсчетов блока, попавших в окна импульсов
+    """
+    resistance = float(archive['resistance'])
+    block_size = int(archive['block_size'])  # Размер блока из архива: его могли записать с другими настройками
+    starts = archive['block_starts']
+    n_samples = int(archive['n_samples'])
+    coverage = np.zeros(len(starts), dtype=np.int64)
+    for start, end in archive['event_windows']:
+        # Число отсчетов окна в каждом блоке, который оно задевает
+        first, last = start // block_size, (end - 1) // block_size
+        for block in range(first, last + 1):
+            block_start = starts[block]
+            block_end = starts[block + 1] if block + 1 < len(starts) else n_samples
+            coverage[block] += min(end, block_end) - max(start, block_start)
+    return {
+        'time': archive['block_time'],
+        'voltage_mean': archive['block_mean'][0],
+        'voltage_std': archive['block_std'][0],
+        'current_mean': archive['block_mean'][1] / resistance,
+        'current_std': archive['block_std'][1] / resistance,
+        'current_range': (archive['block_max'][1] - archive['block_min'][1]) / resistance,
+        'event_samples': coverage,
+    }
+
+
+# Пример использования: архивируем все записи и проверяем, что импульсы не изменились
+
+os.makedirs(archive_directory, exist_ok=True)
+npz_files = [f for f in os.listdir(source_directory) if f.endswith('.npz')]
+npz_files.sort()
+
+source_bytes = 0
+archive_bytes = 0
+n_windows = 0
+n_impulses = 0
+mismatches = 0
+archived_files = []
+for filename in npz_files:
+    filepath = os.path.join(source_directory, filename)
+    try:
+        with np.load(filepath) as data:
+            raw_data = data['data']
+    except Exception as e:
+        print(f"Ошибка при загрузке файла {filepath}: {e}")
+        continue
+
+    match = re.search(r'(\d+)Ohm', filename)
+    resistance = int(match.group(1)) if match else 50
+    archive_path = os.path.join(archive_directory, filename)
+    n_impulses += write_sparse_archive(raw_data, archive_path, filename, resistance)
+    archived_files.append(filename)
+    source_bytes += os.path.getsize(filepath)
+    archive_bytes += os.path.getsize(archive_path)
+
+    # Окна импульсов из архива должны совпадать с исходными данными отсчет в отсчет
+    archive = read_sparse_archive(archive_path)
+    for (start, end), data in zip(archive['event_windows'], archive['events']):
+        if not np.array_equal(data, raw_data[:, start:end]):
+            mismatches += 1
+    n_windows += len(archive['events'])
+
+print(f"Файлов: {len(archived_files)} из {len(npz_files)}, импульсов: {n_impulses}, "
+      f"окон (пересекающиеся импульсы объединены): {n_windows}, расхождений с исходными данными: {mismatches}")
+print(f"Исходные файлы: {source_bytes / 2**20:.1f} МБ, архив: {archive_bytes / 2**20:.2f} МБ, "
+      f"сжатие в {source_bytes / max(archive_bytes, 1):.0f} раз")
+
+if not archived_files:
+    print("Нет ни одного записанного архива")
+    exit(0)
+
+# Оба представления для одной записи
+archive = read_sparse_archive(os.path.join(archive_directory, archived_files[0]))
+events = event_view(archive)
+summary = summary_view(archive)
+print(f"\nЗапись {archive['source']}: {archive['n_samples']} отсчетов, импульсов {len(events)} "
+      f"в {len(archive['event_windows'])} окнах")
+for event in events[:5]:
+    print(f"  Импульс {event['start']}-{event['end']}: время {event['time'] * 1e6:.3f} мкс, "
+          f"амплитуда {event['amplitude']:.3e} А, заряд {event['charge']:.3e} Кл")
+quiet = summary['event_samples'] == 0
+print(f"Блоков по {archive['block_size']} отсчетов: {len(summary['time'])}, без импульсов: {np.sum(quiet)}, "
+      f"СКО шума тока в них: {np.median(summary['current_std'][quiet]):.3e} А")
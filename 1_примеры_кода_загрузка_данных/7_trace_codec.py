@@ -0,0 +1,375 @@
+"""
+Кодек записей без потерь с быстрым доступом к любому участку. Каждый канал переводится
+в целые коды АЦП: значения напряжения и тока лежат на сетке с постоянным шагом, а время
+растет равномерно. Коды режутся на блоки фиксированной длины; в блоке хранится первый
+код и разности соседних кодов, уменьшенные на наименьшую разность блока и упакованные
+минимальным числом бит. Исходные значения восстанавливаются точно до бита: для
+напряжения и тока - по таблице значений кодов, для времени - по формуле; отсчеты, которые
+так не восстанавливаются, хранятся отдельно как исключения. Канал, который не лежит на
+сетке (исключения заняли бы больше места, чем сами значения), хранится как есть, теми же
+блоками. Индекс блоков позволяет прочитать и распаковать только блоки, задевающие нужный
+участок записи. Разности всех нужных блоков распаковываются одной векторной выборкой в
+заранее выделенные рабочие буферы, поэтому вся запись распаковывается быстрее, чем zlib,
+а файл получается в несколько раз меньше.
+load_raw_data возвращает тот же массив 4×N, что и data['data'] из npz файла.
+"""
+
+import io
+import os
+import json
+import time
+import zipfile
+import numpy as np
+
+
+source_directory = '../sample_data'
+codec_directory = '../sample_data/codec'
+block_size = 4096
+max_table_size = 65536   # Больше кодов - канал восстанавливается по формуле, а не по таблице
+magic = b'TRCODEC1'
+
+block_index_dtype = np.dtype([('offset', '<i8'), ('n_bytes', '<i8'), ('base', '<i8'),
+                              ('min_delta', '<i8'), ('width', '<i8')])
+
+
+# Перевод канала в коды АЦП
+
+def channel_model(x):
+    """
+    Подбирает для канала шаг и начало сетки и переводит значения в целые коды.
+    Для равномерно растущего канала (время) шаг - средний шаг по записи
+    """
+    differences = np.diff(x)
+    if len(x) > 1 and np.all(differences > 0):
+        step = (x[-1] - x[0]) / (len(x) - 1)
+        offset = x[0]
+    else:
+        levels = np.unique(x)
+        gaps = np.diff(levels)
+        # Соседние уровни отличаются на шаг АЦП; совсем маленькие отличия - погрешность округления
+        gaps = gaps[gaps > 1e-6 * (levels[-1] - levels[0])] if len(gaps) else gaps
+        step = gaps.min() if len(gaps) else 1.0
+        offset = levels[0]
+    codes = np.round((x - offset) / step).astype(np.int64)
+
+    code_range = codes.max() - codes.min() + 1
+    if code_range <= max_table_size:
+        # Таблица: для каждого кода - точное значение, которое встретилось в записи
+        first_code = codes.min()
+        table = offset + (np.arange(code_range) + first_code) * step
+        table[codes - first_code] = x  # Для повторяющихся кодов остается последнее значение
+        model = {'mode': 'table', 'step': step, 'offset': offset, 'first_code': int(first_code)}
+    else:
+        table = np.empty(0)
+        model = {'mode': 'linear', 'step': step, 'offset': offset, 'first_code': 0}
+    return model, table, codes
+
+
+def encode_channel(x):
+    """
+    Модель, таблица, позиции исключений и упакованные блоки канала. Если коды с таблицей и
+    исключениями занимают не меньше исходных значений (у исключения 16 байт: позиция и
+    значение), канал хранится как есть в режиме 'raw'
+    """
+    model, table, codes = channel_model(x)
+    decoded = codes_to_values(model, table, codes)
+    exceptions = np.flatnonzero(decoded.view(np.int64) != x.view(np.int64))  # Сравнение до бита
+    blocks = [encode_block(codes[start:start + block_size]) for start in range(0, len(x), block_size)]
+
+    coded_bytes = sum(len(packed) for *_, packed in blocks) + table.nbytes + 16 * len(exceptions)
+    if coded_bytes >= x.nbytes:
+        model = {'mode': 'raw'}
+        table, exceptions = np.empty(0), np.empty(0, dtype=np.int64)
+        blocks = [(0, 0, 0, x[start:start + block_size].astype('<f8').tobytes()) for start in range(0, len(x), block_size)]
+    return model, table, exceptions, blocks
+
+
+def codes_to_values(model, table, codes):
+    if model['mode'] == 'table':
+        return table[codes - model['first_code']]
+    return model['offset'] + codes * model['step']
+
+
+# Упаковка блоков
+
+def pack_bits(values, width):
+    """Записывает неотрицательные числа по width бит подряд, младшие биты первыми"""
+    if width == 0 or len(values) == 0:
+        return b''
+    bits = (values[:, None] >> np.arange(width, dtype=np.uint64)) & np.uint64(1)
+    return np.packbits(bits.astype(np.uint8).ravel(), bitorder='little').tobytes()
+
+
+def unpack_wide(buffer, width, count):
+    """Обратно к pack_bits для чисел шире 57 бит: такое число может занимать 9 байт"""
+    bits = np.unpackbits(np.frombuffer(buffer, dtype=np.uint8), count=count * width, bitorder='little')
+    weights = np.uint64(1) << np.arange(width, dtype=np.uint64)
+    return (bits.reshape(count, width).astype(np.uint64) * weights).sum(axis=1).view(np.int64)
+
+
+def encode_block(codes):
+    deltas = np.diff(codes)
+    min_delta = int(deltas.min()) if len(deltas) else 0
+    shifted = (deltas - min_delta).astype(np.uint64)
+    width = int(shifted.max()).bit_length() if len(shifted) else 0
+    return int(codes[0]), min_delta, width, pack_bits(shifted, width)
+
+
+bit_layouts = {}  # длина блока -> номера байтов и сдвиги разностей для каждой ширины до 57 бит
+workspace = {}    # имя -> рабочий буфер распаковки, переиспользуется между вызовами
+
+
+def bit_layout(size):
+    """Для ширины w (строка) и номера разности k (столбец): байт и бит, где начинается разность"""
+    if size not in bit_layouts:
+        bits = np.arange(58, dtype=np.int64)[:, None] * np.arange(size, dtype=np.int64)
+        bit_layouts[size] = (bits >> 3, (bits & 7).astype(np.uint8))
+    return bit_layouts[size]
+
+
+def scratch(name, shape, dtype):
+    """
+    Рабочий буфер нужной формы. Запись в только что выделенную память (первое обращение к
+    страницам) стоит столько же, сколько сама распаковка, поэтому буферы не выделяются
+    заново, пока хватает прежних
+    """
+    size = int(np.prod(shape))
+    buffer = workspace.get(name)
+    if buffer is None or buffer.size < size or buffer.dtype != dtype:
+        buffer = workspace[name] = np.empty(size, dtype=dtype)
+    return buffer[:size].reshape(shape)
+
+
+def decode_blocks(buffer, entries, counts):
+    """
+    Коды нескольких соседних блоков, без цикла по блокам: разности всех блоков
+    распаковываются одной выборкой в массив (блок, номер разности). Для каждой разности
+    берутся 8 байт, начиная с байта, где лежит ее первый бит (невыровненное чтение с шагом
+    1 байт), сдвигаются на номер бита в байте и обрезаются маской ширины блока. Лишние
+    разности в конце короткого последнего блока читаются с прижатым к концу буфера номером
+    байта (mode='clip') и отбрасываются. Только блоки шире 57 бит распаковываются по одному.
+    Коды лежат в рабочем буфере и действительны до следующего вызова
+    """
+    size = int(np.max(counts))
+    widths = entries['width']
+    codes = scratch('codes', (len(counts), size), np.int64)
+    if not np.any(widths):
+        # Равномерное время: все разности равны наименьшей, читать нечего
+        np.multiply(np.arange(size), entries['min_delta'][:, None], out=codes)
+        codes += entries['base'][:, None]
+        return codes.ravel()[:int(np.sum(counts))]
+
+    padded = np.frombuffer(buffer + bytes(8), dtype=np.uint8)
+    words = np.ndarray((len(padded) - 7,), dtype='<u8', buffer=padded, strides=(1,))
+    narrow = np.where(widths <= 57, widths, 0)
+    masks = (np.uint64(1) << narrow.astype(np.uint64)) - np.uint64(1)
+    byte_index, shifts = bit_layout(size)
+    positions = codes  # Номера байтов больше не нужны, когда разности прочитаны
+    np.take(byte_index, narrow, axis=0, out=positions)
+    positions += (entries['offset'] - entries['offset'][0])[:, None]
+
+    # np.take с невыровненным массивом заметно быстрее, чем words[positions]
+    deltas = np.take(words, positions, mode='clip', out=scratch('deltas', positions.shape, np.uint64))
+    np.right_shift(deltas, shifts[narrow], out=deltas)
+    deltas &= masks[:, None]
+    deltas = deltas.view(np.int64)
+    for k in np.flatnonzero(widths > 57):
+        offset, count = int(entries['offset'][k] - entries['offset'][0]), int(counts[k]) - 1
+        deltas[k, :count] = unpack_wide(buffer[offset:offset + int(entries['n_bytes'][k])], int(widths[k]), count)
+    deltas += entries['min_delta'][:, None]
+
+    codes[:, 0] = entries['base']
+    np.cumsum(deltas[:, :-1], axis=1, out=codes[:, 1:])
+    codes[:, 1:] += entries['base'][:, None]
+    return codes.ravel()[:int(np.sum(counts))]
+
+
+# Запись и чтение файла
+
+def encode_trace(raw_data, filepath):
+    """
+    Формат файла: метка, длина и JSON заголовок, затем для каждого канала таблица
+    значений, исключения и индекс блоков (в формате .npy), затем упакованные блоки.
+    Возвращает модели каналов
+    """
+    n_channels, n_samples = raw_data.shape
+    channels = []
+    payload = []
+    payload_size = 0
+    for x in raw_data:
+        model, table, exceptions, blocks = encode_channel(x)
+
+        index = np.zeros(len(blocks), dtype=block_index_dtype)
+        for k, (base, min_delta, width, packed) in enumerate(blocks):
+            index[k] = (payload_size, len(packed), base, min_delta, width)
+            payload.append(packed)
+            payload_size += len(packed)
+        channels.append((model, table, exceptions, x[exceptions], index))
+
+    header = json.dumps({'n_samples': n_samples, 'block_size': block_size,
+                         'channels': [model for model, *_ in channels]}).encode()
+    with open(filepath, 'wb') as f:
+        f.write(magic)
+        f.write(np.uint32(len(header)).tobytes())
+        f.write(header)
+        for _, table, exception_positions, exception_values, index in channels:
+            for array in (table, exception_positions, exception_values, index):
+                np.lib.format.write_array(f, array)
+        for packed in payload:
+            f.write(packed)
+    return [model for model, *_ in channels]
+
+
+def open_trace(filepath):
+    """Читает заголовок и индекс (без упакованных данных); файл остается открытым"""
+    f = open(filepath, 'rb')
+    if f.read(len(magic)) != magic:
+        f.close()
+        raise ValueError(f"{filepath} не является файлом кодека")
+    header = json.loads(f.read(int(np.frombuffer(f.read(4), dtype=np.uint32)[0])))
+    channels = []
+    for model in header['channels']:
+        table, exception_positions, exception_values, index = (np.lib.format.read_array(f) for _ in range(4))
+        channels.append({'model': model, 'table': table, 'exception_positions': exception_positions,
+                         'exception_values': exception_values, 'index': index})
+    return {'file': f, 'n_samples': header['n_samples'], 'block_size': header['block_size'],
+            'channels': channels, 'payload_start': f.tell(), 'blocks_decoded': 0}
+
+
+def read_samples(trace, start, end):
+    """Отсчеты [start, end) всех каналов; распаковываются только блоки, задевающие участок"""
+    size = trace['block_size']
+    n_samples = trace['n_samples']
+    start, end = max(start, 0), min(end, n_samples)
+    if end <= start:
+        return np.empty((len(trace['channels']), 0))
+    first_block, last_block = start // size, (end - 1) // size
+    block_start = first_block * size
+
+    result = np.empty((len(trace['channels']), end - start))
+    for c, channel in enumerate(trace['channels']):
+        index = channel['index']
+        # Блоки канала лежат подряд - читаем их одним обращением к диску
+        trace['file'].seek(trace['payload_start'] + index['offset'][first_block])
+        buffer = trace['file'].read(int(index['offset'][last_block] + index['n_bytes'][last_block]
+                                         - index['offset'][first_block]))
+        counts = np.minimum(size, n_samples - np.arange(first_block, last_block + 1) * size)
+        trace['blocks_decoded'] += len(counts)
+        if channel['model']['mode'] == 'raw':
+            result[c] = np.frombuffer(buffer, dtype='<f8')[start - block_start:end - block_start]
+            continue
+        codes = decode_blocks(buffer, index[first_block:last_block + 1], counts)[start - block_start:end - block_start]
+
+        # То же, что codes_to_values, но сразу в строку результата: коды лежат в рабочем буфере,
+        # а с mode='clip' np.take пишет в out без промежуточного массива
+        model = channel['model']
+        if model['mode'] == 'table':
+            codes -= model['first_code']
+            np.take(channel['table'], codes, mode='clip', out=result[c])
+        else:
+            np.multiply(codes, model['step'], out=result[c])
+            result[c] += model['offset']
+        lo, hi = np.searchsorted(channel['exception_positions'], [start, end])
+        result[c, channel['exception_positions'][lo:hi] - start] = channel['exception_values'][lo:hi]
+    return result
+
+
+def load_raw_data(filepath):
+    """Массив 4×N как data['data'] из npz; понимает и npz файлы, и файлы кодека"""
+    if filepath.endswith('.npz'):
+        with np.load(filepath) as data:
+            return data['data']
+    trace = open_trace(filepath)
+    try:
+        return read_samples(trace, 0, trace['n_samples'])
+    finally:
+        trace['file'].close()
+
+
+def load_window(filepath, start, end):
+    """Участок [start, end) записи; для файла кодека читаются только нужные блоки"""
+    if filepath.endswith('.npz'):
+        return load_raw_data(filepath)[:, max(start, 0):end]
+    trace = open_trace(filepath)
+    try:
+        return read_samples(trace, start, end)
+    finally:
+        trace['file'].close()
+
+
+# Пример использования: кодируем все записи, сравниваем с zlib (как в np.savez_compressed)
+
+os.makedirs(codec_directory, exist_ok=True)
+npz_files = [f for f in os.listdir(source_directory) if f.endswith('.npz')]
+npz_files.sort()
+
+raw_bytes = codec_bytes = zlib_bytes = 0
+codec_time = zlib_time = 0.0
+mismatches = 0
+raw_channels = 0
+encoded_files = []
+for filename in npz_files:
+    filepath = os.path.join(source_directory, filename)
+    try:
+        with np.load(filepath) as data:
+            raw_data = data['data']
+    except Exception as e:
+        print(f"Ошибка при загрузке файла {filepath}: {e}")
+        continue
+
+    codec_path = os.path.join(codec_directory, filename[:-len('.npz')] + '.trc')
+    models = encode_trace(raw_data, codec_path)
+    raw_channels += sum(model['mode'] == 'raw' for model in models)
+    encoded_files.append((filepath, codec_path))
+
+    # Тот же массив в сжатом npz - для сравнения размера и скорости распаковки
+    compressed = io.BytesIO()
+    np.savez_compressed(compressed, data=raw_data)
+
+    start_time = time.perf_counter()
+    decoded = load_raw_data(codec_path)
+    codec_time += time.perf_counter() - start_time
+
+    compressed.seek(0)
+    start_time = time.perf_counter()
+    with np.load(compressed) as data:
+        data['data']
+    zlib_time += time.perf_counter() - start_time
+
+    if not np.array_equal(decoded.view(np.int64), raw_data.view(np.int64)):
+        mismatches += 1
+    raw_bytes += raw_data.nbytes
+    codec_bytes += os.path.getsize(codec_path)
+    zlib_bytes += compressed.getbuffer().nbytes
+
+print(f"Файлов: {len(encoded_files)}, несовпадений до бита после декодирования: {mismatches}, "
+      f"каналов, сохраненных как есть: {raw_channels}")
+print(f"Исходные данные: {raw_bytes / 2**20:.1f} МБ")
+print(f"Кодек: {codec_bytes / 2**20:.2f} МБ (в {raw_bytes / codec_bytes:.1f} раз), "
+      f"распаковка {codec_time:.2f} с ({raw_bytes / codec_time / 2**20:.0f} МБ/с)")
+print(f"zlib:  {zlib_bytes / 2**20:.2f} МБ (в {raw_bytes / zlib_bytes:.1f} раз), "
+      f"распаковка {zlib_time:.2f} с ({raw_bytes / zlib_time / 2**20:.0f} МБ/с)")
+
+# Участок вокруг самого большого импульса первой записи: распаковывается один блок
+if encoded_files:
+    filepath, codec_path = encoded_files[0]
+    i = load_raw_data(filepath)[2] / 50  # Конвертируем в амперы
+    peak = int(np.argmax(np.abs(i)))
+    start, end = peak - 100, peak + 100
+
+    trace = open_trace(codec_path)
+    start_time = time.perf_counter()
+    window = read_samples(trace, start, end)
+    window_time = time.perf_counter() - start_time
+    trace['file'].close()
+
+    start_time = time.perf_counter()
+    with np.load(filepath) as data:
+        expected = data['data'][:, start:end]
+    npz_time = time.perf_counter() - start_time
+
+    with zipfile.ZipFile(filepath) as archive:
+        stored = archive.getinfo('data.npy').compress_type == zipfile.ZIP_STORED
+    print(f"\nУчасток {start}-{end} записи {os.path.basename(filepath)}: распаковано блоков {trace['blocks_decoded'] // len(trace['channels'])} на канал, "
+          f"{window_time * 1000:.2f} мс (npz{' без сжатия' if stored else ''} целиком: {npz_time * 1000:.2f} мс), "
+          f"совпадает: {np.array_equal(window, expected)}")
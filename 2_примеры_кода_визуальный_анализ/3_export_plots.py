@@ -0,0 +1,156 @@
+"""
+Сохраняет графики тока и напряжения для всех временных промежутков всех файлов
+в PNG без открытия окон. Файлы обрабатываются параллельно в нескольких процессах,
+а перед отрисовкой каждый сигнал прореживается до пар минимум/максимум на пиксель,
+поэтому время отрисовки зависит от ширины картинки, а не от числа точек.
+"""
+
+import os
+import json
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')  # Отрисовка без окон, только в файлы
+import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+
+
+directory = '../sample_data'
+output_directory = 'exported_plots'
+limits_file = 'current_limits.json'  # Или 'robust_limits.json' из 5_robust_limits.py - пределы по квантилям
+figure_size = (15, 6)
+dpi = 100  # Для быстрого экспорта; для печати можно поставить 400, как в 2_show_plots.py
+
+
+def split_experimental_data_into_batches(data, batch_size, overlap=0):
+    batches = []
+    data_length = len(data['t'])
+
+    for i in range(0, data_length, batch_size):
+        start = max(i - overlap, 0)
+        end = min(i + batch_size + overlap, data_length)
+
+        batch = {
+            't': data['t'][start:end],
+            'v': data['v'][start:end],
+            'i': data['i'][start:end]
+        }
+        batches.append(batch)
+
+    return batches
+
+
+def minmax_decimate(x, y, n_pixels):
+    """
+    Прореживает сигнал до n_pixels столбцов: в каждом столбце оставляет минимум
+    и максимум, чтобы короткие импульсы не пропадали с графика.
+    """
+    n = len(y)
+    if n <= 2 * n_pixels:
+        return x, y
+
+    per_pixel = n // n_pixels
+    n_used = per_pixel * n_pixels
+    y_blocks = y[:n_used].reshape(n_pixels, per_pixel)
+    x_blocks = x[:n_used].reshape(n_pixels, per_pixel)
+
+    # Точки в столбце идут в порядке времени: сначала та из пары min/max, что была раньше
+    argmin = np.argmin(y_blocks, axis=1)
+    argmax = np.argmax(y_blocks, axis=1)
+    first = np.minimum(argmin, argmax)
+    second = np.maximum(argmin, argmax)
+    rows = np.arange(n_pixels)
+
+    x_out = np.column_stack((x_blocks[rows, first], x_blocks[rows, second])).ravel()
+    y_out = np.column_stack((y_blocks[rows, first], y_blocks[rows, second])).ravel()
+
+    # Хвост, не поместившийся в целое число столбцов, добавляем как есть
+    return np.concatenate((x_out, x[n_used:])), np.concatenate((y_out, y[n_used:]))
+
+
+def export_file_plots(filename, min_current, max_current):
+    """Сохраняет графики всех временных промежутков одного файла. Выполняется в отдельном процессе"""
+    filepath = os.path.join(directory, filename)
+    try:
+        with np.load(filepath) as data:
+            raw_data = data['data']
+            t = raw_data[0]
+            v = raw_data[1]
+            i = raw_data[2] / 50  # Конвертируем в амперы
+    except Exception as e:
+        return filename, 0, f"Ошибка при обработке файла {filename}: {e}"
+
+    batches = split_experimental_data_into_batches({
+        't': t, 'v': v, 'i': i
+    }, batch_size=10000, overlap=100)
+
+    n_pixels = int(figure_size[0] * dpi)
+
+    # Фигура создается один раз на файл, для каждого промежутка меняются только данные линий
+    fig, ax1 = plt.subplots(figsize=figure_size, dpi=dpi)
+    current_line, = ax1.step([], [], 'k-', linewidth=3, label='Ток')
+    ax1.set_xlabel('Время, нс', fontsize=20)
+    ax1.set_ylabel('Ток, А', fontsize=20)
+    ax1.tick_params(axis='both', labelsize=20)
+    ax1.set_ylim(min_current, max_current)
+
+    ax2 = ax1.twinx()
+    voltage_line, = ax2.step([], [], 'k:', linewidth=2, label='Напряжение', alpha=1.0)
+    ax2.set_ylabel('Напряжение, В', fontsize=20)
+    ax2.tick_params(axis='y', labelsize=20)
+    ax2.set_ylim(-3200, 3200)
+
+    lines_1, labels_1 = ax1.get_legend_handles_labels()
+    lines_2, labels_2 = ax2.get_legend_handles_labels()
+    ax1.legend(lines_1 + lines_2, labels_1 + labels_2, loc='upper left', fontsize=20)
+    ax1.grid(True, linestyle='-', alpha=0.7, which="both")
+    plt.subplots_adjust(bottom=0.15, top=0.95)
+
+    name = os.path.splitext(filename)[0]
+    saved = 0
+    try:
+        for batch_index, batch in enumerate(batches):
+            # Сдвигаем время на ноль и конвертируем в наносекунды
+            t_ns = (batch['t'] - batch['t'][0]) * 1e9
+
+            current_line.set_data(*minmax_decimate(t_ns, batch['i'], n_pixels))
+            voltage_line.set_data(*minmax_decimate(t_ns, batch['v'], n_pixels))
+            ax1.set_xlim(t_ns[0], t_ns[-1])
+
+            fig.savefig(os.path.join(output_directory, f"{name}_batch_{batch_index:04d}.png"))
+            saved += 1
+    except Exception as e:
+        return filename, saved, f"Ошибка при сохранении графиков файла {filename} (сохранено {saved}): {e}"
+    finally:
+        plt.close(fig)
+    return filename, saved, None
+
+
+if __name__ == '__main__':
+    # Загружаем заранее определенные пределы тока
+    with open(limits_file, 'r') as f:
+        limits = json.load(f)
+        min_current = limits['min_current']
+        max_current = limits['max_current']
+
+    npz_files = [f for f in os.listdir(directory) if f.endswith('.npz')]
+    npz_files.sort()
+    os.makedirs(output_directory, exist_ok=True)
+
+    # Каждый процесс рисует все промежутки своего файла
+    total = 0
+    with ProcessPoolExecutor() as executor:
+        futures = [executor.submit(export_file_plots, filename, min_current, max_current) for filename in npz_files]
+        for filename, future in zip(npz_files, futures):
+            try:
+                filename, count, error = future.result()
+            except Exception as e:
+                # Процесс-обработчик упал целиком - остальные файлы продолжают сохраняться
+                print(f"Ошибка при обработке файла {filename}: {e}")
+                continue
+            total += count
+            if error:
+                print(error)
+                continue
+            print(f"{filename}: сохранено {count} графиков")
+
+    print(f"\nВсего сохранено {total} графиков в {output_directory}")
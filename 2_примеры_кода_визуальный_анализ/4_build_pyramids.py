@@ -0,0 +1,200 @@
+"""
+Строит для каждого файла многоуровневую пирамиду (минимум, максимум, среднее)
+с прореживанием в 2, 4, 8, ... раз и сохраняет ее рядом с данными. Для заданного
+диапазона времени и ширины графика в пикселях выбирается подходящий уровень,
+поэтому график любого масштаба строится по числу точек порядка ширины картинки.
+"""
+
+import os
+import time
+import struct
+import zipfile
+import numpy as np
+import matplotlib.pyplot as plt
+
+
+directory = '../sample_data'
+pyramid_directory = os.path.join(directory, 'pyramids')
+channels = {'v': 1, 'i': 2}
+scales = {'v': 1, 'i': 1 / 50}  # Ток конвертируем в амперы
+top_level_blocks = 256  # Уровней столько, чтобы на самом грубом было не больше стольких блоков
+
+
+def open_source(filepath):
+    """
+    Открывает массив data из npz без загрузки в память: несжатый массив в порядке C
+    отображается в память прямо из архива. Сжатый архив так открыть нельзя - тогда
+    файл загружается целиком.
+    """
+    with zipfile.ZipFile(filepath) as archive:
+        info = archive.getinfo('data.npy')
+        with archive.open('data.npy') as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            header_size = f.tell()
+    if fortran_order or info.compress_type != zipfile.ZIP_STORED:
+        with np.load(filepath) as data:
+            return data['data']
+
+    # Данные члена архива начинаются после локального заголовка: 30 байт, имя и поле extra
+    with open(filepath, 'rb') as f:
+        f.seek(info.header_offset + 26)
+        name_length, extra_length = struct.unpack('<HH', f.read(4))
+    offset = info.header_offset + 30 + name_length + extra_length + header_size
+    return np.memmap(filepath, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+
+def reduce_pairs(mins, maxs, means, counts):
+    """Объединяет соседние пары блоков одного уровня в блоки следующего уровня"""
+    indices = np.arange(0, len(mins), 2)
+    pair_counts = np.add.reduceat(counts, indices)
+    return (np.minimum.reduceat(mins, indices),
+            np.maximum.reduceat(maxs, indices),
+            np.add.reduceat(means * counts, indices) / pair_counts,
+            pair_counts)
+
+
+def build_pyramid(filepath, output_path, chunk_size=1 << 16):
+    """
+    Строит пирамиду за один проход по данным блоками chunk_size точек, не загружая
+    запись в память. chunk_size - степень двойки, поэтому блоки уровней до
+    log2(chunk_size) не пересекают границы чанков и считаются в пределах чанка.
+    Более грубые уровни (для длинных записей) считаются из последнего такого уровня,
+    который в chunk_size раз короче записи. Уровней строится столько, чтобы самый
+    грубый содержал не больше top_level_blocks блоков: тогда вид всей записи тоже
+    получается по числу точек порядка ширины картинки.
+    """
+    assert chunk_size > 1 and chunk_size & (chunk_size - 1) == 0, "chunk_size должен быть степенью двойки"
+    raw_data = open_source(filepath)
+
+    os.makedirs(output_path, exist_ok=True)
+    n = raw_data.shape[1]
+    t0 = raw_data[0, 0]
+    dt = (raw_data[0, -1] - t0) / (n - 1)
+    n_levels = max(1, int(np.ceil(np.log2(n / top_level_blocks))))
+    chunk_levels = min(n_levels, chunk_size.bit_length() - 1)
+
+    for channel, row in channels.items():
+        # Уровень number содержит ceil(n / 2**number) блоков - файлы создаются сразу нужного размера
+        levels = [{statistic: np.lib.format.open_memmap(
+                       os.path.join(output_path, f'{channel}_{number}_{statistic}.npy'),
+                       mode='w+', dtype=np.float32, shape=(-(-n // 2 ** number),))
+                   for statistic in ('min', 'max', 'mean')}
+                  for number in range(1, n_levels + 1)]
+
+        for start in range(0, n, chunk_size):
+            chunk = np.asarray(raw_data[row, start:start + chunk_size]) * scales[channel]
+            mins, maxs, means, counts = chunk, chunk, chunk, np.ones(len(chunk))
+            for number, level in enumerate(levels[:chunk_levels], start=1):
+                mins, maxs, means, counts = reduce_pairs(mins, maxs, means, counts)
+                offset = start >> number
+                level['min'][offset:offset + len(mins)] = mins
+                level['max'][offset:offset + len(maxs)] = maxs
+                level['mean'][offset:offset + len(means)] = means
+
+        if n_levels > chunk_levels:
+            level = levels[chunk_levels - 1]
+            mins, maxs, means = (np.asarray(level[statistic], dtype=np.float64) for statistic in ('min', 'max', 'mean'))
+            counts = np.full(len(mins), 2.0 ** chunk_levels)
+            counts[-1] = n - (len(mins) - 1) * 2 ** chunk_levels
+            for level in levels[chunk_levels:]:
+                mins, maxs, means, counts = reduce_pairs(mins, maxs, means, counts)
+                level['min'][:], level['max'][:], level['mean'][:] = mins, maxs, means
+
+        for level in levels:
+            for array in level.values():
+                array.flush()
+
+    # Исходные точки (уровень 0) не копируются: самые подробные виды читаются из исходного файла
+    np.save(os.path.join(output_path, 'meta.npy'), np.array([t0, dt, n, n_levels]))
+    np.save(os.path.join(output_path, 'source.npy'), np.array(os.path.abspath(filepath)))
+
+
+def load_pyramid(path):
+    """Открывает пирамиду. Массивы отображаются в память и читаются только по запросу"""
+    t0, dt, n, n_levels = np.load(os.path.join(path, 'meta.npy'))
+    pyramid = {'t0': t0, 'dt': dt, 'n': int(n), 'n_levels': int(n_levels), 'levels': {},
+               'source': open_source(str(np.load(os.path.join(path, 'source.npy'))))}
+    for channel in channels:
+        for number in range(1, int(n_levels) + 1):
+            pyramid['levels'][(channel, number)] = {
+                statistic: np.load(os.path.join(path, f'{channel}_{number}_{statistic}.npy'), mmap_mode='r')
+                for statistic in ('min', 'max', 'mean')
+            }
+    return pyramid
+
+
+def get_view(pyramid, channel, t_start, t_end, n_pixels):
+    """
+    Возвращает (время, минимум, максимум, среднее, уровень) для диапазона
+    [t_start, t_end]. Выбирается самый грубый уровень, у которого на пиксель
+    приходится не меньше одного блока, поэтому число точек не превышает
+    ~max(2 * n_pixels, top_level_blocks). На уровне 0 точки читаются из исходного файла.
+    """
+    first = max(0, int((t_start - pyramid['t0']) / pyramid['dt']))
+    last = min(pyramid['n'], int(np.ceil((t_end - pyramid['t0']) / pyramid['dt'])) + 1)
+    samples_per_pixel = max(1, (last - first) / n_pixels)
+    level = int(min(pyramid['n_levels'], np.floor(np.log2(samples_per_pixel))))
+
+    factor = 2 ** level
+    block_first = first // factor
+    block_last = -(-last // factor)
+    times = pyramid['t0'] + (np.arange(block_first, block_last) * factor + (factor - 1) / 2) * pyramid['dt']
+
+    if level == 0:
+        values = np.asarray(pyramid['source'][channels[channel], first:last]) * scales[channel]
+        return times, values, values, values, level
+
+    data = pyramid['levels'][(channel, level)]
+    return (times,
+            np.asarray(data['min'][block_first:block_last]),
+            np.asarray(data['max'][block_first:block_last]),
+            np.asarray(data['mean'][block_first:block_last]),
+            level)
+
+
+npz_files = [f for f in os.listdir(directory) if f.endswith('.npz')]
+npz_files.sort()
+
+# Строим пирамиды для всех файлов
+start_time = time.perf_counter()
+built = []
+for filename in npz_files:
+    output_path = os.path.join(pyramid_directory, os.path.splitext(filename)[0])
+    try:
+        build_pyramid(os.path.join(directory, filename), output_path)
+        built.append(output_path)
+    except Exception as e:
+        print(f"Ошибка при обработке файла {filename}: {e}")
+print(f"Построено {len(built)} пирамид за {time.perf_counter() - start_time:.2f} с")
+
+# Показываем один файл целиком и с приближением к максимуму тока
+pyramid = load_pyramid(built[0])
+n_pixels = 1500
+t_first = pyramid['t0']
+t_last = pyramid['t0'] + (pyramid['n'] - 1) * pyramid['dt']
+full_times, _, full_max, _, _ = get_view(pyramid, 'i', t_first, t_last, n_pixels)
+peak_time = full_times[np.argmax(full_max)]
+
+fig, axes = plt.subplots(3, 1, figsize=(15, 12))
+for ax, width in zip(axes, [t_last - t_first, 2e-6, 1e-7]):
+    t_start = max(t_first, peak_time - width / 2)
+    t_end = min(t_last, t_start + width)
+    view_start = time.perf_counter()
+    times, mins, maxs, means, level = get_view(pyramid, 'i', t_start, t_end, n_pixels)
+    elapsed = (time.perf_counter() - view_start) * 1000
+    print(f"Диапазон {width * 1e9:.0f} нс: уровень {level}, {len(times)} точек, {elapsed:.2f} мс")
+
+    t_ns = (times - t_start) * 1e9
+    ax.fill_between(t_ns, mins, maxs, color='grey', alpha=0.5, step='mid')
+    ax.plot(t_ns, means, 'k-', linewidth=1)
+    ax.set_xlabel('Время, нс', fontsize=14)
+    ax.set_ylabel('Ток, А', fontsize=14)
+    ax.set_title(f'Уровень пирамиды {level}', fontsize=14)
+    ax.grid(True, linestyle='-', alpha=0.7, which="both")
+
+plt.tight_layout()
+plt.show()
@@ -0,0 +1,173 @@
+"""
+Определяет устойчивые к выбросам пределы для графиков по квантилям (0.1% и 99.9%)
+вместо абсолютных максимума и минимума. Для каждого файла и канала строится
+компактный квантильный эскиз (логарифмическая гистограмма с заданной относительной
+точностью). Эскизы разных файлов складываются, поэтому файлы обрабатываются
+параллельно, а при повторном запуске пересчитываются только новые файлы.
+Пределы сохраняются в robust_limits.json; 3_export_plots.py строит графики по ним,
+если в нем выбран этот файл.
+"""
+
+import numpy as np
+import os
+import json
+from functools import reduce
+from concurrent.futures import ProcessPoolExecutor
+
+
+directory = '../sample_data'
+sketch_file = 'current_sketches.json'
+limits_file = 'robust_limits.json'
+relative_accuracy = 0.005  # Относительная погрешность квантилей
+min_value = 1e-9           # Значения меньше по модулю считаются нулем
+
+
+gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+log_gamma = np.log(gamma)
+
+
+def empty_sketch():
+    return {'positive': {}, 'negative': {}, 'zero': 0, 'count': 0,
+            'min': float('inf'), 'max': -float('inf'), 'sum': 0.0, 'sum_sq': 0.0}
+
+
+def build_sketch(values):
+    """
+    Строит эскиз массива: значение x попадает в корзину ceil(log_gamma(|x|)),
+    отдельно для положительных и отрицательных. Число корзин ограничено
+    диапазоном модулей значений, а не числом точек.
+    """
+    values = np.asarray(values, dtype=float)
+    sketch = empty_sketch()
+    sketch['count'] = int(len(values))
+    sketch['min'] = float(np.min(values))
+    sketch['max'] = float(np.max(values))
+    sketch['sum'] = float(np.sum(values))
+    sketch['sum_sq'] = float(np.sum(values ** 2))
+
+    magnitude = np.abs(values)
+    is_zero = magnitude < min_value
+    sketch['zero'] = int(np.sum(is_zero))
+
+    for sign, mask in (('positive', (values > 0) & ~is_zero), ('negative', (values < 0) & ~is_zero)):
+        keys = np.ceil(np.log(magnitude[mask]) / log_gamma).astype(int)
+        unique_keys, counts = np.unique(keys, return_counts=True)
+        sketch[sign] = {int(k): int(c) for k, c in zip(unique_keys, counts)}
+
+    return sketch
+
+
+def merge_sketches(a, b):
+    """Складывает два эскиза. Операция ассоциативна, поэтому порядок слияния не важен"""
+    merged = empty_sketch()
+    for sign in ('positive', 'negative'):
+        merged[sign] = dict(a[sign])
+        for key, count in b[sign].items():
+            merged[sign][key] = merged[sign].get(key, 0) + count
+    for field in ('zero', 'count', 'sum', 'sum_sq'):
+        merged[field] = a[field] + b[field]
+    merged['min'] = min(a['min'], b['min'])
+    merged['max'] = max(a['max'], b['max'])
+    return merged
+
+
+def sketch_quantiles(sketch, quantiles):
+    """Возвращает значения квантилей с относительной погрешностью relative_accuracy"""
+    negative_keys = sorted(sketch['negative'], reverse=True)  # От больших по модулю к меньшим
+    positive_keys = sorted(sketch['positive'])
+
+    representative = lambda k: 2 * gamma ** k / (gamma + 1)
+    values = np.array([-representative(k) for k in negative_keys] + [0.0] +
+                      [representative(k) for k in positive_keys])
+    counts = np.array([sketch['negative'][k] for k in negative_keys] + [sketch['zero']] +
+                      [sketch['positive'][k] for k in positive_keys])
+    cumulative = np.cumsum(counts)
+
+    ranks = np.asarray(quantiles) * (sketch['count'] - 1)
+    positions = np.searchsorted(cumulative, ranks, side='right')
+    result = values[np.minimum(positions, len(values) - 1)]
+    # Крайние квантили не выходят за реальные минимум и максимум
+    return np.clip(result, sketch['min'], sketch['max'])
+
+
+def sketch_file_channels(filepath):
+    """Строит эскизы тока и напряжения для одного файла. Выполняется в отдельном процессе"""
+    try:
+        with np.load(filepath) as data:
+            raw_data = data['data']
+            return {
+                'current': build_sketch(raw_data[2] / 50),  # Конвертируем в амперы
+                'voltage': build_sketch(raw_data[1])
+            }, None
+    except Exception as e:
+        return None, f"Ошибка при обработке файла {os.path.basename(filepath)}: {e}"
+
+
+def to_json(sketch):
+    return {**sketch, 'positive': {str(k): v for k, v in sketch['positive'].items()},
+            'negative': {str(k): v for k, v in sketch['negative'].items()}}
+
+
+def from_json(sketch):
+    return {**sketch, 'positive': {int(k): v for k, v in sketch['positive'].items()},
+            'negative': {int(k): v for k, v in sketch['negative'].items()}}
+
+
+if __name__ == '__main__':
+    npz_files = [f for f in os.listdir(directory) if f.endswith('.npz')]
+    npz_files.sort()
+
+    # Загружаем эскизы, посчитанные при прошлых запусках
+    cache = {}
+    if os.path.exists(sketch_file):
+        with open(sketch_file, 'r') as f:
+            cache = json.load(f)
+
+    # Файл пересчитывается, только если он новый или изменился
+    def file_key(filename):
+        stat = os.stat(os.path.join(directory, filename))
+        return f"{stat.st_size}_{stat.st_mtime_ns}"
+
+    to_process = [f for f in npz_files if cache.get(f, {}).get('key') != file_key(f)]
+    print(f"Файлов в датасете: {len(npz_files)}, требуют обработки: {len(to_process)}")
+
+    with ProcessPoolExecutor() as executor:
+        paths = [os.path.join(directory, f) for f in to_process]
+        for filename, (sketches, error) in zip(to_process, executor.map(sketch_file_channels, paths)):
+            if error:
+                print(error)
+                continue
+            cache[filename] = {'key': file_key(filename),
+                               'current': to_json(sketches['current']),
+                               'voltage': to_json(sketches['voltage'])}
+
+    with open(sketch_file, 'w') as f:
+        json.dump(cache, f)
+
+    # Сливаем эскизы всех файлов датасета
+    present = [cache[f] for f in npz_files if f in cache]
+    current = reduce(merge_sketches, (from_json(entry['current']) for entry in present), empty_sketch())
+    voltage = reduce(merge_sketches, (from_json(entry['voltage']) for entry in present), empty_sketch())
+
+    for name, unit, sketch in (('Ток', 'А', current), ('Напряжение', 'В', voltage)):
+        mean = sketch['sum'] / sketch['count']
+        std = np.sqrt(max(sketch['sum_sq'] / sketch['count'] - mean ** 2, 0.0))
+        q = sketch_quantiles(sketch, [0.001, 0.01, 0.5, 0.99, 0.999])
+        print(f"{name}: {sketch['count']} точек, среднее {mean:.6g} {unit}, СКО {std:.6g} {unit}")
+        print(f"  мин {sketch['min']:.6g}, 0.1% {q[0]:.6g}, 1% {q[1]:.6g}, медиана {q[2]:.6g}, "
+              f"99% {q[3]:.6g}, 99.9% {q[4]:.6g}, макс {sketch['max']:.6g}")
+
+    # Устойчивые пределы пишутся в отдельный файл с теми же ключами, что и current_limits.json,
+    # чтобы скрипты построения графиков могли читать любой из них
+    low, high = sketch_quantiles(current, [0.001, 0.999])
+    limits = {
+        'max_current': float(high) * 1.05,  # Запас 5%, как в 1_write_max_min.py
+        'min_current': float(low) * 1.05,
+        'max_current_quantile': float(high),
+        'min_current_quantile': float(low)
+    }
+
+    with open(limits_file, 'w') as f:
+        json.dump(limits, f)
+
+    print(f"\nУстойчивые пределы тока (0.1% - 99.9%): {low:.6f} - {high:.6f} А, сохранены в {limits_file}")
@@ -0,0 +1,216 @@
+"""
+Находит импульсы с адаптивными порогами: базовая линия и уровень шума оцениваются
+по блокам через медиану и MAD (медианное абсолютное отклонение), поэтому пороги
+подстраиваются под дрейф базовой линии без ручной настройки для каждого файла.
+"""
+
+import numpy as np
+import os
+from scipy.special import erfinv
+
+
+directory = '../../sample_data'
+npz_files = [f for f in os.listdir(directory) if f.endswith('.npz')]
+npz_files.sort()
+
+
+def quantized_sigma(deviations, mads, step):
+    """
+    СКО шума по блокам с учетом квантования АЦП. Если шум меньше шага АЦП, больше половины
+    точек блока совпадает с медианой, MAD = 0 и ничего не говорит о шуме. Тогда СКО
+    находится по доле p0 точек в центральном уровне: для нормального шума
+    p0 = erf(step / (2 sqrt(2) sigma)). Если шум заметно больше шага, берется 1.4826 * MAD
+    """
+    p0 = np.mean(np.abs(deviations) < step / 2, axis=1)
+    p0 = np.clip(p0, 1e-6, 1 - 1e-6)
+    quantized = step / (2 * np.sqrt(2) * erfinv(p0))
+    return np.where(mads >= step, 1.4826 * mads, quantized)
+
+
+def robust_baseline_and_noise(signal, window=2000, step=None):
+    """
+    Оценивает базовую линию (медиана) и уровень шума (см. quantized_sigma) по блокам
+    из window точек и линейно интерполирует их на каждую точку сигнала.
+    np.median использует алгоритм выбора, а шаг АЦП ищется только по первому блоку,
+    поэтому оценка занимает O(n).
+    """
+    signal = np.asarray(signal)
+    n = len(signal)
+    window = min(window, n)
+    n_full = n // window
+
+    # Шаг АЦП - наименьшая разность уровней в первом блоке (сортируется только он)
+    if step is None:
+        levels = np.unique(signal[:window])
+        gaps = np.diff(levels)
+        gaps = gaps[gaps > 1e-6 * (levels[-1] - levels[0])] if len(gaps) else gaps
+        step = np.min(gaps) if len(gaps) else 1e-12
+
+    # Полные блоки обрабатываем одним вызовом через reshape, без цикла
+    blocks = signal[:n_full * window].reshape(n_full, window)
+    medians = np.median(blocks, axis=1)
+    deviations = blocks - medians[:, None]
+    mads = np.median(np.abs(deviations), axis=1)
+    sigmas = quantized_sigma(deviations, mads, step)
+    centers = np.arange(n_full) * window + (window - 1) / 2
+
+    # Хвост, не вошедший в полные блоки, считаем отдельным блоком
+    if n_full * window < n:
+        tail = signal[n_full * window:]
+        tail_median = np.median(tail)
+        tail_deviations = (tail - tail_median)[None, :]
+        tail_mad = np.median(np.abs(tail_deviations), axis=1)
+        medians = np.append(medians, tail_median)
+        sigmas = np.append(sigmas, quantized_sigma(tail_deviations, tail_mad, step))
+        centers = np.append(centers, (n_full * window + n - 1) / 2)
+
+    positions = np.arange(n)
+    baseline = np.interp(positions, centers, medians)
+    noise = np.interp(positions, centers, sigmas)
+    return baseline, noise
+
+
+def find_impulse_bounds(above_current_threshold, at_noise_level, di_dt, derivative_threshold):
+    """
+    Находит границы импульсов по маскам превышения порога и уровня шума.
+    derivative_threshold - число или массив порогов для каждой точки производной.
+    """
+    derivative_threshold = np.broadcast_to(derivative_threshold, di_dt.shape)
+    impulse_starts = []
+    impulse_ends = []
+    in_impulse = False
+    for idx, (is_above, is_noise) in enumerate(zip(above_current_threshold, at_noise_level)):
+        if is_above and not in_impulse:
+            # Начало импульса найдено по току, ищем точную границу по производной
+            start_idx = idx
+            while start_idx > 0 and np.abs(di_dt[start_idx-1]) > derivative_threshold[start_idx-1]:
+                start_idx -= 1
+            impulse_starts.append(start_idx)
+            in_impulse = True
+        elif (not is_above or is_noise) and in_impulse:
+            # Конец импульса найден по току или возврату к уровню шума
+            end_idx = idx
+            while end_idx < len(di_dt) and np.abs(di_dt[end_idx]) > derivative_threshold[end_idx]:
+                end_idx += 1
+            impulse_ends.append(end_idx)
+            in_impulse = False
+    return impulse_starts, impulse_ends
+
+
+# Поиск импульсов в одном файле: окна (начало, конец) с дополнительными точками
+def find_impulses(filepath, current_threshold=0.001, derivative_threshold=0.0003, noise_threshold=0.0005,
+                  min_duration=10, padding=5, adaptive=False, window=2000,
+                  k_current=8.0, k_noise=4.0, k_derivative=8.0):
+    try:
+        with np.load(filepath) as data:
+            raw_data = data['data']
+            i = raw_data[2] / 50  # Конвертируем в амперы
+    except Exception as e:
+        print(f"Ошибка при загрузке файла {filepath}: {e}")
+        return None, []
+
+    # Вычисляем производную тока
+    di_dt = np.diff(i)
+
+    if adaptive:
+        # Пороги задаются в единицах локального СКО шума относительно локальной базовой линии.
+        # k_current = 8: у нормального шума выброс за 8 СКО бывает с вероятностью ~1e-15 на точку,
+        # то есть ложных срабатываний на шуме нет даже с запасом на негауссовы хвосты.
+        # k_noise = k_current / 2 - то же отношение, что у фиксированных порогов (0.0005 / 0.001).
+        # Производная при одном шаге АЦП скачет на целый шаг, поэтому для нее порог тоже 8 СКО
+        baseline, noise = robust_baseline_and_noise(i, window=window)
+        _, derivative_noise = robust_baseline_and_noise(di_dt, window=window)
+        deviation = np.abs(i - baseline)
+        above_current_threshold = deviation > k_current * noise
+        at_noise_level = deviation <= k_noise * noise
+        derivative_threshold = k_derivative * derivative_noise
+    else:
+        # Находим точки, где ток превышает порог (сам импульс)
+        above_current_threshold = np.abs(i) > current_threshold
+        # Находим точки, где ток возвращается к уровню шума
+        at_noise_level = np.abs(i) <= noise_threshold
+
+    impulse_starts, impulse_ends = find_impulse_bounds(
+        above_current_threshold, at_noise_level, di_dt, derivative_threshold)
+
+    impulses = []
+    for start, end in zip(impulse_starts, impulse_ends):
+        if end - start >= min_duration:
+            padded_start = max(0, start - padding)
+            # Повторное срабатывание внутри импульса дает ту же начальную точку - пропускаем
+            if impulses and impulses[-1][0] == padded_start:
+                continue
+            impulses.append((padded_start, min(len(i), end + padding)))
+    return raw_data, impulses
+
+
+# Обработка одного файла для поиска и сохранения импульсов
+def find_and_save_impulses(filepath, output_dir='saved_impulses', **parameters):
+    raw_data, impulses = find_impulses(filepath, **parameters)
+    if raw_data is None:
+        return 0
+    t = raw_data[0]
+    i = raw_data[2] / 50  # Конвертируем в амперы
+
+    # Сохраняем найденные импульсы с дополнительными точками
+    os.makedirs(output_dir, exist_ok=True)
+    impulse_count = 0
+    for padded_start, padded_end in impulses:
+        impulse_data = {
+            't': t[padded_start:padded_end],
+            'i': i[padded_start:padded_end]
+        }
+
+        # Сохраняем импульс в отдельный файл
+        filename = f"{output_dir}/impulse_{impulse_count:04d}.npz"
+        np.savez(filename, **impulse_data)
+        impulse_count += 1
+
+    print(f"Найдено и сохранено {impulse_count} импульсов в {output_dir}")
+    return impulse_count
+
+
+def count_overlapping(impulses, reference):
+    """Считает, сколько интервалов impulses пересекаются хотя бы с одним интервалом reference"""
+    if not impulses or not reference:
+        return 0
+    starts = np.array([start for start, end in impulses])
+    ends = np.array([end for start, end in impulses])
+    ref_starts = np.array([start for start, end in reference])
+    ref_ends = np.array([end for start, end in reference])
+    # Последний опорный интервал, начавшийся до конца текущего
+    idx = np.searchsorted(ref_starts, ends) - 1
+    valid = idx >= 0
+    return int(np.sum(ref_ends[idx[valid]] > starts[valid]))
+
+
+# Сравниваем фиксированные и адаптивные пороги на всех файлах за один проход
+total_fixed = 0
+total_adaptive = 0
+total_common = 0
+total_found = 0
+noise_levels = []
+for npz_file in npz_files:
+    filepath = os.path.join(directory, npz_file)
+    raw_data, fixed = find_impulses(filepath)
+    if raw_data is None:
+        continue
+    _, adaptive = find_impulses(filepath, adaptive=True)
+    common = count_overlapping(adaptive, fixed)
+    found = count_overlapping(fixed, adaptive)
+    _, noise = robust_baseline_and_noise(raw_data[2] / 50)
+    noise_levels.append(np.median(noise))
+
+    total_fixed += len(fixed)
+    total_adaptive += len(adaptive)
+    total_common += common
+    total_found += found
+    print(f"{npz_file}: фиксированные пороги - {len(fixed)}, адаптивные - {len(adaptive)}, пересекаются с фиксированными - {common}")
+
+print(f"\nВсего импульсов: фиксированные пороги - {total_fixed}, адаптивные - {total_adaptive}, пересекаются с фиксированными - {total_common}")
+print(f"Импульсов фиксированных порогов, найденных и адаптивными: {total_found} ({total_found / max(total_fixed, 1):.1%})")
+print(f"СКО шума (медиана по файлам): {np.median(noise_levels):.2e} А; адаптивный порог тока 8 СКО = {8 * np.median(noise_levels):.2e} А, "
+      f"фиксированный - 0.001 А")
+
+# Сохраняем импульсы первого файла, найденные с адаптивными порогами
+find_and_save_impulses(f"{directory}/{npz_files[0]}", adaptive=True, output_dir='saved_impulses_adaptive')
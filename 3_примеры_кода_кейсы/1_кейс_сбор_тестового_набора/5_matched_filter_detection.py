@@ -0,0 +1,322 @@
+"""
+Ищет импульсы методом согласованного фильтра: строит нормированные шаблоны
+из сохраненных импульсов (saved_impulses) и вычисляет взаимную корреляцию всего
+сигнала с шаблонами через БПФ по методу overlap-save. Выход фильтра делится на
+его СКО на шуме (оценка через MAD в каждом сегменте), и импульсом считается пик
+выше score_threshold СКО любой полярности. Сигнал читается из файла и
+обрабатывается блоками, поэтому его длина не ограничена объемом памяти. Для
+сравнения на тех же файлах запускаются advanced_filter из кейса 2 и пороговый
+детектор из find_and_save_impulses.
+"""
+
+import numpy as np
+import os
+import zipfile
+from scipy.signal import find_peaks
+
+
+directory = '../../sample_data'
+impulse_directory = 'saved_impulses'
+npz_files = [f for f in os.listdir(directory) if f.endswith('.npz')]
+npz_files.sort()
+
+# Порог в СКО выхода фильтра. У нормального шума превышение 8 СКО случается с
+# вероятностью ~1e-15 на точку, то есть на записи из 1e5 точек ложных срабатываний нет
+# даже с запасом на негауссов шум. Импульсы, найденные пороговым детектором,
+# дают на выходе фильтра не меньше ~15 СКО
+score_threshold = 8.0
+block_size = 8192      # Длина блока БПФ; меньше записи, чтобы работала склейка overlap-save
+chunk_size = 20000     # Сколько точек читается из файла за раз
+
+
+def build_templates(impulse_directory, n_templates=2, pre_peak=8, length=32):
+    """
+    Строит n_templates шаблонов длиной length точек: импульсы сортируются по
+    длительности, делятся на группы, выравниваются по пику и усредняются.
+    Каждый шаблон имеет нулевое среднее и единичную норму.
+    """
+    impulses = []
+    for filename in sorted(os.listdir(impulse_directory)):
+        if not filename.endswith('.npz'):
+            continue
+        with np.load(os.path.join(impulse_directory, filename)) as data:
+            impulses.append(data['i'])
+
+    if not impulses:
+        raise ValueError(f"В директории {impulse_directory} нет сохраненных импульсов")
+
+    # Выравниваем импульсы по пику и приводим к одной длине
+    aligned = np.zeros((len(impulses), length))
+    for idx, i in enumerate(impulses):
+        i = i - i[0]  # Убираем базовую линию по первой точке
+        peak = np.argmax(np.abs(i))
+        src_start = max(0, peak - pre_peak)
+        src_end = min(len(i), peak - pre_peak + length)
+        dst_start = src_start - (peak - pre_peak)
+        aligned[idx, dst_start:dst_start + src_end - src_start] = i[src_start:src_end]
+
+    # Группируем по длительности и усредняем внутри группы
+    order = np.argsort([len(i) for i in impulses])
+    groups = np.array_split(order, min(n_templates, len(impulses)))
+    templates = np.array([aligned[group].mean(axis=0) for group in groups])
+
+    templates -= templates.mean(axis=1, keepdims=True)
+    templates /= np.linalg.norm(templates, axis=1, keepdims=True)
+    return templates
+
+
+def iter_current_chunks(filepath, chunk_size):
+    """
+    Читает канал тока из npz по кускам, не загружая файл целиком (как в
+    7_streaming_detectors.py). Для сжатых архивов и массивов в порядке Fortran
+    соседние отсчеты тока не лежат подряд - тогда файл загружается полностью.
+    """
+    with zipfile.ZipFile(filepath) as archive:
+        with archive.open('data.npy') as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if fortran_order or archive.getinfo('data.npy').compress_type != zipfile.ZIP_STORED:
+                f.seek(0)
+                i = np.lib.format.read_array(f)[2] / 50
+                for start in range(0, len(i), chunk_size):
+                    yield i[start:start + chunk_size]
+                return
+
+            n_samples = shape[1]
+            f.seek(f.tell() + 2 * n_samples * dtype.itemsize)  # Пропускаем время и напряжение
+            for start in range(0, n_samples, chunk_size):
+                count = min(chunk_size, n_samples - start)
+                yield np.frombuffer(f.read(count * dtype.itemsize), dtype=dtype) / 50  # Конвертируем в амперы
+
+
+def matched_filter(chunks, templates, block_size=65536):
+    """
+    Вычисляет взаимную корреляцию потока блоков с шаблонами методом overlap-save.
+    Возвращает генератор четверок (позиция начала сегмента, оценки, шаблоны, выход
+    фильтра): оценка - модуль выхода лучшего шаблона в единицах СКО шума.
+    Сложность O(n log m) на точку сигнала, память O(block_size * число шаблонов).
+    """
+    n_templates, m = templates.shape
+    fft_size = 1 << int(np.ceil(np.log2(block_size + m - 1)))
+    step = fft_size - m + 1
+
+    # Спектры шаблонов считаются один раз; корреляция = свертка с перевернутым шаблоном
+    templates_fft = np.fft.rfft(templates[:, ::-1], n=fft_size, axis=1)
+
+    buffer = np.zeros(0)  # Необработанные данные вместе с хвостом m - 1 предыдущих точек
+    position = 0          # Абсолютная позиция первой точки buffer
+
+    def process(segment, segment_position):
+        # Корреляция со всеми шаблонами одним обратным БПФ
+        spectrum = np.fft.rfft(segment, n=fft_size)
+        full = np.fft.irfft(spectrum[None, :] * templates_fft, n=fft_size, axis=1)
+        n_valid = len(segment) - m + 1
+        correlation = full[:, m - 1:m - 1 + n_valid]
+
+        # Шаблоны с нулевым средним и единичной нормой: на белом шуме выход фильтра
+        # имеет то же СКО, что и шум. Оценка через MAD не чувствительна к самим импульсам
+        mads = np.median(np.abs(correlation - np.median(correlation, axis=1, keepdims=True)), axis=1)
+        sigmas = np.maximum(1.4826 * mads, 1e-15)
+        scores = np.abs(correlation) / sigmas[:, None]
+        best = np.argmax(scores, axis=0)
+        columns = np.arange(n_valid)
+        return segment_position, scores[best, columns], best, correlation[best, columns]
+
+    for chunk in chunks:
+        buffer = np.concatenate((buffer, np.asarray(chunk, dtype=float)))
+        while len(buffer) >= fft_size:
+            yield process(buffer[:fft_size], position)
+            # Соседние сегменты перекрываются на m - 1 точку
+            buffer = buffer[step:]
+            position += step
+
+    if len(buffer) >= m:
+        yield process(buffer, position)
+
+
+def detect_impulses(filepath, templates, score_threshold=score_threshold):
+    """
+    Находит позиции импульсов по пикам выхода фильтра выше score_threshold СКО.
+    Возвращает позиции начала окна шаблона, оценки, номера шаблонов и полярность
+    """
+    m = templates.shape[1]
+    positions = []
+    scores = []
+    template_ids = []
+    signs = []
+    try:
+        for block_position, block_scores, block_best, block_output in matched_filter(
+                iter_current_chunks(filepath, chunk_size), templates, block_size=block_size):
+            # Векторный поиск пиков внутри блока
+            peaks, properties = find_peaks(block_scores, height=score_threshold, distance=m)
+            positions.append(block_position + peaks)
+            scores.append(properties['peak_heights'])
+            template_ids.append(block_best[peaks])
+            signs.append(np.sign(block_output[peaks]))
+    except Exception as e:
+        print(f"Ошибка при загрузке файла {filepath}: {e}")
+        return None
+
+    positions = np.concatenate(positions) if positions else np.zeros(0, dtype=int)
+    scores = np.concatenate(scores) if scores else np.zeros(0)
+    template_ids = np.concatenate(template_ids) if template_ids else np.zeros(0, dtype=int)
+    signs = np.concatenate(signs) if signs else np.zeros(0)
+
+    # Пики на стыке блоков могут оказаться ближе m точек. Сравниваем с последним
+    # оставленным пиком, чтобы цепочка близких пиков давала ровно один импульс
+    keep = []
+    for idx in range(len(positions)):
+        if keep and positions[idx] - positions[keep[-1]] < m:
+            if scores[idx] > scores[keep[-1]]:
+                keep[-1] = idx
+        else:
+            keep.append(idx)
+    return positions[keep], scores[keep], template_ids[keep], signs[keep]
+
+
+# Детекторы для сравнения на тех же файлах
+
+def find_threshold_impulses(i, current_threshold=0.001, derivative_threshold=0.0003, noise_threshold=0.0005, min_duration=10, padding=5):
+    """
+    Цикл поиска импульсов из find_and_save_impulses; возвращает окна (начало, конец).
+    Повторные срабатывания внутри одного импульса дают то же начало - они отбрасываются
+    """
+    di_dt = np.diff(i)
+    above_current_threshold = np.abs(i) > current_threshold
+    at_noise_level = np.abs(i) <= noise_threshold
+    impulses = []
+    in_impulse = False
+    for idx, (is_above, is_noise) in enumerate(zip(above_current_threshold, at_noise_level)):
+        if is_above and not in_impulse:
+            start_idx = idx
+            while start_idx > 0 and np.abs(di_dt[start_idx-1]) > derivative_threshold:
+                start_idx -= 1
+            in_impulse = True
+        elif (not is_above or is_noise) and in_impulse:
+            end_idx = idx
+            while end_idx < len(di_dt) and np.abs(di_dt[end_idx]) > derivative_threshold:
+                end_idx += 1
+            in_impulse = False
+
+            if end_idx - start_idx >= min_duration:
+                padded_start = max(0, start_idx - padding)
+                if impulses and impulses[-1][0] == padded_start:
+                    continue
+                impulses.append((padded_start, min(len(i), end_idx + padding)))
+    return impulses
+
+
+def advanced_filter(batch_data):
+    """advanced_filter из кейса 2 (2_advanced_filtering_with_hints.py)"""
+    data = np.asarray(batch_data)
+    data_shifted = data - np.mean(data)
+
+    # Параметры
+    chunk_size = 50
+    overlap = 14
+    q_threshold = 0.007515
+    h_threshold = 0.025
+
+    # Проверяем по амплитуде
+    if np.max(data_shifted) > h_threshold or np.min(data_shifted) < -h_threshold:
+        return True, []
+
+    # Проверяем по площади в сегментах и собираем потенциальные события
+    potential_events = []
+    step = chunk_size - overlap
+    for start in range(0, len(data_shifted) - chunk_size + 1, step):
+        chunk = data_shifted[start:start + chunk_size]
+        area = np.trapezoid(chunk)
+        if abs(area) > q_threshold:
+            potential_events.append([start, start + chunk_size])
+            return True, potential_events
+
+    return False, []
+
+
+templates = build_templates(impulse_directory)
+m = templates.shape[1]
+print(f"Построено {len(templates)} шаблонов длиной {m} точек, порог {score_threshold} СКО")
+
+# Проверка склейки overlap-save: потоковый выход совпадает с прямой корреляцией всей записи
+first_path = os.path.join(directory, npz_files[0])
+segments = list(matched_filter(iter_current_chunks(first_path, chunk_size), templates, block_size=block_size))
+with np.load(first_path) as data:
+    i = data['data'][2] / 50
+direct = np.array([np.correlate(i, template, mode='valid') for template in templates])
+streamed = np.full_like(direct, np.nan)
+for segment_position, _, best, output in segments:
+    # Выход лучшего шаблона сравниваем с прямой корреляцией того же шаблона
+    columns = np.arange(len(output))
+    streamed[best, segment_position + columns] = output
+checked = ~np.isnan(streamed)
+print(f"Сегментов overlap-save на первой записи: {len(segments)}, "
+      f"отличие от прямой корреляции: {np.max(np.abs(streamed[checked] - direct[checked])):.1e}")
+
+# Сравнение на тех же файлах: пороговый детектор - опорный список импульсов
+batch_size = 10000
+overlap = 100
+totals = {'reference': 0, 'found': 0, 'extra': 0, 'batches': 0, 'reference_batches': 0,
+          'advanced_hits': 0, 'matched_hits': 0, 'advanced_flags': 0, 'matched_flags': 0}
+extra_amplitudes = []
+extra_distances = []
+for npz_file in npz_files:
+    filepath = os.path.join(directory, npz_file)
+    detected = detect_impulses(filepath, templates)
+    if detected is None:
+        continue
+    positions, scores, template_ids, signs = detected
+    with np.load(filepath) as data:
+        i = data['data'][2] / 50  # Конвертируем в амперы
+    reference = find_threshold_impulses(i)
+
+    # Импульс найден, если в его окне (с запасом на длину шаблона) есть пик фильтра
+    windows = np.array(reference, dtype=int).reshape(-1, 2)
+    found = np.array([np.any((positions >= start - m) & (positions < end)) for start, end in windows], dtype=bool)
+    covered = np.zeros(len(positions), dtype=bool)
+    for start, end in windows:
+        covered |= (positions >= start - m) & (positions < end)
+    totals['reference'] += len(windows)
+    totals['found'] += int(np.sum(found))
+    totals['extra'] += int(np.sum(~covered))
+    baseline = np.median(i)
+    for p in positions[~covered]:
+        extra_amplitudes.append(np.max(np.abs(i[p:p + m] - baseline)))
+        extra_distances.append(np.min(np.minimum(np.abs(p - windows[:, 1]), np.abs(p + m - windows[:, 0])))
+                               if len(windows) else np.inf)
+
+    # Сравнение с advanced_filter по временным промежуткам, как в кейсе 2
+    for first in range(0, len(i), batch_size):
+        start = max(first - overlap, 0)
+        end = min(first + batch_size + overlap, len(i))
+        has_reference = bool(np.any((windows[:, 1] > start) & (windows[:, 0] < end)))
+        advanced = advanced_filter(i[start:end])[0]
+        matched = bool(np.any((positions + m > start) & (positions < end)))
+        totals['batches'] += 1
+        totals['reference_batches'] += has_reference
+        totals['advanced_hits'] += advanced and has_reference
+        totals['matched_hits'] += matched and has_reference
+        totals['advanced_flags'] += advanced
+        totals['matched_flags'] += matched
+
+    print(f"{npz_file}: пороговый детектор - {len(windows)}, согласованный фильтр - {len(positions)}, "
+          f"из них совпадают {int(np.sum(covered))}")
+
+print(f"\nИмпульсов порогового детектора: {totals['reference']}, найдено согласованным фильтром: {totals['found']} "
+      f"({totals['found'] / max(totals['reference'], 1):.1%})")
+if extra_amplitudes:
+    # Рядом с импульсом - хвост того же импульса; вдали - отдельные импульсы, которые пороговый
+    # детектор пропускает: короче min_duration или ниже порога 0.001 А
+    extra_amplitudes = np.array(extra_amplitudes)
+    near = np.array(extra_distances) < 100
+    print(f"Дополнительно найдено фильтром: {totals['extra']}, из них в пределах 100 точек от импульса "
+          f"порогового детектора: {np.sum(near)}; отдельных: выше 0.001 А (короче min_duration) - "
+          f"{np.sum(~near & (extra_amplitudes >= 0.001))}, ниже 0.001 А - {np.sum(~near & (extra_amplitudes < 0.001))}")
+print(f"Промежутков по {batch_size} точек: {totals['batches']}, с импульсами порогового детектора: {totals['reference_batches']}")
+print(f"  advanced_filter: отмечено {totals['advanced_flags']}, из них с импульсами {totals['advanced_hits']} "
+      f"(чувствительность {totals['advanced_hits'] / max(totals['reference_batches'], 1):.1%})")
+print(f"  согласованный фильтр: отмечено {totals['matched_flags']}, из них с импульсами {totals['matched_hits']} "
+      f"(чувствительность {totals['matched_hits'] / max(totals['reference_batches'], 1):.1%})")
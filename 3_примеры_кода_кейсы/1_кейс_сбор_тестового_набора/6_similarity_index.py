@@ -0,0 +1,204 @@
+"""
+Строит индекс для поиска импульсов, похожих по форме на заданный. Каждый импульс
+приводится к фиксированной длине и нормируется, затем сжимается методом главных
+компонент (PCA) и добавляется в набор KD-деревьев. Индекс пополняется по частям
+(файл за файлом), а запрос проходит по всем частям и возвращает ближайшие импульсы.
+"""
+
+import numpy as np
+import os
+import time
+from scipy.spatial import cKDTree
+
+
+directory = '../../sample_data'
+npz_files = [f for f in os.listdir(directory) if f.endswith('.npz')]
+npz_files.sort()
+
+
+def extract_impulses(filepath, current_threshold=0.001, derivative_threshold=0.0003, noise_threshold=0.0005, min_duration=10, padding=5):
+    """Находит импульсы так же, как find_and_save_impulses, но возвращает их вместо сохранения"""
+    try:
+        with np.load(filepath) as data:
+            raw_data = data['data']
+            i = raw_data[2] / 50  # Конвертируем в амперы
+
+        # Вычисляем производную тока
+        di_dt = np.diff(i)
+        above_current_threshold = np.abs(i) > current_threshold
+        at_noise_level = np.abs(i) <= noise_threshold
+
+        impulses = []
+        in_impulse = False
+        for idx, (is_above, is_noise) in enumerate(zip(above_current_threshold, at_noise_level)):
+            if is_above and not in_impulse:
+                start_idx = idx
+                while start_idx > 0 and np.abs(di_dt[start_idx-1]) > derivative_threshold:
+                    start_idx -= 1
+                in_impulse = True
+            elif (not is_above or is_noise) and in_impulse:
+                end_idx = idx
+                while end_idx < len(di_dt) and np.abs(di_dt[end_idx]) > derivative_threshold:
+                    end_idx += 1
+                in_impulse = False
+
+                if end_idx - start_idx >= min_duration:
+                    padded_start = max(0, start_idx - padding)
+                    padded_end = min(len(i), end_idx + padding)
+                    # Повторное срабатывание внутри импульса дает ту же начальную точку - пропускаем
+                    if impulses and impulses[-1][0] == padded_start:
+                        continue
+                    impulses.append((padded_start, i[padded_start:padded_end]))
+
+        return impulses
+
+    except Exception as e:
+        print(f"Ошибка при загрузке файла {filepath}: {e}")
+        return []
+
+
+def impulse_to_vector(impulse, length=64):
+    """Приводит импульс к length точкам линейной интерполяцией и нормирует по амплитуде"""
+    impulse = np.asarray(impulse, dtype=float)
+    x = np.linspace(0, len(impulse) - 1, length)
+    vector = np.interp(x, np.arange(len(impulse)), impulse)
+    vector -= vector[0]  # Убираем базовую линию
+    amplitude = np.max(np.abs(vector))
+    return vector / amplitude if amplitude > 0 else vector
+
+
+def create_index(length=64, n_components=8, partition_size=10000):
+    """Создает пустой индекс, все его данные хранятся в словаре"""
+    return {
+        'length': length,
+        'n_components': n_components,
+        'partition_size': partition_size,
+        # Накопленные суммы для инкрементального PCA
+        'count': 0,
+        'sum': np.zeros(length),
+        'scatter': np.zeros((length, length)),
+        'mean': None,
+        'basis': None,
+        # Готовые части индекса: KD-дерево и метки импульсов
+        'partitions': [],
+        # Еще не попавшие в дерево проекции (ищутся полным перебором)
+        'pending_points': [],
+        'pending_labels': []
+    }
+
+
+def fit_index(index, vectors):
+    """
+    Пополняет статистику для PCA (сумма и матрица рассеяния) и пересчитывает базис.
+    Вызывается до добавления импульсов: после первого add_to_index базис фиксируется,
+    иначе проекции в уже построенных деревьях станут несовместимы с новыми.
+    """
+    if index['partitions'] or index['pending_points']:
+        raise RuntimeError("Базис PCA нельзя менять после добавления импульсов в индекс")
+
+    vectors = np.asarray(vectors)
+    index['count'] += len(vectors)
+    index['sum'] += vectors.sum(axis=0)
+    index['scatter'] += vectors.T @ vectors
+
+    mean = index['sum'] / index['count']
+    covariance = index['scatter'] / index['count'] - np.outer(mean, mean)
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+
+    # eigh возвращает собственные значения по возрастанию - берем последние
+    index['mean'] = mean
+    index['basis'] = eigenvectors[:, ::-1][:, :index['n_components']]
+    return eigenvalues[::-1][:index['n_components']] / np.sum(eigenvalues)
+
+
+def build_partition(index):
+    """Строит KD-дерево из накопленных проекций"""
+    points = np.concatenate(index['pending_points'])
+    labels = [label for batch in index['pending_labels'] for label in batch]
+
+    # Сливаем с предыдущими частями не большего размера, чтобы число деревьев
+    # росло логарифмически с числом импульсов и запрос оставался быстрым
+    while index['partitions'] and index['partitions'][-1][0].n <= len(points):
+        tree, previous_labels = index['partitions'].pop()
+        points = np.concatenate((tree.data, points))
+        labels = previous_labels + labels
+
+    index['partitions'].append((cKDTree(points), labels))
+    index['pending_points'] = []
+    index['pending_labels'] = []
+
+
+def add_to_index(index, vectors, labels):
+    """Проецирует импульсы на базис PCA и добавляет их в индекс"""
+    if len(vectors) == 0:
+        return
+    points = (np.asarray(vectors) - index['mean']) @ index['basis']
+    index['pending_points'].append(points)
+    index['pending_labels'].append(list(labels))
+
+    # Как только накопилось достаточно точек, строим из них новую часть индекса
+    if sum(len(p) for p in index['pending_points']) >= index['partition_size']:
+        build_partition(index)
+
+
+def query_index(index, vector, k=5):
+    """Возвращает k ближайших импульсов в виде списка (расстояние, метка)"""
+    point = (np.asarray(vector) - index['mean']) @ index['basis']
+    candidates = []
+
+    for tree, labels in index['partitions']:
+        distances, positions = tree.query(point, k=min(k, tree.n))
+        for distance, position in zip(np.atleast_1d(distances), np.atleast_1d(positions)):
+            candidates.append((distance, labels[position]))
+
+    if index['pending_points']:
+        points = np.concatenate(index['pending_points'])
+        labels = [label for batch in index['pending_labels'] for label in batch]
+        distances = np.linalg.norm(points - point, axis=1)
+        for position in np.argsort(distances)[:k]:
+            candidates.append((distances[position], labels[position]))
+
+    candidates.sort(key=lambda item: item[0])
+    return candidates[:k]
+
+
+# Извлекаем импульсы из всех файлов
+impulses_by_file = []
+for npz_file in npz_files:
+    impulses = extract_impulses(os.path.join(directory, npz_file))
+    vectors = np.array([impulse_to_vector(impulse) for _, impulse in impulses])
+    labels = [(npz_file, position) for position, _ in impulses]
+    impulses_by_file.append((vectors, labels))
+
+index = create_index(partition_size=200)
+
+# Базис PCA строим по первым пяти файлам с импульсами, остальные файлы только добавляем
+explained = None
+fitted_files = 0
+for vectors, labels in impulses_by_file:
+    if fitted_files == 5:
+        break
+    if len(vectors):
+        explained = fit_index(index, vectors)
+        fitted_files += 1
+if explained is None:
+    print("Ни в одном файле не найдено импульсов - индекс не построен")
+    exit(0)
+print(f"Доля дисперсии, объясненная {index['n_components']} компонентами: {np.sum(explained):.3f}")
+
+for vectors, labels in impulses_by_file:
+    add_to_index(index, vectors, labels)
+
+total = sum(len(labels) for _, labels in impulses_by_file)
+print(f"В индексе {total} импульсов, частей индекса: {len(index['partitions'])}")
+
+# Ищем импульсы, похожие на первый импульс первого файла
+query_vectors, query_labels = next((v, l) for v, l in impulses_by_file if len(v))
+start_time = time.perf_counter()
+neighbours = query_index(index, query_vectors[0], k=5)
+elapsed = time.perf_counter() - start_time
+
+print(f"\nИмпульсы, похожие на импульс из {query_labels[0][0]} (позиция {query_labels[0][1]}):")
+for distance, (filename, position) in neighbours:
+    print(f"  {filename}, позиция {position}, расстояние {distance:.4f}")
+print(f"Время запроса: {elapsed * 1000:.2f} мс")
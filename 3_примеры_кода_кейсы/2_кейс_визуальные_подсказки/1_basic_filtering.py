@@ -45,7 +45,7 @@ def simple_filter(batch_data):
     step = chunk_size - overlap
     for start in range(0, len(data_shifted) - chunk_size + 1, step):
         chunk = data_shifted[start:start + chunk_size]
-        area = np.trapz(chunk)
+        area = np.trapezoid(chunk)
         if abs(area) > q_threshold:
             return True
     return False
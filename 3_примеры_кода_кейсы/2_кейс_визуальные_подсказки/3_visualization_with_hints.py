@@ -46,7 +46,7 @@ def advanced_filter(batch_data):
     step = chunk_size - overlap
     for start in range(0, len(data_shifted) - chunk_size + 1, step):
         chunk = data_shifted[start:start + chunk_size]
-        area = np.trapz(chunk)
+        area = np.trapezoid(chunk)
         if abs(area) > q_threshold:
             potential_events.append([start, start + chunk_size])
             return True, potential_events
@@ -0,0 +1,114 @@
+"""
+Сшивает события, найденные в отдельных временных промежутках. Локальные индексы
+событий переводятся в абсолютные позиции в файле, после чего пересекающиеся
+интервалы объединяются за один проход по отсортированному списку. Так события
+в зоне перекрытия не считаются дважды, а импульсы на границе промежутков не
+разрезаются, и число событий не зависит от размера промежутка.
+"""
+
+import numpy as np
+import os
+
+
+def split_experimental_data_into_batches(data, batch_size, overlap=0):
+    batches = []
+    data_length = len(data['t'])
+
+    for i in range(0, data_length, batch_size):
+        start = max(i - overlap, 0)
+        end = min(i + batch_size + overlap, data_length)
+
+        batch = {
+            't': data['t'][start:end],
+            'v': data['v'][start:end],
+            'i': data['i'][start:end],
+            'batch_index': len(batches),
+            'start': start  # Абсолютная позиция первой точки промежутка
+        }
+        batches.append(batch)
+
+    return batches
+
+
+def find_events_in_batch(batch_data, current_threshold=0.001, padding=5):
+    """
+    Находит участки, где ток превышает порог, и возвращает их локальные границы
+    [start, end) с запасом padding точек, обрезанным по краям промежутка.
+    """
+    data = np.asarray(batch_data)
+    above = np.abs(data) > current_threshold
+
+    # Границы участков находим по изменению маски, без цикла по точкам
+    edges = np.diff(above.astype(np.int8), prepend=0, append=0)
+    starts = np.nonzero(edges == 1)[0]
+    ends = np.nonzero(edges == -1)[0]
+
+    starts = np.maximum(starts - padding, 0)
+    ends = np.minimum(ends + padding, len(data))
+    return np.column_stack((starts, ends))
+
+
+def merge_events(starts, ends, gap=0):
+    """
+    Объединяет интервалы [start, end), которые пересекаются или отстоят не более
+    чем на gap точек. Один проход по отсортированным интервалам: новая группа
+    начинается там, где начало интервала дальше максимального конца всех предыдущих.
+    """
+    starts = np.asarray(starts)
+    ends = np.asarray(ends)
+    if len(starts) == 0:
+        return np.zeros((0, 2), dtype=int)
+
+    order = np.argsort(starts, kind='stable')
+    starts = starts[order]
+    ends = ends[order]
+
+    running_end = np.maximum.accumulate(ends)
+    new_group = np.ones(len(starts), dtype=bool)
+    new_group[1:] = starts[1:] > running_end[:-1] + gap
+    group_starts = np.nonzero(new_group)[0]
+
+    merged_starts = starts[group_starts]
+    merged_ends = np.maximum.reduceat(ends, group_starts)
+    return np.column_stack((merged_starts, merged_ends))
+
+
+def stitch_batch_events(batches, detector):
+    """Запускает detector в каждом промежутке и сшивает события в абсолютных позициях"""
+    all_events = [detector(batch['i']) + batch['start'] for batch in batches]
+    all_events = np.concatenate(all_events) if all_events else np.zeros((0, 2), dtype=int)
+    return merge_events(all_events[:, 0], all_events[:, 1]), len(all_events)
+
+
+directory = '../../sample_data'
+
+# Загружаем данные
+npz_files = [f for f in os.listdir(directory) if f.endswith('.npz')]
+npz_files.sort()
+filepath = os.path.join(directory, npz_files[0])
+
+try:
+    with np.load(filepath) as data:
+        raw_data = data['data']
+        t = raw_data[0]
+        v = raw_data[1]
+        i = raw_data[2] / 50
+
+    # Эталон - поиск событий сразу во всем файле
+    reference = find_events_in_batch(i)
+    reference = merge_events(reference[:, 0], reference[:, 1])
+    print(f"Весь файл целиком: {len(reference)} событий")
+
+    # Сшитые события не зависят от размера временного промежутка
+    for batch_size in [1000, 10000, 50000]:
+        batches = split_experimental_data_into_batches({
+            't': t, 'v': v, 'i': i
+        }, batch_size=batch_size, overlap=100)
+
+        events, raw_count = stitch_batch_events(batches, find_events_in_batch)
+        same = np.array_equal(events, reference)
+        print(f"Размер промежутка {batch_size}: до сшивки {raw_count} событий, после - {len(events)}, "
+              f"{'совпадает' if same else 'не совпадает'} с эталоном")
+
+except Exception as e:
+    print(f"Ошибка при загрузке файла {filepath}: {e}")
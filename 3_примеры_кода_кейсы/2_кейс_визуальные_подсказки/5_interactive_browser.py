@@ -0,0 +1,239 @@
+"""
+Интерактивный просмотр временных промежутков с потенциальными импульсами или
+срезанных импульсов. Оси создаются один раз, при переходе меняются только данные
+линии и выделенной области, а перерисовка идет через blitting. Следующее окно
+готовится в фоновом потоке, пока просматривается текущее.
+
+Управление: → или пробел - следующее окно, ← - предыдущее, q - выход.
+"""
+
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.patches import Rectangle
+from concurrent.futures import ThreadPoolExecutor
+import os
+import json
+
+
+directory = '../../sample_data'
+mode = 'windows'  # 'windows' - промежутки с подсказками, 'clipped' - срезанные импульсы
+
+
+def split_experimental_data_into_batches(data, batch_size, overlap=0):
+    batches = []
+    data_length = len(data['t'])
+
+    for i in range(0, data_length, batch_size):
+        start = max(i - overlap, 0)
+        end = min(i + batch_size + overlap, data_length)
+
+        batch = {
+            't': data['t'][start:end],
+            'v': data['v'][start:end],
+            'i': data['i'][start:end],
+            'batch_index': len(batches)
+        }
+        batches.append(batch)
+
+    return batches
+
+
+def advanced_filter(batch_data):
+    data = np.asarray(batch_data)
+    data_shifted = data - np.mean(data)
+
+    # Параметры
+    chunk_size = 50
+    overlap = 14
+    q_threshold = 0.007515
+    h_threshold = 0.025
+
+    # Проверяем по амплитуде
+    if np.max(data_shifted) > h_threshold or np.min(data_shifted) < -h_threshold:
+        return True, []
+
+    # Проверяем по площади в сегментах и собираем потенциальные события
+    potential_events = []
+    step = chunk_size - overlap
+    for start in range(0, len(data_shifted) - chunk_size + 1, step):
+        chunk = data_shifted[start:start + chunk_size]
+        area = np.trapezoid(chunk)
+        if abs(area) > q_threshold:
+            potential_events.append([start, start + chunk_size])
+            return True, potential_events
+
+    return False, []
+
+
+def load_global_maximum():
+    """Загружает глобальный максимум из файла limits"""
+    try:
+        with open('../../2_примеры_кода_визуальный_анализ/current_limits.json', 'r') as f:
+            limits = json.load(f)
+        return limits['max_current_actual']
+    except Exception as e:
+        print(f"Ошибка при загрузке глобального максимума: {e}")
+        return None
+
+
+def load_current(filepath):
+    with np.load(filepath) as data:
+        raw_data = data['data']
+        return raw_data[0], raw_data[1], raw_data[2] / 50  # Конвертируем в амперы
+
+
+def iter_flagged_windows(npz_files, batch_size=1000):
+    """Отдает временные промежутки, в которых advanced_filter нашел потенциальные импульсы"""
+    for npz_file in npz_files:
+        try:
+            t, v, i = load_current(os.path.join(directory, npz_file))
+        except Exception as e:
+            print(f"Ошибка при загрузке файла {npz_file}: {e}")
+            continue
+
+        batches = split_experimental_data_into_batches({
+            't': t, 'v': v, 'i': i
+        }, batch_size=batch_size, overlap=100)
+
+        for batch in batches:
+            verdict, potential_events = advanced_filter(batch['i'])
+            if not verdict:
+                continue
+            t_ns = (batch['t'] - batch['t'][0]) * 1e9
+            spans = [(t_ns[start], t_ns[min(end, len(t_ns) - 1)]) for start, end in potential_events]
+            yield {
+                't_ns': t_ns,
+                'i': batch['i'],
+                'spans': spans,
+                'title': f"{npz_file}, промежуток {batch['batch_index']}"
+            }
+
+
+def iter_clipped_events(npz_files, global_max, min_plateau_length=3, margin=100):
+    """Отдает окрестности срезанных импульсов (плато на уровне глобального максимума)"""
+    for npz_file in npz_files:
+        try:
+            t, v, i = load_current(os.path.join(directory, npz_file))
+        except Exception as e:
+            print(f"Ошибка при загрузке файла {npz_file}: {e}")
+            continue
+
+        # Границы плато находим по изменению маски
+        clipped_points = np.isclose(i, global_max, rtol=1e-10, atol=1e-15)
+        edges = np.diff(clipped_points.astype(np.int8), prepend=0, append=0)
+        starts = np.nonzero(edges == 1)[0]
+        ends = np.nonzero(edges == -1)[0]
+
+        for start, end in zip(starts, ends):
+            if end - start < min_plateau_length:
+                continue
+            start_show = max(0, start - margin)
+            end_show = min(len(t), end + margin)
+            t_ns = (t[start_show:end_show] - t[start_show]) * 1e9
+            yield {
+                't_ns': t_ns,
+                'i': i[start_show:end_show],
+                'spans': [(t_ns[start - start_show], t_ns[end - 1 - start_show])],
+                'title': f"{npz_file}, срез {start} - {end}"
+            }
+
+
+def browse(items, y_limits):
+    """Показывает окна из итератора items в одной фигуре с blitting и предзагрузкой"""
+    fig, ax = plt.subplots(figsize=(15, 6))
+    line, = ax.plot([], [], 'k-', linewidth=3, animated=True)
+    span = Rectangle((0, 0), 0, 1, transform=ax.get_xaxis_transform(),
+                     color='black', alpha=0.3, animated=True)
+    ax.add_patch(span)
+    label = ax.text(0.01, 0.97, '', transform=ax.transAxes, verticalalignment='top',
+                    fontsize=16, animated=True)
+
+    ax.set_xlabel('Время, нс', fontsize=20)
+    ax.set_ylabel('Ток, А', fontsize=20)
+    ax.set_ylim(*y_limits)
+    ax.tick_params(axis='both', labelsize=20)
+    ax.grid(True, linestyle='-', alpha=0.7, which="both")
+    plt.subplots_adjust(bottom=0.15, top=0.95)
+
+    # Следующее окно готовится в фоновом потоке
+    executor = ThreadPoolExecutor(max_workers=1)
+    state = {
+        'history': [],
+        'position': -1,
+        'background': None,
+        'pending': executor.submit(next, items, None)
+    }
+
+    def draw_animated():
+        ax.draw_artist(span)
+        ax.draw_artist(line)
+        ax.draw_artist(label)
+
+    def on_draw(event):
+        # После полной перерисовки запоминаем фон без анимируемых объектов
+        state['background'] = fig.canvas.copy_from_bbox(fig.bbox)
+        draw_animated()
+
+    def show(item):
+        line.set_data(item['t_ns'], item['i'])
+        if item['spans']:
+            start_time, end_time = item['spans'][0]
+            span.set_x(start_time)
+            span.set_width(end_time - start_time)
+            span.set_visible(True)
+        else:
+            span.set_visible(False)
+        label.set_text(item['title'])
+
+        xlim = (item['t_ns'][0], item['t_ns'][-1])
+        if state['background'] is None or ax.get_xlim() != xlim:
+            # Изменился масштаб оси - нужна полная перерисовка, фон обновится в on_draw
+            ax.set_xlim(*xlim)
+            fig.canvas.draw_idle()
+        else:
+            fig.canvas.restore_region(state['background'])
+            draw_animated()
+            fig.canvas.blit(fig.bbox)
+            fig.canvas.flush_events()
+
+    def step(direction):
+        position = state['position'] + direction
+        if position < 0:
+            return
+        if position == len(state['history']):
+            item = state['pending'].result()
+            if item is None:
+                print("Больше окон нет")
+                return
+            state['history'].append(item)
+            state['pending'] = executor.submit(next, items, None)
+        state['position'] = position
+        show(state['history'][position])
+
+    def on_key(event):
+        if event.key in ('right', ' '):
+            step(1)
+        elif event.key == 'left':
+            step(-1)
+        elif event.key == 'q':
+            plt.close(fig)
+
+    fig.canvas.mpl_connect('draw_event', on_draw)
+    fig.canvas.mpl_connect('key_press_event', on_key)
+    step(1)
+    plt.show()
+    executor.shutdown(wait=False, cancel_futures=True)
+    return state
+
+
+npz_files = [f for f in os.listdir(directory) if f.endswith('.npz')]
+npz_files.sort()
+
+if mode == 'clipped':
+    global_max = load_global_maximum()
+    if global_max is None:
+        print("Не удалось загрузить глобальный максимум. Завершение работы.")
+        exit(1)
+    browse(iter_clipped_events(npz_files, global_max), y_limits=(-0.004, global_max * 1.05))
+else:
+    browse(iter_flagged_windows(npz_files), y_limits=(-0.004, 0.009))
@@ -0,0 +1,288 @@
+"""
+Восстанавливает истинную амплитуду и заряд срезанных импульсов по несрезанным фронтам.
+В модели импульса из кейса 4 нарастание и спад экспоненциальные, поэтому в логарифме
+тока каждый фронт - прямая. Прямые подбираются взвешенным методом наименьших квадратов
+по точкам фронтов сразу для всех срезанных импульсов кампании, а их пересечение дает
+время и амплитуду пика. Время нарастания и спада (10-90%) считается по линейной
+интерполяции между отсчетами, а уровни выше предела шкалы берутся из модели.
+"""
+
+import numpy as np
+import matplotlib.pyplot as plt
+import os
+import csv
+import json
+
+
+directory = '../../sample_data'
+synthetic_directory = '../../4_примеры_кода_производительность/synthetic_data'  # Создается 2_generate_synthetic_data.py
+min_plateau_length = 3
+flank_length = 50      # Сколько точек с каждой стороны плато берется для анализа
+fit_fraction = 0.3     # Для подбора прямых берутся точки фронта выше этой доли предела шкалы
+charge_fraction = 0.05  # Заряд считается по точкам, где ток выше этой доли предела шкалы
+
+
+def load_global_maximum():
+    """Загружает глобальный максимум из файла limits"""
+    try:
+        with open('../../2_примеры_кода_визуальный_анализ/current_limits.json', 'r') as f:
+            limits = json.load(f)
+        return limits['max_current_actual']
+    except Exception as e:
+        print(f"Ошибка при загрузке глобального максимума: {e}")
+        return None
+
+
+def find_plateaus(i, rail):
+    """Последовательности из min_plateau_length и более точек на пределе шкалы"""
+    clipped = np.isclose(i, rail, rtol=1e-10, atol=1e-15)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], clipped.astype(np.int8), [0]))))
+    runs = edges.reshape(-1, 2)
+    return runs[runs[:, 1] - runs[:, 0] >= min_plateau_length]
+
+
+def collect_flanks(i, plateaus):
+    """
+    Вырезает фронты вокруг каждого плато: rise[:, j] - j-я точка перед плато,
+    fall[:, j] - j-я точка после плато (обе по направлению от плато). За границами
+    записи - NaN.
+    """
+    padded = np.concatenate((np.full(flank_length, np.nan), i, np.full(flank_length, np.nan)))
+    offsets = np.arange(flank_length)
+    starts = plateaus[:, 0] + flank_length
+    ends = plateaus[:, 1] + flank_length
+    rise = padded[starts[:, None] - 1 - offsets[None, :]]
+    fall = padded[ends[:, None] + offsets[None, :]]
+    return rise, fall
+
+
+def contiguous(mask):
+    """Оставляет только точки, идущие подряд от плато"""
+    return np.logical_and.accumulate(mask, axis=1)
+
+
+def fit_lines(x, values, mask):
+    """Взвешенная прямая ln(i) = a + s*x по отмеченным точкам каждой строки"""
+    # Шум в логарифме обратно пропорционален току, поэтому вес - квадрат тока
+    w = np.where(mask, values, 0.0) ** 2
+    y = np.log(np.where(mask, values, 1.0))
+    sw = w.sum(axis=1)
+    sx = (w * x).sum(axis=1)
+    sy = (w * y).sum(axis=1)
+    sxx = (w * x * x).sum(axis=1)
+    sxy = (w * x * y).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (sw * sxy - sx * sy) / (sw * sxx - sx ** 2)
+        intercept = (sy - slope * sx) / sw
+    valid = mask.sum(axis=1) >= 2
+    return np.where(valid, intercept, np.nan), np.where(valid, slope, np.nan)
+
+
+def crossings(values, x, edge_x, edge_value, level):
+    """
+    Положение (в отсчетах) первого пересечения уровня level при движении от плато,
+    с линейной интерполяцией между соседними отсчетами
+    """
+    below = values < level[:, None]
+    found = below.any(axis=1)
+    j = np.argmax(below, axis=1)
+    rows = np.arange(len(values))
+    previous_value = np.where(j > 0, values[rows, j - 1], edge_value)
+    previous_x = np.where(j > 0, x[rows, j - 1], edge_x)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = (previous_value - level) / (previous_value - values[rows, j])
+    position = previous_x + fraction * (x[rows, j] - previous_x)
+    return np.where(found & (previous_value >= level), position, np.nan)
+
+
+def reconstruct(rise, fall, plateau_lengths, rail, dt):
+    """Восстанавливает параметры всех срезанных импульсов одним векторным расчетом"""
+    n = len(plateau_lengths)
+    offsets = np.arange(flank_length)
+    # Координата x в отсчетах от первой точки плато
+    rise_x = np.broadcast_to(-1.0 - offsets, (n, flank_length))
+    fall_x = plateau_lengths[:, None] + offsets[None, :].astype(float)
+
+    rise_fit = contiguous((rise > fit_fraction * rail) & (rise < rail))
+    fall_fit = contiguous((fall > fit_fraction * rail) & (fall < rail))
+    a_rise, s_rise = fit_lines(rise_x, rise, rise_fit)
+    a_fall, s_fall = fit_lines(fall_x, fall, fall_fit)
+
+    # Пересечение прямых фронтов - пик импульса
+    with np.errstate(divide='ignore', invalid='ignore'):
+        peak_x = (a_fall - a_rise) / (s_rise - s_fall)
+    log_amplitude = a_rise + s_rise * peak_x
+    valid = (s_rise > 0) & (s_fall < 0) & np.isfinite(log_amplitude)
+    # Шум может дать пик чуть ниже предела шкалы - тогда амплитуда не меньше предела
+    amplitude = np.where(valid, np.maximum(np.exp(np.where(valid, log_amplitude, 0.0)), rail), np.nan)
+
+    # Точки плато заменяются моделью: минимум двух прямых в логарифме
+    max_plateau = plateau_lengths.max()
+    plateau_x = np.arange(max_plateau, dtype=float)[None, :]
+    on_plateau = plateau_x < plateau_lengths[:, None]
+    model = np.exp(np.minimum(a_rise[:, None] + s_rise[:, None] * plateau_x,
+                              a_fall[:, None] + s_fall[:, None] * plateau_x))
+    plateau = np.where(valid[:, None], np.maximum(model, rail), rail)
+
+    charge_rise = contiguous(rise > charge_fraction * rail)
+    charge_fall = contiguous(fall > charge_fraction * rail)
+    flanks_sum = np.where(charge_rise, rise, 0.0).sum(axis=1) + np.where(charge_fall, fall, 0.0).sum(axis=1)
+    clipped_charge = (flanks_sum + rail * plateau_lengths) * dt
+    charge = (flanks_sum + np.where(on_plateau, plateau, 0.0).sum(axis=1)) * dt
+
+    # Уровни 10% и 90%: ниже предела - по отсчетам, выше - по прямым модели
+    times = {}
+    rise_edge_x = np.zeros(n)
+    fall_edge_x = plateau_lengths - 1.0
+    for name, fraction in (('10', 0.1), ('90', 0.9)):
+        level = fraction * amplitude
+        with np.errstate(divide='ignore', invalid='ignore'):
+            model_rise = (np.log(level) - a_rise) / s_rise
+            model_fall = (np.log(level) - a_fall) / s_fall
+        measured_rise = crossings(rise, rise_x, rise_edge_x, rail, level)
+        measured_fall = crossings(fall, fall_x, fall_edge_x, rail, level)
+        times['rise_' + name] = np.where(level < rail, measured_rise, model_rise)
+        times['fall_' + name] = np.where(level < rail, measured_fall, model_fall)
+
+    return {
+        'amplitude': amplitude,
+        'peak_x': peak_x,
+        'rise_time': (times['rise_90'] - times['rise_10']) * dt,
+        'fall_time': (times['fall_10'] - times['fall_90']) * dt,
+        'charge': charge,
+        'clipped_charge': clipped_charge,
+        'rise_slope': s_rise,
+        'fall_slope': s_fall,
+        'valid': valid
+    }
+
+
+def collect_campaign(data_directory, rail):
+    """Находит плато во всех файлах и собирает их фронты в общие массивы"""
+    npz_files = [f for f in os.listdir(data_directory) if f.endswith('.npz')]
+    npz_files.sort()
+
+    events = []
+    rises = []
+    falls = []
+    dt = None
+    for npz_file in npz_files:
+        try:
+            with np.load(os.path.join(data_directory, npz_file)) as data:
+                raw_data = data['data']
+                t = raw_data[0]
+                i = raw_data[2] / 50  # Конвертируем в амперы
+        except Exception as e:
+            print(f"Ошибка при загрузке файла {npz_file}: {e}")
+            continue
+
+        plateaus = find_plateaus(i, rail)
+        if len(plateaus) == 0:
+            continue
+        dt = t[1] - t[0]
+        rise, fall = collect_flanks(i, plateaus)
+        rises.append(rise)
+        falls.append(fall)
+        events.extend((npz_file, int(start), int(end)) for start, end in plateaus)
+
+    if not events:
+        return [], None, None, None
+    return events, np.vstack(rises), np.vstack(falls), dt
+
+
+def print_results(events, results):
+    print(f"Срезанных импульсов: {len(events)}, восстановлено: {np.sum(results['valid'])}")
+    for (filename, start, end), amplitude, charge, clipped_charge, rise_time, fall_time in zip(
+            events[:5], results['amplitude'], results['charge'], results['clipped_charge'],
+            results['rise_time'], results['fall_time']):
+        print(f"  {filename} [{start}:{end}]: амплитуда {amplitude:.6f} А, "
+              f"заряд {charge * 1e12:.2f} пКл (со срезом {clipped_charge * 1e12:.2f} пКл), "
+              f"нарастание {rise_time * 1e9:.2f} нс, спад {fall_time * 1e9:.2f} нс")
+
+    valid = results['valid']
+    if np.any(valid):
+        print("Статистика по восстановленным импульсам:")
+        print(f"  Медианная амплитуда: {np.median(results['amplitude'][valid]):.6f} А")
+        print(f"  Медианное отношение амплитуды к пределу: {np.median(results['amplitude'][valid] / global_max):.2f}")
+        print(f"  Медианная доля заряда, потерянная из-за среза: "
+              f"{np.median(1 - results['clipped_charge'][valid] / results['charge'][valid]):.1%}")
+        print(f"  Медианное время нарастания: {np.nanmedian(results['rise_time'][valid]) * 1e9:.2f} нс")
+        print(f"  Медианное время спада: {np.nanmedian(results['fall_time'][valid]) * 1e9:.2f} нс")
+
+
+global_max = load_global_maximum()
+if global_max is None:
+    print("Не удалось загрузить глобальный максимум. Завершение работы.")
+    exit(1)
+
+print(f"Используем глобальный максимум: {global_max:.6f} А")
+
+events, rise, fall, dt = collect_campaign(directory, global_max)
+if not events:
+    print("Срезанные импульсы не найдены ни в одном файле")
+    exit(0)
+
+plateau_lengths = np.array([end - start for _, start, end in events])
+results = reconstruct(rise, fall, plateau_lengths, global_max, dt)
+print_results(events, results)
+
+# Проверка на синтетических данных, где известны истинные параметры импульсов
+truth_path = os.path.join(synthetic_directory, 'ground_truth.csv')
+if os.path.exists(truth_path):
+    with open(truth_path, 'r') as f:
+        truth = {(row['file'], int(row['peak_index'])): row for row in csv.DictReader(f)}
+
+    synthetic_events, synthetic_rise, synthetic_fall, synthetic_dt = collect_campaign(synthetic_directory, global_max)
+    if synthetic_events:
+        synthetic_lengths = np.array([end - start for _, start, end in synthetic_events])
+        synthetic_results = reconstruct(synthetic_rise, synthetic_fall, synthetic_lengths, global_max, synthetic_dt)
+
+        # Для экспоненциальных фронтов время 10-90% равно ln(9), умноженному на постоянную времени
+        errors = {'амплитуды': [], 'времени нарастания': [], 'времени спада': []}
+        for (filename, start, end), amplitude, rise_time, fall_time in zip(
+                synthetic_events, synthetic_results['amplitude'],
+                synthetic_results['rise_time'], synthetic_results['fall_time']):
+            # Сопоставляем плато с истинным пиком в том же файле
+            for peak in range(start - 2, end + 2):
+                if (filename, peak) in truth and np.isfinite(amplitude):
+                    row = truth[(filename, peak)]
+                    errors['амплитуды'].append(amplitude / float(row['amplitude']) - 1)
+                    errors['времени нарастания'].append(rise_time / (np.log(9) * float(row['rise_time'])) - 1)
+                    errors['времени спада'].append(fall_time / (np.log(9) * float(row['fall_time'])) - 1)
+                    break
+        if errors['амплитуды']:
+            print(f"\nСинтетические данные: {len(synthetic_events)} срезанных импульсов, "
+                  f"сопоставлено {len(errors['амплитуды'])}")
+            for name, values in errors.items():
+                values = np.abs(values)
+                print(f"  Медианная ошибка {name}: {np.nanmedian(values):.1%}, "
+                      f"90-й процентиль: {np.nanpercentile(values, 90):.1%}")
+
+# Показываем первый восстановленный импульс
+first = np.flatnonzero(results['valid'])
+if len(first):
+    n = first[0]
+    filename, start, end = events[n]
+    with np.load(os.path.join(directory, filename)) as data:
+        raw_data = data['data']
+        t = raw_data[0]
+        i = raw_data[2] / 50
+
+    window = slice(max(0, start - 20), min(len(i), end + 20))
+    x = np.arange(window.start, window.stop) - start
+    model = np.exp(np.minimum(np.log(results['amplitude'][n]) + results['rise_slope'][n] * (x - results['peak_x'][n]),
+                              np.log(results['amplitude'][n]) + results['fall_slope'][n] * (x - results['peak_x'][n])))
+
+    plt.figure(figsize=(15, 6))
+    plt.plot(x * dt * 1e9, i[window], 'k-', linewidth=3, label='Измеренный ток')
+    plt.plot(x * dt * 1e9, model, 'k:', linewidth=2, label='Восстановленный импульс')
+    plt.axhline(global_max, color='k', linestyle='--', linewidth=1, label='Предел шкалы')
+    plt.ylim(-0.1 * results['amplitude'][n], 1.1 * results['amplitude'][n])
+    plt.xlabel('Время от начала среза, нс', fontsize=20)
+    plt.ylabel('Ток, А', fontsize=20)
+    plt.title(f'Восстановление срезанного импульса ({filename})', fontsize=18)
+    plt.legend(loc='upper right', fontsize=16)
+    plt.grid(True, linestyle='-', alpha=0.7, which="both")
+    plt.tick_params(axis='both', labelsize=20)
+    plt.subplots_adjust(bottom=0.15, top=0.95)
+    plt.show()
@@ -0,0 +1,259 @@
+"""
+Выравнивает импульсы между собой с точностью до долей отсчета и строит по ним средние
+шаблоны. Импульсы из find_and_save_impulses начинаются там, где сработал порог, с отступом
+padding, поэтому их простое среднее размыто. Здесь каждый импульс сравнивается с
+опорным взаимной корреляцией через БПФ: преобразования всех импульсов считаются одной
+операцией над массивом (импульсы × отсчеты), корреляция вычисляется с повышенной частотой
+дискретизации, а положение ее максимума уточняется параболой. Затем импульсы сдвигаются
+на найденную задержку (тоже в частотной области) и усредняются. Опорный импульс
+уточняется за несколько итераций. Импульсы, задержка которых уперлась в max_lag, не
+выровнены (окно для них мало) и в шаблон не входят. Шаблоны строятся отдельно для каждой
+директории, условий измерения и полярности импульса.
+"""
+
+import numpy as np
+import matplotlib.pyplot as plt
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+
+directories = ['../../sample_data']
+# Синтетические записи (2_generate_synthetic_data.py) добавляются только по явному выбору:
+# directories = ['../../sample_data', '../../4_примеры_кода_производительность/synthetic_data'].
+# Форма и шум синтетических импульсов другие, поэтому их шаблоны строятся отдельно
+window_before = 20      # Точек до начала импульса в окне
+window_length = 128     # Длина окна импульса, точек
+upsample = 8            # Во сколько раз повышается частота дискретизации корреляции
+max_lag = 40            # Наибольший допустимый сдвиг, точек
+n_iterations = 3        # Итераций уточнения опорного импульса
+batch_size = 4096       # Импульсов в одной операции БПФ (ограничивает память)
+min_impulses = 5        # Шаблон строится, только если импульсов не меньше
+
+
+def extract_parameters_from_filename(filename):
+    # Паттерн для извлечения параметров из имени файла
+    match = re.search(r'(\d+)Ohm_(\d+)V_(\d+)kHz', filename)
+    if match:
+        return int(match.group(1)), int(match.group(2)), int(match.group(3))
+    return None, None, None
+
+
+def extract_impulse_windows(filepath, current_threshold=0.001, derivative_threshold=0.0003, noise_threshold=0.0005, min_duration=10, padding=5):
+    """
+    Находит импульсы так же, как find_and_save_impulses, и вырезает для каждого окно
+    фиксированной длины от начала сохраненного импульса (с отступом padding)
+    """
+    try:
+        with np.load(filepath) as data:
+            raw_data = data['data']
+            i = raw_data[2] / 50  # Конвертируем в амперы
+    except Exception as e:
+        return None, f"Ошибка при загрузке файла {filepath}: {e}"
+
+    # Вычисляем производную тока
+    di_dt = np.diff(i)
+    above_current_threshold = np.abs(i) > current_threshold
+    at_noise_level = np.abs(i) <= noise_threshold
+
+    starts = []
+    in_impulse = False
+    for idx, (is_above, is_noise) in enumerate(zip(above_current_threshold, at_noise_level)):
+        if is_above and not in_impulse:
+            start_idx = idx
+            while start_idx > 0 and np.abs(di_dt[start_idx-1]) > derivative_threshold:
+                start_idx -= 1
+            in_impulse = True
+        elif (not is_above or is_noise) and in_impulse:
+            end_idx = idx
+            while end_idx < len(di_dt) and np.abs(di_dt[end_idx]) > derivative_threshold:
+                end_idx += 1
+            in_impulse = False
+
+            if end_idx - start_idx >= min_duration:
+                padded_start = max(0, start_idx - padding)
+                # Повторное срабатывание внутри импульса дает ту же начальную точку - пропускаем
+                if starts and starts[-1] == padded_start:
+                    continue
+                starts.append(padded_start)
+
+    starts = np.array(starts, dtype=int) - window_before
+    starts = starts[(starts >= 0) & (starts + window_length <= len(i))]
+    windows = i[starts[:, None] + np.arange(window_length)[None, :]]
+    return windows, None
+
+
+def extract_noise_windows(filepath, count, noise_threshold=0.0005, seed=0):
+    """
+    Случайные окна длины window_length из спокойных участков записи, где ток нигде не
+    выходит за noise_threshold. Базовая линия убирается так же, как в normalize
+    """
+    with np.load(filepath) as data:
+        i = data['data'][2] / 50  # Конвертируем в амперы
+
+    quiet = np.abs(i) <= noise_threshold
+    # Окно спокойное, если в нем нет ни одной точки выше порога
+    loud_before = np.concatenate(([0], np.cumsum(~quiet)))
+    starts = np.flatnonzero(loud_before[window_length:] - loud_before[:-window_length] == 0)
+    if len(starts) == 0:
+        return np.zeros((count, window_length))
+    starts = np.random.default_rng(seed).choice(starts, count)
+    windows = i[starts[:, None] + np.arange(window_length)[None, :]]
+    return windows - np.median(windows[:, :window_before // 2], axis=1, keepdims=True)
+
+
+def normalize(windows):
+    """Убирает базовую линию, приводит импульсы к положительной полярности и единичной амплитуде"""
+    windows = windows - np.median(windows[:, :window_before // 2], axis=1, keepdims=True)
+    peak_positions = np.argmax(np.abs(windows), axis=1)
+    peaks = windows[np.arange(len(windows)), peak_positions]
+    return windows / peaks[:, None], np.sign(peaks), np.abs(peaks)
+
+
+def estimate_lags(windows, reference):
+    """
+    Задержки всех импульсов относительно опорного, в точках (с долями).
+    Корреляция всех импульсов считается одним БПФ; нулевое дополнение спектра до
+    upsample раз большей длины дает корреляцию на сетке с шагом 1/upsample точки
+    """
+    n_fft = 2 * window_length  # Нулевое дополнение: корреляция не заворачивается по кругу
+    n_up = n_fft * upsample
+    reference_spectrum = np.conj(np.fft.rfft(reference, n=n_fft))
+    lags_grid = np.fft.fftfreq(n_up, 1 / n_up) / upsample  # Задержка для каждой точки корреляции
+    allowed = np.abs(lags_grid) <= max_lag
+
+    lags = np.empty(len(windows))
+    for start in range(0, len(windows), batch_size):
+        spectra = np.fft.rfft(windows[start:start + batch_size], n=n_fft, axis=1)
+        correlation = np.fft.irfft(spectra * reference_spectrum, n=n_up, axis=1) * upsample
+        correlation[:, ~allowed] = -np.inf
+        best = np.argmax(correlation, axis=1)
+
+        # Парабола по трем соседним точкам корреляции вокруг максимума
+        rows = np.arange(len(best))
+        left = correlation[rows, (best - 1) % n_up]
+        center = correlation[rows, best]
+        right = correlation[rows, (best + 1) % n_up]
+        denominator = left - 2 * center + right
+        with np.errstate(invalid='ignore', divide='ignore'):
+            offset = np.where(np.isfinite(denominator) & (denominator < 0), 0.5 * (left - right) / denominator, 0.0)
+        lags[start:start + batch_size] = lags_grid[best] + offset / upsample
+    return lags
+
+
+def shift_windows(windows, lags):
+    """Сдвигает каждый импульс на -lag точек умножением спектра на фазовый множитель"""
+    n_fft = 2 * window_length
+    frequencies = np.fft.rfftfreq(n_fft)
+    shifted = np.empty_like(windows)
+    for start in range(0, len(windows), batch_size):
+        batch = windows[start:start + batch_size]
+        # Дополняем краевыми значениями, чтобы сдвинутый импульс не заходил на другой край окна
+        padded = np.concatenate((batch, np.repeat(batch[:, -1:], n_fft - window_length, axis=1)), axis=1)
+        phase = np.exp(2j * np.pi * frequencies[None, :] * lags[start:start + batch_size, None])
+        shifted[start:start + batch_size] = np.fft.irfft(np.fft.rfft(padded, axis=1) * phase, n=n_fft, axis=1)[:, :window_length]
+    return shifted
+
+
+def build_template(windows):
+    """
+    Итеративно выравнивает импульсы по опорному и возвращает шаблон, задержки, выровненные
+    импульсы и маску импульсов, вошедших в шаблон. Задержка, упершаяся в max_lag, означает,
+    что максимум корреляции лежит за пределами поиска, - такой импульс в шаблон не входит
+    """
+    reference = np.median(windows, axis=0)
+    total_lags = np.zeros(len(windows))
+    kept = np.ones(len(windows), dtype=bool)
+    aligned = windows
+    for _ in range(n_iterations):
+        lags = estimate_lags(windows, reference)
+        kept = np.abs(lags) < max_lag - 1 / upsample
+        if not np.any(kept):
+            break
+        # Опорный импульс держим на месте: средняя задержка не должна сдвигать шаблон
+        total_lags = lags - np.median(lags[kept])
+        aligned = shift_windows(windows, total_lags)
+        reference = aligned[kept].mean(axis=0)
+    return reference, total_lags, aligned, kept
+
+
+def residual_rms(windows, template):
+    """Среднеквадратичное отличие импульсов от шаблона"""
+    return np.sqrt(np.mean((windows - template) ** 2))
+
+
+paths = []
+for directory in directories:
+    if os.path.isdir(directory):
+        npz_files = [f for f in os.listdir(directory) if f.endswith('.npz')]
+        npz_files.sort()
+        paths.extend(os.path.join(directory, f) for f in npz_files)
+
+groups = {}
+with ProcessPoolExecutor() as executor:
+    for path, (windows, error) in zip(paths, executor.map(extract_impulse_windows, paths)):
+        if error:
+            print(error)
+            continue
+        if len(windows) == 0:
+            continue
+        key = (os.path.dirname(path),) + extract_parameters_from_filename(os.path.basename(path))
+        groups.setdefault(key, []).append(windows)
+        if len(groups) == 1 and len(groups[key]) == 1:
+            first_path = path
+
+# Проверка точности: сдвигаем один импульс на известные дробные задержки, добавляем шум,
+# вырезанный из спокойных участков той же записи, и находим задержки снова
+if groups:
+    first_windows = next(iter(groups.values()))[0]
+    test_impulse, _, test_amplitude = normalize(first_windows[:1])
+    rng = np.random.default_rng(0)
+    true_lags = rng.uniform(-10, 10, 1000)
+    test_windows = shift_windows(np.repeat(test_impulse, len(true_lags), axis=0), -true_lags)
+    clean_lags = estimate_lags(test_windows, test_impulse[0])
+    noise = extract_noise_windows(first_path, len(true_lags)) / test_amplitude[0]
+    noisy_lags = estimate_lags(test_windows + noise, test_impulse[0])
+    print(f"Проверка на сдвинутых копиях импульса амплитудой {test_amplitude[0]:.3e} А: ошибка задержки "
+          f"без шума {np.sqrt(np.mean((clean_lags - true_lags) ** 2)):.3f} точки, "
+          f"с шумом записи (СКО {np.std(noise) * test_amplitude[0]:.2e} А) "
+          f"{np.sqrt(np.mean((noisy_lags - true_lags) ** 2)):.3f} точки")
+
+dt = 0.5e-9  # Шаг дискретизации записей, с
+for (source, resistance, voltage, frequency), parts in sorted(groups.items()):
+    normalized, polarity, amplitudes = normalize(np.concatenate(parts))
+    for sign, polarity_name in ((1, 'положительные'), (-1, 'отрицательные')):
+        selected = normalized[polarity == sign]
+        if len(selected) < min_impulses:
+            continue
+
+        naive_template = selected.mean(axis=0)
+        template, lags, aligned, kept = build_template(selected)
+
+        print(f"\n{source}: {resistance} Ом, {voltage} В, {frequency} кГц, {polarity_name}: {len(selected)} импульсов, "
+              f"средняя амплитуда {np.mean(amplitudes[polarity == sign]):.3e} А")
+        if not np.all(kept):
+            print(f"  Задержка уперлась в предел ±{max_lag} точек у {np.sum(~kept)} импульсов - "
+                  f"они не выровнены и в шаблон не входят (возможно, мало окно window_length)")
+        if np.sum(kept) < min_impulses:
+            print(f"  Выровнено меньше {min_impulses} импульсов, шаблон не строится")
+            continue
+        aligned = aligned[kept]
+        print(f"  Задержки: СКО {np.std(lags[kept]):.2f} точки, от {lags[kept].min():.2f} до {lags[kept].max():.2f}")
+        print(f"  Пик шаблона: без выравнивания {np.max(naive_template):.3f}, с выравниванием {np.max(template):.3f}")
+        print(f"  Отличие импульсов от шаблона (СКО): без выравнивания {residual_rms(selected, naive_template):.4f}, "
+              f"с выравниванием {residual_rms(aligned, template):.4f}")
+
+        t_ns = (np.arange(window_length) - window_before) * dt * 1e9
+        plt.figure(figsize=(15, 6))
+        for window in aligned[:50]:
+            plt.plot(t_ns, window, color='0.8', linewidth=0.5)
+        plt.plot(t_ns, naive_template, 'k:', linewidth=2, label='Среднее без выравнивания')
+        plt.plot(t_ns, template, 'k-', linewidth=3, label='Шаблон после выравнивания')
+        plt.xlabel('Время, нс', fontsize=20)
+        plt.ylabel('Нормированный ток', fontsize=20)
+        plt.title(f'Шаблон импульса: {resistance} Ом, {voltage} В, {frequency} кГц, {polarity_name}', fontsize=18)
+        plt.legend(loc='upper right', fontsize=16)
+        plt.grid(True, linestyle='-', alpha=0.7, which="both")
+        plt.tick_params(axis='both', labelsize=20)
+        plt.subplots_adjust(bottom=0.15, top=0.95)
+        plt.show()
@@ -0,0 +1,196 @@
+"""
+Усредняет ток синхронно с напряжением по всем записям с одинаковыми условиями. В каждой
+записи векторно находится переход напряжения через ноль снизу вверх (с уточнением между
+отсчетами), и каждому отсчету тока присваивается фаза периода питания. Отсчеты
+раскладываются по общей сетке фаз, а среднее и дисперсия в каждой ячейке сетки
+накапливаются по файлам за один проход. Запись длится около полутора периодов, поэтому
+неполные периоды тоже учитываются - в тех ячейках фазы, которые они покрывают.
+Импульсы тоже привязаны к фазе напряжения, поэтому ток усредняется еще раз без отсчетов
+вблизи импульсов, и по этому среднему оцениваются амплитуда и задержка емкостного тока.
+"""
+
+import numpy as np
+import matplotlib.pyplot as plt
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+
+directories = ['../../sample_data']
+# Синтетические записи (2_generate_synthetic_data.py) добавляются только по явному выбору:
+# directories = ['../../sample_data', '../../4_примеры_кода_производительность/synthetic_data'].
+# У них другие шум и емкостной ток, поэтому они усредняются отдельно от записей с теми же условиями
+n_phase_bins = 1000
+crossing_fit_half_width = 200  # Точек с каждой стороны перехода для уточнения его времени
+current_threshold = 0.001      # Порог тока из find_and_save_impulses
+impulse_guard = 100            # Сколько точек вокруг импульса исключать из усреднения без импульсов
+
+# Параметры емкостного тока, заданные вручную в 1_calculate_capacitive_current.py, - для сравнения.
+# Амплитуда там примерно в 5 раз больше измеренной: синус, подобранный по одной записи
+# (000001), дает 3.08e-05 А, как и среднее по всем записям здесь
+capacitor_current_amp = 1.478774e-04
+capacitor_current_delay = -7.068553539992742e-06
+
+
+def extract_parameters_from_filename(filename):
+    # Паттерн для извлечения параметров из имени файла
+    match = re.search(r'(\d+)Ohm_(\d+)V_(\d+)kHz', filename)
+    if match:
+        return int(match.group(1)), int(match.group(2)), int(match.group(3))
+    return None, None, None
+
+
+def rising_zero_crossings(t, v, period):
+    """
+    Переходы напряжения через ноль снизу вверх. Соседние смены знака из-за шума
+    объединяются (остается первая в пределах половины периода), а время перехода
+    уточняется прямой, подобранной по точкам вокруг него
+    """
+    dt = t[1] - t[0]
+    candidates = np.flatnonzero((v[:-1] < 0) & (v[1:] >= 0))
+    if len(candidates) == 0:
+        return np.empty(0)
+    keep = np.concatenate(([True], np.diff(candidates) > period / 2 / dt))
+    candidates = candidates[keep]
+
+    # Уточнение сразу для всех переходов: окна точек вокруг каждого перехода
+    w = crossing_fit_half_width
+    candidates = candidates[(candidates >= w) & (candidates + w < len(v))]
+    offsets = np.arange(-w, w + 1)
+    windows = v[candidates[:, None] + offsets[None, :]]
+    x = offsets * dt
+    slope = ((windows - windows.mean(axis=1, keepdims=True)) * (x - x.mean())).sum(axis=1) / np.sum((x - x.mean()) ** 2)
+    intercept = windows.mean(axis=1) - slope * x.mean()
+    return t[candidates] - intercept / slope
+
+
+def phase_statistics(filepath):
+    """Число отсчетов, среднее и сумма квадратов отклонений тока и напряжения в каждой ячейке фазы"""
+    try:
+        with np.load(filepath) as data:
+            raw_data = data['data']
+            t = raw_data[0]
+            v = raw_data[1]
+            i = raw_data[2] / 50  # Конвертируем в амперы
+    except Exception as e:
+        return None, f"Ошибка при загрузке файла {filepath}: {e}"
+
+    frequency = extract_parameters_from_filename(os.path.basename(filepath))[2]
+    if frequency is None:
+        return None, f"Ошибка при обработке файла {filepath}: в имени нет параметров записи"
+    period = 1 / (frequency * 1000)
+    crossings = rising_zero_crossings(t, v, period)
+    if len(crossings) == 0:
+        return None, f"В файле {filepath} не найден переход напряжения через ноль"
+
+    # Фаза отсчитывается от первого перехода; отсчеты до него получают фазу предыдущего периода
+    phase = np.mod((t - crossings[0]) / period, 1.0)
+    bins = np.minimum((phase * n_phase_bins).astype(int), n_phase_bins - 1)
+
+    # Отсчеты вблизи импульсов, чтобы отдельно усреднить ток без них
+    above = (np.abs(i) > current_threshold).astype(float)
+    near_impulse = np.convolve(above, np.ones(2 * impulse_guard + 1), mode='same') > 0
+    quiet = ~near_impulse
+
+    stats = {}
+    for name, values, selection in (('current', i, slice(None)), ('current_quiet', i, quiet), ('voltage', v, slice(None))):
+        selected_bins = bins[selection]
+        selected = values[selection]
+        count = np.bincount(selected_bins, minlength=n_phase_bins)
+        mean = np.bincount(selected_bins, weights=selected, minlength=n_phase_bins) / np.maximum(count, 1)
+        m2 = np.bincount(selected_bins, weights=(selected - mean[selected_bins]) ** 2, minlength=n_phase_bins)
+        stats[name] = {'count': count, 'mean': mean, 'm2': m2}
+    stats['cycles'] = (t[-1] - t[0]) / period
+    return stats, None
+
+
+def merge_statistics(total, part):
+    """Объединение среднего и дисперсии двух наборов (формула Чана), по каждой ячейке"""
+    if total is None:
+        return {name: value.copy() for name, value in part.items()}
+    count = total['count'] + part['count']
+    delta = part['mean'] - total['mean']
+    safe = np.maximum(count, 1)
+    mean = total['mean'] + delta * part['count'] / safe
+    m2 = total['m2'] + part['m2'] + delta ** 2 * total['count'] * part['count'] / safe
+    return {'count': count, 'mean': mean, 'm2': m2}
+
+
+def fit_fundamental(phase, values):
+    """Подбирает values ≈ A sin(2π phase + θ) + c; возвращает A и θ"""
+    design = np.column_stack((np.sin(2 * np.pi * phase), np.cos(2 * np.pi * phase), np.ones_like(phase)))
+    (a, b, c), *_ = np.linalg.lstsq(design, values, rcond=None)
+    return np.hypot(a, b), np.arctan2(b, a)
+
+
+paths = []
+for directory in directories:
+    if os.path.isdir(directory):
+        npz_files = [f for f in os.listdir(directory) if f.endswith('.npz')]
+        npz_files.sort()
+        paths.extend(os.path.join(directory, f) for f in npz_files)
+
+# Один проход по файлам: статистика файла сразу вливается в накопитель его условий
+conditions = {}
+with ProcessPoolExecutor() as executor:
+    for path, (stats, error) in zip(paths, executor.map(phase_statistics, paths)):
+        if error:
+            print(error)
+            continue
+        key = (os.path.dirname(path),) + extract_parameters_from_filename(os.path.basename(path))
+        accumulator = conditions.setdefault(key, {'current': None, 'current_quiet': None, 'voltage': None,
+                                                  'files': 0, 'cycles': 0.0})
+        for name in ('current', 'current_quiet', 'voltage'):
+            accumulator[name] = merge_statistics(accumulator[name], stats[name])
+        accumulator['files'] += 1
+        accumulator['cycles'] += stats['cycles']
+
+phase_grid = (np.arange(n_phase_bins) + 0.5) / n_phase_bins
+
+for (source, resistance, voltage, frequency), accumulator in sorted(conditions.items()):
+    current = accumulator['current']
+    filled = current['count'] > 1
+    std = np.sqrt(current['m2'] / np.maximum(current['count'] - 1, 1))
+    stderr = std / np.sqrt(np.maximum(current['count'], 1))
+
+    # Емкостной ток оцениваем по отсчетам без импульсов: импульсы тоже привязаны к фазе и смещают среднее
+    quiet = accumulator['current_quiet']
+    quiet_filled = quiet['count'] > 1
+    amplitude, theta = fit_fundamental(phase_grid[quiet_filled], quiet['mean'][quiet_filled])
+    voltage_amplitude, voltage_theta = fit_fundamental(phase_grid[filled], accumulator['voltage']['mean'][filled])
+    # Опережение тока относительно напряжения переводим в задержку, как в кейсе 5
+    omega = 2 * np.pi * frequency * 1000
+    delay = -np.angle(np.exp(1j * (theta - voltage_theta))) / omega
+    impulse_current = current['mean'] - quiet['mean']
+
+    print(f"\n{source}: {resistance} Ом, {voltage} В, {frequency} кГц: {accumulator['files']} записей, "
+          f"{accumulator['cycles']:.1f} периодов")
+    print(f"  Ячеек фазы с данными: {np.sum(filled)} из {n_phase_bins}, "
+          f"отсчетов в ячейке: от {current['count'][filled].min()} до {current['count'][filled].max()}")
+    print(f"  Средняя погрешность среднего тока: {np.median(stderr[filled]):.2e} А")
+    print(f"  Амплитуда напряжения: {voltage_amplitude:.1f} В")
+    print(f"  Доля отсчетов вблизи импульсов: {1 - quiet['count'].sum() / current['count'].sum():.1%}, "
+          f"вклад импульсов в средний ток: до {np.max(np.abs(impulse_current[quiet_filled])):.2e} А")
+    print(f"  Емкостной ток: амплитуда {amplitude:.4e} А, задержка {delay * 1e6:.3f} мкс")
+    print(f"  Константы кейса 5 заданы вручную и с измерением не совпадают: амплитуда {capacitor_current_amp:.4e} А "
+          f"(в {capacitor_current_amp / amplitude:.1f} раза больше), задержка {capacitor_current_delay * 1e6:.3f} мкс")
+
+    fig, ax1 = plt.subplots(figsize=(15, 6))
+    ax1.plot(phase_grid[filled] * 360, current['mean'][filled], 'k-', linewidth=2, label='Средний ток')
+    ax1.fill_between(phase_grid[filled] * 360, current['mean'][filled] - std[filled],
+                     current['mean'][filled] + std[filled], color='k', alpha=0.15, label='± СКО')
+    ax1.plot(phase_grid[quiet_filled] * 360, quiet['mean'][quiet_filled], 'k--', linewidth=2, label='Средний ток без импульсов')
+    ax1.set_xlabel('Фаза напряжения, градусы', fontsize=20)
+    ax1.set_ylabel('Ток, А', fontsize=20)
+    ax1.tick_params(axis='both', labelsize=20)
+    ax2 = ax1.twinx()
+    ax2.plot(phase_grid[filled] * 360, accumulator['voltage']['mean'][filled], 'k:', linewidth=2, label='Напряжение')
+    ax2.set_ylabel('Напряжение, В', fontsize=20)
+    ax2.tick_params(axis='y', labelsize=20)
+    lines = ax1.get_legend_handles_labels()[0] + ax2.get_legend_handles_labels()[0]
+    labels = ax1.get_legend_handles_labels()[1] + ax2.get_legend_handles_labels()[1]
+    ax1.legend(lines, labels, loc='upper right', fontsize=16)
+    plt.title(f'Ток, усредненный по фазе напряжения: {resistance} Ом, {voltage} В, {frequency} кГц', fontsize=18)
+    ax1.grid(True, linestyle='-', alpha=0.7, which="both")
+    plt.subplots_adjust(bottom=0.15, top=0.92)
+    plt.show()
@@ -0,0 +1,189 @@
+"""
+Оценивает спектр шума тока и напряжения для каждой записи методом Уэлча: запись режется
+на перекрывающиеся сегменты, все сегменты обоих каналов умножаются на окно Хэннинга и
+проходят одно общее быстрое преобразование Фурье. Кроме среднего по сегментам
+считается медиана, на которую почти не влияют сегменты с импульсами. Спектры каждого
+файла сохраняются и пересчитываются, только если файл изменился. По группам записей с
+одинаковыми условиями (сопротивление, напряжение, частота) выводятся уровень шума,
+его СКО и самые заметные линии помех.
+"""
+
+import numpy as np
+import matplotlib.pyplot as plt
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from scipy.signal import welch, find_peaks
+from scipy.ndimage import median_filter
+
+
+directory = '../../sample_data'
+cache_directory = 'noise_spectra'
+segment_length = 4096
+segment_overlap = 2048
+line_threshold = 10.0   # Линия - пик спектра выше локальной медианы в столько раз
+n_lines = 5             # Сколько самых сильных линий выводить для каждой группы
+band_start = 2e6        # Шум считается выше этой частоты, Гц: ниже лежат основная частота и емкостной ток
+current_threshold = 0.001  # Порог тока из find_and_save_impulses, для сравнения с шумом
+
+
+def extract_parameters_from_filename(filename):
+    # Паттерн для извлечения параметров из имени файла
+    match = re.search(r'(\d+)Ohm_(\d+)V_(\d+)kHz', filename)
+    if match:
+        return int(match.group(1)), int(match.group(2)), int(match.group(3))
+    return None, None, None
+
+
+def median_bias(n):
+    """Поправка медианы к среднему для распределения хи-квадрат с 2 степенями свободы (как в scipy)"""
+    ii_2 = 2 * np.arange(1., (n - 1) // 2 + 1)
+    return 1 + np.sum(1. / (ii_2 + 1) - 1. / ii_2)
+
+
+def welch_psd(channels, fs):
+    """
+    Односторонняя спектральная плотность мощности для нескольких каналов сразу.
+    channels - массив (каналы × отсчеты); возвращает частоты, среднее и медиану по сегментам
+    """
+    step = segment_length - segment_overlap
+    segments = np.lib.stride_tricks.sliding_window_view(channels, segment_length, axis=1)[:, ::step]
+    window = np.hanning(segment_length + 1)[:-1]  # Периодическое окно, как в scipy.signal.welch
+
+    # Удаляем среднее каждого сегмента и делаем одно преобразование для всех сегментов всех каналов
+    detrended = segments - segments.mean(axis=2, keepdims=True)
+    spectra = np.abs(np.fft.rfft(detrended * window, axis=2)) ** 2
+    spectra /= fs * np.sum(window ** 2)
+    spectra[:, :, 1:-1] *= 2  # Односторонний спектр: удваиваем все, кроме нулевой частоты и частоты Найквиста
+
+    frequencies = np.fft.rfftfreq(segment_length, 1 / fs)
+    mean_psd = spectra.mean(axis=1)
+    median_psd = np.median(spectra, axis=1) / median_bias(spectra.shape[1])
+    return frequencies, mean_psd, median_psd
+
+
+def spectrum_for_file(filepath):
+    """Спектры тока и напряжения одного файла"""
+    try:
+        with np.load(filepath) as data:
+            raw_data = data['data']
+            t = raw_data[0]
+            v = raw_data[1]
+            i = raw_data[2] / 50  # Конвертируем в амперы
+    except Exception as e:
+        return None, f"Ошибка при загрузке файла {filepath}: {e}"
+
+    # В короткой записи не помещается ни одного сегмента - спектр не оценить
+    if len(t) < segment_length:
+        return None, f"Ошибка при обработке файла {filepath}: {len(t)} отсчетов, меньше длины сегмента {segment_length}"
+
+    fs = 1 / (t[1] - t[0])
+    frequencies, mean_psd, median_psd = welch_psd(np.vstack((i, v)), fs)
+    return {'frequencies': frequencies, 'mean_psd': mean_psd, 'median_psd': median_psd,
+            'current_std': np.std(i), 'voltage_std': np.std(v)}, None
+
+
+def cached_spectra(npz_files):
+    """Загружает спектры из кэша и досчитывает новые и изменившиеся файлы"""
+    os.makedirs(cache_directory, exist_ok=True)
+    spectra = {}
+
+    # Файл пересчитывается, только если изменился он сам или параметры расчета
+    def file_key(filename):
+        stat = os.stat(os.path.join(directory, filename))
+        return f"{stat.st_size}_{stat.st_mtime_ns}_{segment_length}_{segment_overlap}"
+
+    to_process = []
+    for filename in npz_files:
+        cache_path = os.path.join(cache_directory, filename)
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as cached:
+                if str(cached['key']) == file_key(filename):
+                    spectra[filename] = {name: cached[name] for name in cached.files if name != 'key'}
+                    continue
+        to_process.append(filename)
+    print(f"Файлов: {len(npz_files)}, спектры в кэше: {len(spectra)}, требуют расчета: {len(to_process)}")
+
+    with ProcessPoolExecutor() as executor:
+        paths = [os.path.join(directory, f) for f in to_process]
+        for filename, (spectrum, error) in zip(to_process, executor.map(spectrum_for_file, paths)):
+            if error:
+                print(error)
+                continue
+            np.savez(os.path.join(cache_directory, filename), key=file_key(filename), **spectrum)
+            spectra[filename] = spectrum
+    return spectra
+
+
+def find_lines(frequencies, psd):
+    """Линии помех: пики спектра, которые выше локальной медианы в line_threshold раз"""
+    background = median_filter(psd, size=31, mode='nearest')
+    excess = psd / background
+    peaks, _ = find_peaks(excess, height=line_threshold)
+    peaks = peaks[frequencies[peaks] > 0]
+    strongest = peaks[np.argsort(excess[peaks])[::-1][:n_lines]]
+    return [(frequencies[k], psd[k], excess[k]) for k in strongest]
+
+
+npz_files = [f for f in os.listdir(directory) if f.endswith('.npz')]
+npz_files.sort()
+
+spectra = cached_spectra(npz_files)
+if not spectra:
+    print("Нет ни одного спектра")
+    exit(0)
+
+# Проверяем совпадение с scipy.signal.welch на первом файле
+first = next(iter(spectra))
+with np.load(os.path.join(directory, first)) as data:
+    raw_data = data['data']
+fs = 1 / (raw_data[0][1] - raw_data[0][0])
+_, reference = welch(raw_data[2] / 50, fs=fs, nperseg=segment_length, noverlap=segment_overlap, average='median')
+print(f"Отличие от scipy.signal.welch: {np.max(np.abs(spectra[first]['median_psd'][0] - reference)) / np.max(reference):.1e}")
+
+# Группируем записи по условиям измерения
+groups = {}
+for filename, spectrum in spectra.items():
+    groups.setdefault(extract_parameters_from_filename(filename), []).append(spectrum)
+
+for (resistance, voltage, frequency), members in sorted(groups.items()):
+    frequencies = members[0]['frequencies']
+    df = frequencies[1] - frequencies[0]
+    # Медиана по файлам: отдельные записи с сильными импульсами не смещают оценку группы
+    current_psd = np.median([m['median_psd'][0] for m in members], axis=0)
+    voltage_psd = np.median([m['median_psd'][1] for m in members], axis=0)
+    current_mean_psd = np.median([m['mean_psd'][0] for m in members], axis=0)
+
+    band = frequencies >= band_start
+    current_noise = np.sqrt(np.sum(current_psd[band]) * df)
+    current_total = np.sqrt(np.sum(current_mean_psd[band]) * df)
+    voltage_noise = np.sqrt(np.sum(voltage_psd[band]) * df)
+    floor = np.median(current_psd[band])
+
+    print(f"\n{resistance} Ом, {voltage} В, {frequency} кГц: {len(members)} записей")
+    print(f"  Уровень шума тока: {np.sqrt(floor):.3e} А/√Гц")
+    print(f"  СКО шума тока выше {band_start / 1e6:.0f} МГц: {current_noise:.3e} А (с импульсами {current_total:.3e} А; "
+          f"СКО всего сигнала {np.median([m['current_std'] for m in members]):.3e} А)")
+    print(f"  Порог тока {current_threshold} А = {current_threshold / current_noise:.1f} СКО шума")
+    print(f"  СКО шума напряжения выше {band_start / 1e6:.0f} МГц: {voltage_noise:.3e} В")
+    lines = [line for line in find_lines(frequencies, current_psd) if line[0] >= band_start]
+    if lines:
+        print("  Линии помех в токе:")
+        for line_frequency, level, excess in lines:
+            print(f"    {line_frequency / 1e6:8.2f} МГц: {np.sqrt(level):.3e} А/√Гц, в {excess:.0f} раз выше фона")
+    else:
+        print("  Линии помех в токе не найдены")
+
+    plt.figure(figsize=(15, 6))
+    plt.semilogy(frequencies[1:] / 1e6, current_mean_psd[1:], 'k:', linewidth=1, label='Среднее по сегментам')
+    plt.semilogy(frequencies[1:] / 1e6, current_psd[1:], 'k-', linewidth=2, label='Медиана по сегментам')
+    for line_frequency, level, _ in lines:
+        plt.plot(line_frequency / 1e6, level, 'ko', markersize=8)
+    plt.xlabel('Частота, МГц', fontsize=20)
+    plt.ylabel('СПМ тока, А²/Гц', fontsize=20)
+    plt.title(f'Спектр шума тока: {resistance} Ом, {voltage} В, {frequency} кГц', fontsize=18)
+    plt.legend(loc='upper right', fontsize=16)
+    plt.grid(True, linestyle='-', alpha=0.7, which="both")
+    plt.tick_params(axis='both', labelsize=20)
+    plt.subplots_adjust(bottom=0.15, top=0.95)
+    plt.show()
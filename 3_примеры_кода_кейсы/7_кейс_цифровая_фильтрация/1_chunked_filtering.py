@@ -0,0 +1,358 @@
+"""
+Фильтрует ток перед поиском импульсов, обрабатывая запись по кускам. Фильтр задается
+настройками: БИХ-фильтр Баттерворта в виде каскада звеньев второго порядка или
+КИХ-фильтр. Состояние фильтра переносится между кусками. В режиме без фазового сдвига
+(как scipy.signal.sosfiltfilt) прямой проход идет непрерывно, а обратный проход для
+каждого блока начинается с запасом точек после него, за который влияние неизвестного
+продолжения затухает. Края записи дополняются нечетным отражением, как в scipy.
+Отфильтрованные куски собираются во временные промежутки с перекрытием и передаются
+существующим детекторам без создания массивов на всю запись. Фильтр уменьшает пик
+коротких импульсов и производную тока, поэтому пороги детектора импульсов для
+отфильтрованного тока пересчитываются по первой записи.
+"""
+
+import numpy as np
+import matplotlib.pyplot as plt
+import os
+import zipfile
+from scipy.signal import butter, firwin, sosfilt, sosfilt_zi, lfilter, lfilter_zi, sosfiltfilt, filtfilt
+
+
+directory = '../../sample_data'
+filter_config = {'kind': 'butter', 'order': 4, 'cutoff': 300e6, 'btype': 'lowpass'}
+# filter_config = {'kind': 'fir', 'numtaps': 63, 'cutoff': 300e6, 'btype': 'lowpass'}
+zero_phase = True
+settle_tolerance = 1e-12  # Обратный проход начинается там, где импульсная характеристика затухла до этой доли
+max_settle = 1 << 22      # Наибольший допустимый запас обратного прохода, точек
+chunk_size = 8192
+batch_size = 10000
+batch_overlap = 100
+
+
+def iter_current_chunks(filepath, chunk_size):
+    """Читает канал тока из npz по кускам, не загружая файл целиком"""
+    with zipfile.ZipFile(filepath) as archive:
+        with archive.open('data.npy') as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if fortran_order or archive.getinfo('data.npy').compress_type != zipfile.ZIP_STORED:
+                f.seek(0)
+                i = np.lib.format.read_array(f)[2] / 50
+                for start in range(0, len(i), chunk_size):
+                    yield i[start:start + chunk_size]
+                return
+
+            n_samples = shape[1]
+            f.seek(f.tell() + 2 * n_samples * dtype.itemsize)  # Пропускаем время и напряжение
+            for start in range(0, n_samples, chunk_size):
+                count = min(chunk_size, n_samples - start)
+                yield np.frombuffer(f.read(count * dtype.itemsize), dtype=dtype) / 50  # Конвертируем в амперы
+
+
+def design_filter(config, fs):
+    """Строит фильтр по настройкам; padlen совпадает с длиной дополнения в scipy"""
+    if config['kind'] == 'butter':
+        sos = butter(config['order'], config['cutoff'], btype=config['btype'], fs=fs, output='sos')
+        zero_taps = min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum())
+        filt = {'sos': sos, 'zi': sosfilt_zi(sos), 'padlen': 3 * (2 * len(sos) + 1 - zero_taps)}
+    elif config['kind'] == 'fir':
+        b = firwin(config['numtaps'], config['cutoff'], fs=fs, pass_zero=config['btype'])
+        filt = {'b': b, 'zi': lfilter_zi(b, [1.0]), 'padlen': 3 * len(b)}
+    else:
+        raise ValueError(f"Неизвестный тип фильтра: {config['kind']}")
+
+    filt['settle'] = settle_length(filt)
+    return filt
+
+
+def settle_length(filt):
+    """
+    Сколько точек нужно, чтобы импульсная характеристика затухла до settle_tolerance
+    от максимума. У КИХ-фильтра отклик заканчивается через numtaps точек. У БИХ-фильтра
+    отклик убывает как r**n, где r - наибольший модуль полюса, отсюда начальная оценка
+    log(settle_tolerance) / log(r). Оценка проверяется по самому отклику: если на
+    следующем таком же отрезке он еще выше допуска, длина удваивается. Длиннее max_settle
+    запас не делается - тогда фильтр нужно выбрать другой, а не обрезать отклик.
+    """
+    if 'b' in filt:
+        length = len(filt['b'])
+    else:
+        poles = np.concatenate([np.roots(section[3:]) for section in filt['sos']])
+        radius = np.max(np.abs(poles))
+        if radius >= 1:
+            raise ValueError(f"Фильтр неустойчив: наибольший модуль полюса {radius:.6f}")
+        length = int(np.ceil(np.log(settle_tolerance) / np.log(radius))) + 1
+
+    length = max(length, 16)
+    while length <= max_settle:
+        impulse = np.zeros(2 * length)
+        impulse[0] = 1.0
+        response = np.abs(apply_filter(filt, impulse, filt['zi'] * 0)[0])
+        last = int(np.flatnonzero(response > settle_tolerance * response.max())[-1])
+        if last < length:
+            return last + 1
+        length *= 2
+    raise ValueError(f"Импульсная характеристика не затухает до {settle_tolerance} за {max_settle} точек; "
+                     f"увеличьте max_settle или частоту среза")
+
+
+def apply_filter(filt, x, zi):
+    if 'sos' in filt:
+        return sosfilt(filt['sos'], x, zi=zi)
+    return lfilter(filt['b'], [1.0], x, zi=zi)
+
+
+def filter_chunks(chunks, filt, zero_phase=True):
+    """
+    Фильтрует поток кусков и выдает отфильтрованные куски по порядку. Без фазового
+    сдвига каждый кусок выдается, когда после него накоплено filt['settle'] точек
+    прямого прохода; последние точки выдаются в конце записи.
+    """
+    padlen = filt['padlen']
+    pending = np.empty(0)   # Начало записи, пока не хватает точек для отражения
+    tail = np.empty(0)      # Последние padlen + 1 исходных точек для отражения в конце
+    forward = np.empty(0)   # Результат прямого прохода, еще не прошедший обратный проход
+    zi = None
+
+    for chunk in chunks:
+        if zi is None:
+            pending = np.concatenate((pending, chunk))
+            if len(pending) <= padlen:
+                continue
+            chunk = pending
+            # Начальное состояние и отражение начала - как в sosfiltfilt
+            head = 2 * chunk[0] - chunk[padlen:0:-1]
+            if zero_phase:
+                _, zi = apply_filter(filt, head, filt['zi'] * head[0])
+            else:
+                zi = filt['zi'] * chunk[0]
+
+        y, zi = apply_filter(filt, chunk, zi)
+        tail = np.concatenate((tail, chunk))[-(padlen + 1):]
+        if not zero_phase:
+            yield y
+            continue
+
+        forward = np.concatenate((forward, y))
+        ready = len(forward) - filt['settle']
+        if ready > 0:
+            # Обратный проход начинается с установившегося состояния в конце запаса
+            backward, _ = apply_filter(filt, forward[::-1], filt['zi'] * forward[-1])
+            yield backward[::-1][:ready]
+            forward = forward[ready:]
+
+    if zi is None:
+        raise ValueError(f"Запись короче {padlen + 1} точек")
+    if not zero_phase:
+        return
+
+    # Конец записи: отражаем хвост и делаем обратный проход точно как sosfiltfilt
+    end = 2 * tail[-1] - tail[-2::-1][:padlen]
+    y, _ = apply_filter(filt, end, zi)
+    full = np.concatenate((forward, y))
+    backward, _ = apply_filter(filt, full[::-1], filt['zi'] * full[-1])
+    yield backward[::-1][:len(forward)]
+
+
+def iter_windows(chunks, batch_size, overlap):
+    """Собирает куски в промежутки той же разметки, что и split_experimental_data_into_batches"""
+    buffer = np.empty(0)
+    buffer_start = 0
+    position = 0
+    batch_index = 0
+    for chunk in chunks:
+        buffer = np.concatenate((buffer, chunk))
+        position += len(chunk)
+        while position >= batch_index * batch_size + batch_size + overlap:
+            first = batch_index * batch_size
+            start = max(first - overlap, 0)
+            yield {'i': buffer[start - buffer_start:first + batch_size + overlap - buffer_start],
+                   'start': start, 'batch_index': batch_index}
+            batch_index += 1
+            keep_from = max(batch_index * batch_size - overlap, 0)
+            buffer = buffer[keep_from - buffer_start:]
+            buffer_start = keep_from
+    while batch_index * batch_size < position:
+        first = batch_index * batch_size
+        start = max(first - overlap, 0)
+        yield {'i': buffer[start - buffer_start:min(first + batch_size + overlap, position) - buffer_start],
+               'start': start, 'batch_index': batch_index}
+        batch_index += 1
+
+
+def advanced_filter(batch_data, chunk_size=50, overlap=14, q_threshold=0.007515, h_threshold=0.025):
+    data = np.asarray(batch_data)
+    data_shifted = data - np.mean(data)
+
+    # Проверяем по амплитуде
+    if np.max(data_shifted) > h_threshold or np.min(data_shifted) < -h_threshold:
+        return True, []
+
+    # Проверяем по площади в сегментах и собираем потенциальные события
+    potential_events = []
+    step = chunk_size - overlap
+    for start in range(0, len(data_shifted) - chunk_size + 1, step):
+        chunk = data_shifted[start:start + chunk_size]
+        area = np.trapezoid(chunk)
+        if abs(area) > q_threshold:
+            potential_events.append([start, start + chunk_size])
+            return True, potential_events
+
+    return False, []
+
+
+def find_impulses(i, current_threshold=0.001, derivative_threshold=0.0003, noise_threshold=0.0005, min_duration=10, padding=5):
+    """
+    Цикл поиска импульсов из find_and_save_impulses без сохранения в файлы. Повторные
+    срабатывания внутри одного импульса дают то же начало - они отбрасываются
+    """
+    di_dt = np.diff(i)
+    above_current_threshold = np.abs(i) > current_threshold
+    at_noise_level = np.abs(i) <= noise_threshold
+    impulses = []
+    in_impulse = False
+    for idx, (is_above, is_noise) in enumerate(zip(above_current_threshold, at_noise_level)):
+        if is_above and not in_impulse:
+            start_idx = idx
+            while start_idx > 0 and np.abs(di_dt[start_idx-1]) > derivative_threshold:
+                start_idx -= 1
+            in_impulse = True
+        elif (not is_above or is_noise) and in_impulse:
+            end_idx = idx
+            while end_idx < len(di_dt) and np.abs(di_dt[end_idx]) > derivative_threshold:
+                end_idx += 1
+            in_impulse = False
+
+            if end_idx - start_idx >= min_duration:
+                padded_start = max(0, start_idx - padding)
+                if impulses and impulses[-1][0] == padded_start:
+                    continue
+                impulses.append((padded_start, min(len(i), end_idx + padding)))
+    return impulses
+
+
+def filtered_thresholds(i, filtered_i, current_threshold=0.001, derivative_threshold=0.0003, noise_threshold=0.0005):
+    """
+    Пороги find_impulses для отфильтрованного тока. Пороги тока и уровня шума умножаются
+    на медианное отношение пиков импульсов после и до фильтра, порог производной - на
+    отношение СКО производной шума после и до фильтра
+    """
+    peak_gain = np.median([np.max(np.abs(filtered_i[start:end])) / np.max(np.abs(i[start:end]))
+                           for start, end in find_impulses(i)])
+    quiet = np.abs(i[1:]) <= noise_threshold
+    derivative_gain = np.std(np.diff(filtered_i)[quiet]) / np.std(np.diff(i)[quiet])
+    return {'current_threshold': current_threshold * peak_gain,
+            'derivative_threshold': derivative_threshold * derivative_gain,
+            'noise_threshold': noise_threshold * peak_gain}
+
+
+def analyze_file(filepath, filt, filtered, thresholds):
+    """
+    Прогоняет детекторы по промежуткам записи; возвращает статистику без массивов на всю запись.
+    thresholds - пороги find_impulses для отфильтрованного тока
+    """
+    chunks = iter_current_chunks(filepath, chunk_size)
+    parameters = {}
+    if filtered:
+        chunks = filter_chunks(chunks, filt, zero_phase)
+        parameters = thresholds
+
+    stats = {'flagged': 0, 'impulses': 0, 'amplitudes': [], 'quiet_sum_sq': 0.0, 'quiet_count': 0}
+    for window in iter_windows(chunks, batch_size, batch_overlap):
+        verdict, _ = advanced_filter(window['i'])
+        if verdict:
+            stats['flagged'] += 1
+        else:
+            # Шум оцениваем по промежуткам, где фильтр не нашел событий
+            stats['quiet_sum_sq'] += np.sum((window['i'] - np.mean(window['i'])) ** 2)
+            stats['quiet_count'] += len(window['i'])
+        # Импульс относим к промежутку, в основную часть которого попало его начало
+        core_start = window['batch_index'] * batch_size
+        for start, end in find_impulses(window['i'], **parameters):
+            if core_start <= window['start'] + start < core_start + batch_size:
+                stats['impulses'] += 1
+                stats['amplitudes'].append(np.max(np.abs(window['i'][start:end])))
+    return stats
+
+
+npz_files = [f for f in os.listdir(directory) if f.endswith('.npz')]
+npz_files.sort()
+
+with np.load(os.path.join(directory, npz_files[0])) as data:
+    raw_data = data['data']
+    t = raw_data[0]
+    i = raw_data[2] / 50  # Конвертируем в амперы
+fs = 1 / (t[1] - t[0])
+filt = design_filter(filter_config, fs)
+print(f"Фильтр: {filter_config}, дополнение {filt['padlen']} точек, запас обратного прохода {filt['settle']} точек")
+
+# Проверка: кусочная фильтрация совпадает с фильтрацией всей записи
+reference = sosfiltfilt(filt['sos'], i) if 'sos' in filt else filtfilt(filt['b'], [1.0], i)
+if not zero_phase:
+    reference = apply_filter(filt, i, filt['zi'] * i[0])[0]
+for size in (1000, 4096, 65536):
+    chunked = np.concatenate(list(filter_chunks((i[k:k + size] for k in range(0, len(i), size)), filt, zero_phase)))
+    print(f"Куски по {size}: наибольшее отличие от фильтрации целиком "
+          f"{np.max(np.abs(chunked - reference)) / np.max(np.abs(reference)):.1e} от размаха сигнала")
+
+# Пороги детектора для отфильтрованного тока
+filtered_i = np.concatenate(list(filter_chunks(iter_current_chunks(os.path.join(directory, npz_files[0]), chunk_size),
+                                               filt, zero_phase)))
+thresholds = filtered_thresholds(i, filtered_i)
+print(f"Пороги для отфильтрованного тока: ток {thresholds['current_threshold']:.2e} А (было 0.001), "
+      f"производная {thresholds['derivative_threshold']:.2e} А (было 0.0003), "
+      f"уровень шума {thresholds['noise_threshold']:.2e} А (было 0.0005)")
+
+totals = {False: {'flagged': 0, 'impulses': 0, 'amplitudes': [], 'quiet_sum_sq': 0.0, 'quiet_count': 0},
+          True: {'flagged': 0, 'impulses': 0, 'amplitudes': [], 'quiet_sum_sq': 0.0, 'quiet_count': 0}}
+for npz_file in npz_files:
+    filepath = os.path.join(directory, npz_file)
+    for filtered in (False, True):
+        try:
+            stats = analyze_file(filepath, filt, filtered, thresholds)
+        except Exception as e:
+            print(f"Ошибка при обработке файла {npz_file}: {e}")
+            break
+        for key in ('flagged', 'impulses', 'quiet_sum_sq', 'quiet_count'):
+            totals[filtered][key] += stats[key]
+        totals[filtered]['amplitudes'].extend(stats['amplitudes'])
+
+for filtered, name in ((False, 'Без фильтра'), (True, 'С фильтром')):
+    summary = totals[filtered]
+    noise = np.sqrt(summary['quiet_sum_sq'] / max(summary['quiet_count'], 1))
+    amplitudes = summary['amplitudes']
+    print(f"{name}: шум {noise:.3e} А, промежутков с событиями {summary['flagged']}, импульсов {summary['impulses']}, "
+          f"медианная амплитуда {np.median(amplitudes) if amplitudes else 0:.6f} А")
+
+# С исходными порогами после фильтра находится лишь часть импульсов: пик короткого импульса
+# падает примерно вдвое, а производная - втрое, и импульс не проходит порог тока или min_duration.
+# С пересчитанными порогами находятся почти все исходные импульсы и, так как шум ниже, более слабые
+raw_impulses = find_impulses(i)
+for name, parameters in (('исходные', {}), ('пересчитанные', thresholds)):
+    found = find_impulses(filtered_i, **parameters)
+    matched = sum(any(start < found_end and found_start < end for found_start, found_end in found)
+                  for start, end in raw_impulses)
+    print(f"Первая запись, пороги {name}: после фильтра импульсов {len(found)}, "
+          f"из {len(raw_impulses)} найденных без фильтра совпадают {matched}")
+
+# Показываем отфильтрованный импульс из первого файла
+impulses = raw_impulses
+if impulses:
+    start, end = impulses[0]
+    window = slice(max(0, start - 20), min(len(i), end + 20))
+    t_shifted = (t[window] - t[window][0]) * 1e9
+
+    plt.figure(figsize=(15, 6))
+    plt.step(t_shifted, i[window], 'k-', linewidth=3, where='mid', label='Исходный ток')
+    plt.plot(t_shifted, filtered_i[window], 'k:', linewidth=2, label='После фильтра')
+    plt.xlabel('Время, нс', fontsize=20)
+    plt.ylabel('Ток, А', fontsize=20)
+    plt.title('Импульс до и после фильтрации', fontsize=18)
+    plt.legend(loc='upper right', fontsize=16)
+    plt.grid(True, linestyle='-', alpha=0.7, which="both")
+    plt.tick_params(axis='both', labelsize=20)
+    plt.subplots_adjust(bottom=0.15, top=0.95)
+    plt.show()
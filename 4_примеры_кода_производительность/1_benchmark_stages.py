@@ -0,0 +1,360 @@
+"""
+Измеряет время и пиковую память каждого этапа обработки: загрузка, перевод в амперы,
+разбиение на промежутки, simple_filter/advanced_filter, поиск импульсов, поиск срезанных
+импульсов, расчет заряда, аппроксимация curve_fit и построение графика. Функции этапов
+берутся из самих скриптов репозитория, поэтому замеры меняются вместе с ними. Этапы
+запускаются на файле из sample_data и на синтетических сигналах разной длины, у которых
+уровень шума и плотность импульсов такие же, как в sample_data. Результаты сохраняются
+в JSON с привязкой к коммиту git и сравниваются с предыдущим запуском: если какой-то этап
+замедлился больше допустимого, скрипт завершается с ошибкой.
+"""
+
+import os
+import io
+import ast
+import json
+import time
+import shutil
+import tempfile
+import contextlib
+import tracemalloc
+import subprocess
+import warnings
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')  # Графики строятся без окон
+import matplotlib.pyplot as plt
+from scipy.integrate import trapezoid
+from scipy.optimize import curve_fit, OptimizeWarning
+
+warnings.simplefilter('ignore', OptimizeWarning)  # Плохо обусловленные подгонки не мешают замерам
+
+
+directory = '../sample_data'
+cases_directory = '../3_примеры_кода_кейсы'
+results_file = 'benchmark_results.json'
+sizes = [10**5, 10**6, 10**7]  # Для нагрузочных тестов можно добавить 10**8
+batch_size = 10000             # Длина промежутка, как в 2_show_plots.py
+tolerance = 0.25               # Допустимое замедление относительно прошлого запуска (25%)
+min_total_time = 0.2           # Этап повторяется, пока суммарное время не превысит это значение
+min_regression_time = 0.001    # Замедление меньше 1 мс считается шумом измерения
+global_max = 0.0158561733376   # Предел шкалы по току (max_current_actual из current_limits.json)
+
+
+def load_function(script, name):
+    """
+    Берет функцию из скрипта репозитория. Выполняются только импорты скрипта и
+    определение функции, а пример на уровне модуля (загрузка файлов, графики) не запускается
+    """
+    with open(script, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=script)
+    nodes = [node for node in tree.body
+             if isinstance(node, (ast.Import, ast.ImportFrom))
+             or (isinstance(node, ast.FunctionDef) and node.name == name)]
+    namespace = {}
+    exec(compile(ast.Module(body=nodes, type_ignores=[]), script, 'exec'), namespace)
+    return namespace[name]
+
+
+split_experimental_data_into_batches = load_function(
+    '../1_примеры_кода_загрузка_данных/4_batch_process.py', 'split_experimental_data_into_batches')
+simple_filter = load_function(
+    os.path.join(cases_directory, '2_кейс_визуальные_подсказки/1_basic_filtering.py'), 'simple_filter')
+advanced_filter = load_function(
+    os.path.join(cases_directory, '2_кейс_визуальные_подсказки/2_advanced_filtering_with_hints.py'), 'advanced_filter')
+find_and_save_impulses = load_function(
+    os.path.join(cases_directory, '1_кейс_сбор_тестового_набора/1_collect_test_set.py'), 'find_and_save_impulses')
+find_and_save_clipped_impulses = load_function(
+    os.path.join(cases_directory, '3_кейс_срезанные_импульсы/1_detect_clipped_impulses.py'), 'find_and_save_clipped_impulses')
+
+
+def run_quietly(function, *args):
+    """
+    Запускает функцию репозитория во временной директории без вывода на экран:
+    find_and_save_impulses сохраняет импульсы в saved_impulses/ текущей директории
+    и печатает результат каждого вызова
+    """
+    previous = os.getcwd()
+    os.chdir(work_directory)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            return function(*args)
+    finally:
+        os.chdir(previous)
+
+
+def load_saved_impulses():
+    """Импульсы, сохраненные find_and_save_impulses при последнем запуске, как (t, i)"""
+    impulse_directory = os.path.join(work_directory, 'saved_impulses')
+    impulses = []
+    for filename in sorted(os.listdir(impulse_directory)):
+        with np.load(os.path.join(impulse_directory, filename)) as data:
+            impulses.append((data['t'], data['i']))
+    return impulses
+
+
+def clear_saved_impulses():
+    impulse_directory = os.path.join(work_directory, 'saved_impulses')
+    for filename in os.listdir(impulse_directory):
+        os.remove(os.path.join(impulse_directory, filename))
+
+
+def impulse_stats(impulses):
+    """Заряд, длительность и амплитуда каждого импульса, как в 3_calculate_stats.py (там это код без функции)"""
+    return [(trapezoid(i, t), t[-1] - t[0], np.max(np.abs(i))) for t, i in impulses]
+
+
+def fit_impulses(impulses, max_fits=20):
+    """Аппроксимация импульсов моделью из 1_basic_approximation.py (там это код без функции)"""
+    fits = 0
+    for t_impulse, i_impulse in impulses[:max_fits]:
+        t_peak = t_impulse[np.argmax(i_impulse)]
+
+        def impulse_model(t, A, k, lambda_):
+            sigmoid = np.exp(-k * (t - t_peak))
+            exponential = np.where(t > t_peak, np.exp(-lambda_ * (t - t_peak)), 1)
+            return A * sigmoid * exponential
+
+        try:
+            curve_fit(impulse_model, t_impulse, i_impulse, p0=[np.max(i_impulse), 5.0, 1.0], maxfev=40000)
+            fits += 1
+        except RuntimeError:
+            pass
+    return fits
+
+
+def render_plot(t, i):
+    """Строит полный график тока, как в 2_show_plots.py, и рисует его в память"""
+    fig, ax = plt.subplots(figsize=(15, 6), dpi=100)
+    ax.step((t - t[0]) * 1e9, i, 'k-', linewidth=3)
+    fig.canvas.draw()
+    plt.close(fig)
+
+
+def measure_sample_data(paths):
+    """
+    Уровень шума и импульсы sample_data, по которым строятся синтетические сигналы:
+    СКО тока в промежутках без импульсов, число импульсов в каждом промежутке
+    batch_size каждого файла (массив файлы × промежутки) и сами импульсы без базовой
+    линии. Импульсы ищет find_and_save_impulses; повторное срабатывание внутри импульса
+    дает окно с тем же началом, такие повторы не учитываются
+    """
+    noise = []
+    counts = []
+    impulses = []
+    for filepath in paths:
+        try:
+            with np.load(filepath) as data:
+                raw_data = data['data']
+        except Exception as e:
+            print(f"Ошибка при загрузке файла {filepath}: {e}")
+            continue
+        t = raw_data[0]
+        i = raw_data[2] / 50  # Конвертируем в амперы
+        dt = (t[-1] - t[0]) / (len(t) - 1)
+
+        clear_saved_impulses()
+        run_quietly(find_and_save_impulses, os.path.abspath(filepath))
+        positions = []
+        for t_impulse, i_impulse in load_saved_impulses():
+            position = int(round((t_impulse[0] - t[0]) / dt))
+            if position in positions:
+                continue
+            positions.append(position)
+            # Базовая линия - по отступам padding=5 по краям окна, где импульса уже нет
+            impulses.append(i_impulse - np.median(np.concatenate((i_impulse[:5], i_impulse[-5:]))))
+        n_batches = len(t) // batch_size
+        counts.append(np.bincount(np.array(positions, dtype=int) // batch_size, minlength=n_batches)[:n_batches])
+
+        blocks = i[:n_batches * batch_size].reshape(n_batches, batch_size)
+        quiet = np.max(np.abs(blocks - np.median(blocks, axis=1, keepdims=True)), axis=1) < 0.0005
+        noise.extend(np.std(blocks[quiet], axis=1))
+
+    # В sample_data все файлы одной длины, поэтому числа импульсов складываются в прямоугольный массив
+    return {'noise': float(np.median(noise)), 'counts': np.array(counts), 'impulses': impulses}
+
+
+def make_synthetic_trace(n, statistics, seed=0):
+    """
+    Синтетический сигнал: квантованный шум, емкостной ток и импульсы. Число импульсов
+    в промежутках batch_size повторяет случайно выбранные файлы sample_data подряд, а сами
+    импульсы - копии найденных там же. Поэтому импульсы так же собраны в те же фазы
+    напряжения, а не рассыпаны по всему сигналу, и детекторы работают так же, как на
+    настоящих данных
+    """
+    rng = np.random.default_rng(seed)
+    dt = 5e-10
+    t = np.arange(n) * dt
+    v = 2000 * np.sin(2 * np.pi * 30000 * t)
+    i = 1.478774e-04 * np.sin(2 * np.pi * 30000 * t + np.pi / 2) + rng.normal(0, statistics['noise'], n)
+
+    longest = max(len(impulse) for impulse in statistics['impulses'])
+    counts = statistics['counts']
+    batches_per_file = counts.shape[1]
+    files = rng.integers(len(counts), size=n // (batches_per_file * batch_size) + 1)
+    for batch_start in range(0, n - longest, batch_size):
+        batch = batch_start // batch_size
+        count = counts[files[batch // batches_per_file], batch % batches_per_file]
+        positions = rng.integers(batch_start, min(batch_start + batch_size, n - longest), count)
+        for position in positions:
+            impulse = statistics['impulses'][rng.integers(len(statistics['impulses']))]
+            i[position:position + len(impulse)] += impulse
+
+    # Квантование как у АЦП и срез на максимуме шкалы
+    step = 7.396986880e-05
+    i = np.round(i / step) * step
+    i = np.minimum(i, global_max)
+    return t, v, i
+
+
+def synthetic_raw_file(n, path, statistics):
+    t, v, i = make_synthetic_trace(n, statistics)
+    np.savez(path, data=np.vstack((t, v, i * 50, np.zeros(n))))
+
+
+def run_stage(function, *args):
+    """Возвращает лучшее время из нескольких повторов и пиковую память отдельного запуска"""
+    times = []
+    total = 0.0
+    while not times or (total < min_total_time and len(times) < 10):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        times.append(elapsed)
+        total += elapsed
+        if elapsed > 1.0:
+            break
+
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak, result
+
+
+def benchmark_file(filepath, label):
+    """Прогоняет все этапы на одном файле и возвращает словарь {этап: (время, память)}"""
+    results = {}
+    filepath = os.path.abspath(filepath)
+
+    def load():
+        with np.load(filepath) as data:
+            return data['data']
+
+    stage_time, peak, raw_data = run_stage(load)
+    results['load'] = (stage_time, peak)
+    t = raw_data[0]
+    v = raw_data[1]
+
+    stage_time, peak, i = run_stage(lambda: raw_data[2] / 50)
+    results['convert'] = (stage_time, peak)
+
+    stage_time, peak, batches = run_stage(lambda: split_experimental_data_into_batches(
+        {'t': t, 'v': v, 'i': i}, batch_size=batch_size, overlap=100))
+    results['split_batches'] = (stage_time, peak)
+
+    stage_time, peak, flags = run_stage(lambda: [simple_filter(batch['i']) for batch in batches])
+    results['simple_filter'] = (stage_time, peak)
+
+    stage_time, peak, _ = run_stage(lambda: [advanced_filter(batch['i']) for batch in batches])
+    results['advanced_filter'] = (stage_time, peak)
+
+    # Функции репозитория сами загружают файл, поэтому в их время входит и загрузка
+    clear_saved_impulses()
+    stage_time, peak, n_impulses = run_stage(run_quietly, find_and_save_impulses, filepath)
+    results['find_impulses'] = (stage_time, peak)
+    impulses = load_saved_impulses()
+
+    stage_time, peak, _ = run_stage(run_quietly, find_and_save_clipped_impulses, filepath, global_max)
+    results['find_clipped'] = (stage_time, peak)
+
+    stage_time, peak, _ = run_stage(impulse_stats, impulses)
+    results['trapezoid_stats'] = (stage_time, peak)
+
+    stage_time, peak, _ = run_stage(fit_impulses, impulses)
+    results['curve_fit'] = (stage_time, peak)
+
+    # Полный график длинного сигнала строится слишком долго, ограничиваемся 10^6 точек
+    if len(t) <= 10**6:
+        stage_time, peak, _ = run_stage(render_plot, t, i)
+        results['plot'] = (stage_time, peak)
+
+    print(f"\n{label}: {len(t)} точек, {n_impulses} импульсов, "
+          f"промежутков с событиями {sum(flags)} из {len(flags)}")
+    for stage, (stage_time, peak) in results.items():
+        print(f"  {stage:<16} {stage_time * 1000:10.2f} мс  {peak / 2**20:8.2f} МБ")
+    return {stage: {'time': stage_time, 'peak_bytes': peak} for stage, (stage_time, peak) in results.items()}
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+
+def compare_with_previous(history, commit, results):
+    """Сравнивает с последним запуском на другом коммите и возвращает список регрессий"""
+    previous = [entry for entry in history if entry['commit'] != commit]
+    if not previous:
+        print("\nПредыдущих результатов нет, сравнивать не с чем")
+        return []
+
+    baseline = previous[-1]
+    print(f"\nСравнение с коммитом {baseline['commit']}:")
+    regressions = []
+    for dataset, stages in results.items():
+        for stage, value in stages.items():
+            old = baseline['results'].get(dataset, {}).get(stage)
+            if old is None:
+                continue
+            ratio = value['time'] / old['time']
+            if ratio > 1 + tolerance and value['time'] - old['time'] > min_regression_time:
+                regressions.append(f"{dataset}/{stage}: в {ratio:.2f} раза медленнее")
+    return regressions
+
+
+npz_files = [f for f in os.listdir(directory) if f.endswith('.npz')]
+npz_files.sort()
+
+# Рабочая директория для файлов, которые сохраняют функции репозитория
+work_directory = tempfile.mkdtemp()
+os.makedirs(os.path.join(work_directory, 'saved_impulses'))
+
+results = {}
+results['sample_data'] = benchmark_file(os.path.join(directory, npz_files[0]), f"sample_data ({npz_files[0]})")
+
+statistics = measure_sample_data([os.path.join(directory, f) for f in npz_files])
+print(f"\nsample_data: шум тока {statistics['noise']:.3e} А, импульсов на промежуток {np.mean(statistics['counts']):.2f}, "
+      f"промежутков без импульсов {np.mean(statistics['counts'] == 0) * 100:.0f}%")
+
+# Синтетические файлы зависят от sample_data, поэтому параметры входят в имя файла
+os.makedirs('benchmark_data', exist_ok=True)
+synthetic_key = f"{statistics['noise']:.3e}_{len(statistics['impulses'])}"
+for n in sizes:
+    path = os.path.join('benchmark_data', f'synthetic_{n}_{synthetic_key}.npz')
+    if not os.path.exists(path):
+        synthetic_raw_file(n, path, statistics)
+    results[f'synthetic_{n}'] = benchmark_file(path, f"Синтетический сигнал {n}")
+shutil.rmtree(work_directory)
+
+history = []
+if os.path.exists(results_file):
+    with open(results_file, 'r') as f:
+        history = json.load(f)
+
+commit = current_commit()
+regressions = compare_with_previous(history, commit, results)
+
+history = [entry for entry in history if entry['commit'] != commit]
+history.append({'commit': commit, 'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': results})
+with open(results_file, 'w') as f:
+    json.dump(history, f, indent=1)
+print(f"Результаты сохранены в {results_file} (коммит {commit})")
+
+if regressions:
+    print("Обнаружено замедление:")
+    for regression in regressions:
+        print(f"  {regression}")
+    exit(1)
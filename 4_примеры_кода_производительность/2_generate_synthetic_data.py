@@ -0,0 +1,143 @@
+"""
+Генерирует синтетические файлы измерений в том же формате, что и sample_data:
+массив 4×N (время, напряжение, ток на 50 Ом, дополнительный канал) и имя вида
+<префикс>_<R>Ohm_<V>V_<F>kHz_<номер>.npz. В сигнал добавляются импульсы формы
+impulse_model из кейса 4, емкостной ток, шум, квантование АЦП и срез на обоих пределах
+шкалы. Параметры всех добавленных импульсов записываются в таблицу ground_truth.csv,
+по которой можно проверять детекторы. Файлы генерируются параллельно.
+"""
+
+import os
+import csv
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+
+output_directory = 'synthetic_data'
+prefix = '+current'
+resistance = 50         # Ом
+voltages = [1800, 2000]  # В, для каждого напряжения создается n_files файлов
+frequency = 30          # кГц
+n_files = 20
+n_samples = 100000
+dt = 5e-10              # Шаг по времени, с
+t0 = -9.6875e-06        # Время первой точки, как в sample_data
+seed = 2024
+
+impulses_per_file = 40
+amplitude_range = (0.001, 0.03)      # Амплитуда импульсов, А
+rise_time_range = (1e-9, 4e-9)       # Характерное время нарастания, с
+fall_time_range = (3e-9, 2e-8)       # Характерное время спада, с
+impulse_length = 200                 # Число точек, на которое добавляется каждый импульс
+
+noise_std = 1e-4                     # Шум тока, А
+voltage_step = 80.4019968            # Шаг АЦП канала напряжения, В (сетка от нуля, как в sample_data)
+current_step = 0.00369849344         # Шаг АЦП канала тока в исходных единицах (7.397e-05 А после деления на 50 Ом)
+current_rail = 0.0158561733376       # Верхний предел шкалы по току, А; лежит на сетке АЦП тока
+current_rail_low = -0.0029321733376  # Нижний предел, А: на 254 шага ниже верхнего, его достигает каждый файл sample_data
+extra_level = -0.00403211264         # Четвертый канал: в sample_data он стоит на одном уровне АЦП (±1 шаг)
+capacitor_current_amp = 1.478774e-04
+capacitor_current_delay = -7.068553539992742e-06
+
+
+def impulse_model(t, t_peak, A, k, lambda_):
+    """Та же аналитическая модель, что и в 1_basic_approximation.py"""
+    sigmoid = np.exp(-k * (t - t_peak))
+    exponential = np.where(t > t_peak, np.exp(-lambda_ * (t - t_peak)), 1)
+    return A * sigmoid * exponential
+
+
+def generate_file(task):
+    """Генерирует один файл и возвращает список добавленных в него импульсов"""
+    filename, voltage, file_seed = task
+    rng = np.random.default_rng(file_seed)
+
+    t = t0 + np.arange(n_samples) * dt
+    omega = 2 * np.pi * frequency * 1000
+    phase = rng.uniform(0, 2 * np.pi)
+    v = voltage * np.sin(omega * t + phase)
+
+    # Емкостной ток опережает напряжение, как в кейсе 5
+    i = capacitor_current_amp * np.sin(omega * (t - capacitor_current_delay) + phase)
+    i += rng.normal(0, noise_std, n_samples)
+
+    # Импульсы: при k = -1/rise до пика идет рост, после пика спад со скоростью 1/fall
+    peaks = np.sort(rng.integers(20, n_samples - impulse_length, impulses_per_file))
+    amplitudes = rng.uniform(*amplitude_range, impulses_per_file) * np.sign(v[peaks] + 1e-12)
+    rise_times = rng.uniform(*rise_time_range, impulses_per_file)
+    fall_times = rng.uniform(*fall_time_range, impulses_per_file)
+
+    # Все импульсы считаются одним векторным вызовом на сетке (импульс × точка)
+    offsets = np.arange(-20, impulse_length - 20)
+    relative_t = offsets[None, :] * dt
+    k = -1 / rise_times[:, None]
+    lambda_ = 1 / rise_times[:, None] + 1 / fall_times[:, None]
+    shapes = impulse_model(relative_t, 0.0, amplitudes[:, None], k, lambda_)
+    indices = peaks[:, None] + offsets[None, :]
+    np.add.at(i, indices, shapes)
+
+    # Квантование АЦП в исходных единицах файла и срез на обоих пределах шкалы. Сетка тока
+    # сдвинута относительно нуля, поэтому отсчитывается от верхнего предела, который на ней лежит
+    rail = current_rail * resistance
+    rail_low = current_rail_low * resistance
+    i_raw = rail + np.round((i * resistance - rail) / current_step) * current_step
+    clipped = (i_raw >= rail) | (i_raw <= rail_low)
+    i_raw = np.clip(i_raw, rail_low, rail)
+    v = np.round(v / voltage_step) * voltage_step
+
+    extra = np.full(n_samples, extra_level)  # Четвертый канал в формате файла
+    raw_data = np.vstack((t, v, i_raw, extra))
+    np.savez(os.path.join(output_directory, filename), data=raw_data)
+
+    # Окна соседних импульсов перекрываются: срезанная точка относится к импульсу,
+    # который дает в ней наибольший вклад, чтобы не считать ее у соседа
+    strongest = np.zeros(n_samples)
+    np.maximum.at(strongest, indices, np.abs(shapes))
+    own_clipped = clipped[indices] & (np.abs(shapes) >= strongest[indices])
+
+    events = []
+    for peak, amplitude, rise, fall, window in zip(peaks, amplitudes, rise_times, fall_times, own_clipped):
+        events.append({
+            'file': filename,
+            'peak_index': int(peak),
+            'peak_time': float(t[peak]),
+            'amplitude': float(amplitude),
+            'rise_time': float(rise),
+            'fall_time': float(fall),
+            'clipped_points': int(np.sum(window))
+        })
+    return events
+
+
+if __name__ == '__main__':
+    os.makedirs(output_directory, exist_ok=True)
+
+    # У каждого файла свой независимый генератор случайных чисел
+    seeds = np.random.SeedSequence(seed).spawn(n_files * len(voltages))
+    tasks = []
+    for voltage in voltages:
+        for number in range(1, n_files + 1):
+            filename = f"{prefix}_{resistance}Ohm_{voltage}V_{frequency}kHz_{number:06d}.npz"
+            tasks.append((filename, voltage, seeds[len(tasks)]))
+
+    start_time = time.perf_counter()
+    all_events = []
+    with ProcessPoolExecutor() as executor:
+        for events in executor.map(generate_file, tasks, chunksize=4):
+            all_events.extend(events)
+    elapsed = time.perf_counter() - start_time
+
+    with open(os.path.join(output_directory, 'ground_truth.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(all_events[0].keys()))
+        writer.writeheader()
+        writer.writerows(all_events)
+
+    total_bytes = len(tasks) * 4 * n_samples * 8
+    print(f"Создано {len(tasks)} файлов ({total_bytes / 2**20:.1f} МБ) за {elapsed:.2f} с "
+          f"({total_bytes / 2**20 / elapsed:.1f} МБ/с)")
+    clipped_events = [e for e in all_events if e['clipped_points'] > 0]
+    print(f"Импульсов: {len(all_events)}, из них срезанных: {len(clipped_events)} "
+          f"(на верхнем пределе {sum(e['amplitude'] > 0 for e in clipped_events)}, "
+          f"на нижнем {sum(e['amplitude'] < 0 for e in clipped_events)})")
+    print(f"Таблица импульсов: {os.path.join(output_directory, 'ground_truth.csv')}")
@@ -0,0 +1,260 @@
+"""
+Обрабатывает все файлы датасета (загрузка, перевод в амперы, фильтрация, поиск импульсов,
+расчет заряда, аппроксимация, построение графика) и замеряет каждый этап: время работы,
+процессорное время, прочитанные байты, пиковое выделение памяти и число найденных событий.
+Замеры пишутся построчно в JSON (по строке на этап каждого файла), а в конце выводится
+сводка, показывающая, какие этапы занимают больше всего времени. Когда замеры отключены,
+обертка этапа ничего не делает и почти не влияет на скорость.
+"""
+
+import os
+import io
+import json
+import time
+import tracemalloc
+import warnings
+from contextlib import contextmanager, nullcontext
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')  # Графики строятся без окон
+import matplotlib.pyplot as plt
+from scipy.integrate import trapezoid
+from scipy.optimize import curve_fit, OptimizeWarning
+
+warnings.simplefilter('ignore', OptimizeWarning)
+
+
+directory = '../sample_data'
+metrics_file = 'metrics.jsonl'
+metrics_enabled = True  # False - замеры отключены
+track_memory = True     # Учет памяти через tracemalloc заметно замедляет работу, его можно отключить
+
+metrics_output = None
+disabled_record = {}  # Сюда пишут этапы, когда замеры отключены; содержимое никуда не попадает
+
+
+@contextmanager
+def measured_stage(name, filename):
+    record = {'file': filename, 'stage': name}
+    if track_memory:
+        tracemalloc.reset_peak()
+        memory_start = tracemalloc.get_traced_memory()[0]
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield record
+    except Exception as e:
+        record['error'] = str(e)
+        raise
+    finally:
+        record['wall_time'] = time.perf_counter() - wall_start
+        record['cpu_time'] = time.process_time() - cpu_start
+        if track_memory:
+            # Пик считаем относительно памяти, занятой до начала этапа
+            record['peak_bytes'] = tracemalloc.get_traced_memory()[1] - memory_start
+        metrics_output.write(json.dumps(record) + '\n')
+
+
+def stage(name, filename):
+    """
+    Оборачивает этап обработки. Внутри блока можно дописать в запись
+    счетчики, например record['events'] = 5 или record['bytes_read'] = 1024.
+    """
+    if not metrics_enabled:
+        return nullcontext(disabled_record)
+    return measured_stage(name, filename)
+
+
+def split_experimental_data_into_batches(data, batch_size, overlap=0):
+    batches = []
+    data_length = len(data['t'])
+
+    for i in range(0, data_length, batch_size):
+        start = max(i - overlap, 0)
+        end = min(i + batch_size + overlap, data_length)
+
+        batch = {
+            't': data['t'][start:end],
+            'v': data['v'][start:end],
+            'i': data['i'][start:end],
+            'batch_index': len(batches)
+        }
+        batches.append(batch)
+
+    return batches
+
+
+def advanced_filter(batch_data):
+    data = np.asarray(batch_data)
+    data_shifted = data - np.mean(data)
+
+    # Параметры
+    chunk_size = 50
+    overlap = 14
+    q_threshold = 0.007515
+    h_threshold = 0.025
+
+    # Проверяем по амплитуде
+    if np.max(data_shifted) > h_threshold or np.min(data_shifted) < -h_threshold:
+        return True, []
+
+    # Проверяем по площади в сегментах и собираем потенциальные события
+    potential_events = []
+    step = chunk_size - overlap
+    for start in range(0, len(data_shifted) - chunk_size + 1, step):
+        chunk = data_shifted[start:start + chunk_size]
+        area = np.trapezoid(chunk)
+        if abs(area) > q_threshold:
+            potential_events.append([start, start + chunk_size])
+            return True, potential_events
+
+    return False, []
+
+
+def find_impulses(i, current_threshold=0.001, derivative_threshold=0.0003, noise_threshold=0.0005, min_duration=10, padding=5):
+    """Цикл поиска импульсов из find_and_save_impulses без сохранения в файлы"""
+    di_dt = np.diff(i)
+    above_current_threshold = np.abs(i) > current_threshold
+    at_noise_level = np.abs(i) <= noise_threshold
+    impulse_starts = []
+    impulse_ends = []
+    in_impulse = False
+    for idx, (is_above, is_noise) in enumerate(zip(above_current_threshold, at_noise_level)):
+        if is_above and not in_impulse:
+            start_idx = idx
+            while start_idx > 0 and np.abs(di_dt[start_idx-1]) > derivative_threshold:
+                start_idx -= 1
+            impulse_starts.append(start_idx)
+            in_impulse = True
+        elif (not is_above or is_noise) and in_impulse:
+            end_idx = idx
+            while end_idx < len(di_dt) and np.abs(di_dt[end_idx]) > derivative_threshold:
+                end_idx += 1
+            impulse_ends.append(end_idx)
+            in_impulse = False
+
+    return [(max(0, start - padding), min(len(i), end + padding))
+            for start, end in zip(impulse_starts, impulse_ends) if end - start >= min_duration]
+
+
+def fit_impulse(t_impulse, i_impulse):
+    """Аппроксимация импульса моделью из 1_basic_approximation.py"""
+    t_peak = t_impulse[np.argmax(i_impulse)]
+
+    def impulse_model(t, A, k, lambda_):
+        sigmoid = np.exp(-k * (t - t_peak))
+        exponential = np.where(t > t_peak, np.exp(-lambda_ * (t - t_peak)), 1)
+        return A * sigmoid * exponential
+
+    popt, pcov = curve_fit(impulse_model, t_impulse, i_impulse, p0=[np.max(i_impulse), 5.0, 1.0], maxfev=40000)
+    return popt
+
+
+def process_file(filename, max_fits=5):
+    filepath = os.path.join(directory, filename)
+
+    with stage('load', filename) as record:
+        with np.load(filepath) as data:
+            raw_data = data['data']
+        record['bytes_read'] = os.path.getsize(filepath)
+
+    with stage('convert', filename):
+        t = raw_data[0]
+        v = raw_data[1]
+        i = raw_data[2] / 50  # Конвертируем в амперы
+
+    with stage('filter', filename) as record:
+        batches = split_experimental_data_into_batches({'t': t, 'v': v, 'i': i}, batch_size=10000, overlap=100)
+        flagged = [batch for batch in batches if advanced_filter(batch['i'])[0]]
+        record['events'] = len(flagged)
+
+    with stage('detect', filename) as record:
+        impulses = find_impulses(i)
+        record['events'] = len(impulses)
+
+    with stage('stats', filename) as record:
+        charges = [trapezoid(i[start:end], t[start:end]) for start, end in impulses]
+        record['events'] = len(charges)
+
+    with stage('fit', filename) as record:
+        fits = 0
+        for start, end in impulses[:max_fits]:
+            try:
+                fit_impulse(t[start:end], i[start:end])
+                fits += 1
+            except RuntimeError:
+                pass
+        record['events'] = fits
+
+    with stage('render', filename) as record:
+        if flagged:
+            batch = flagged[0]
+            fig, ax = plt.subplots(figsize=(15, 6), dpi=100)
+            ax.step((batch['t'] - batch['t'][0]) * 1e9, batch['i'], 'k-', linewidth=3)
+            buffer = io.BytesIO()
+            fig.savefig(buffer, format='png')
+            plt.close(fig)
+            record['bytes_written'] = buffer.tell()
+
+
+def print_report(path, top=5):
+    """Сводка по файлу замеров: суммарное время по этапам и самые медленные этапы"""
+    with open(path, 'r') as f:
+        records = [json.loads(line) for line in f]
+    if not records:
+        print("Замеров нет")
+        return
+
+    total_wall = sum(r['wall_time'] for r in records)
+    stages = {}
+    for r in records:
+        summary = stages.setdefault(r['stage'], {'wall': 0.0, 'cpu': 0.0, 'count': 0, 'peak': 0,
+                                                 'events': 0, 'bytes_read': 0})
+        summary['wall'] += r['wall_time']
+        summary['cpu'] += r['cpu_time']
+        summary['count'] += 1
+        summary['peak'] = max(summary['peak'], r.get('peak_bytes', 0))
+        summary['events'] += r.get('events', 0)
+        summary['bytes_read'] += r.get('bytes_read', 0)
+
+    failed = set(r['file'] for r in records if 'error' in r)
+    n_files = len(set(r['file'] for r in records) - failed)
+    print(f"\nСводка по {n_files} файлам (с ошибкой: {len(failed)}), общее время этапов {total_wall:.2f} с:")
+    print(f"  {'этап':<8} {'время, с':>9} {'доля':>7} {'ЦП, с':>8} {'на файл, мс':>12} {'пик, МБ':>8} {'событий':>8}")
+    for name, s in sorted(stages.items(), key=lambda item: -item[1]['wall']):
+        print(f"  {name:<8} {s['wall']:9.3f} {s['wall'] / total_wall:7.1%} {s['cpu']:8.3f} "
+              f"{s['wall'] / s['count'] * 1000:12.2f} {s['peak'] / 2**20:8.2f} {s['events']:8d}")
+
+    read = stages.get('load', {}).get('bytes_read', 0)
+    if read:
+        print(f"  Прочитано {read / 2**20:.1f} МБ, скорость загрузки {read / 2**20 / stages['load']['wall']:.1f} МБ/с")
+
+    print("\nСамые медленные этапы:")
+    for r in sorted(records, key=lambda r: -r['wall_time'])[:top]:
+        print(f"  {r['file']} / {r['stage']}: {r['wall_time'] * 1000:.2f} мс")
+
+
+npz_files = [f for f in os.listdir(directory) if f.endswith('.npz')]
+npz_files.sort()
+
+if metrics_enabled:
+    metrics_output = open(metrics_file, 'w')
+    if track_memory:
+        tracemalloc.start()
+
+start_time = time.perf_counter()
+processed = 0
+for filename in npz_files:
+    try:
+        process_file(filename)
+        processed += 1
+    except Exception as e:
+        print(f"Ошибка при обработке файла {filename}: {e}")
+elapsed = time.perf_counter() - start_time
+print(f"Обработано {processed} из {len(npz_files)} файлов за {elapsed:.2f} с")
+
+if metrics_enabled:
+    if track_memory:
+        tracemalloc.stop()
+    metrics_output.close()
+    print_report(metrics_file)
@@ -0,0 +1,249 @@
+"""
+Запускает цепочку обработки (загрузка → фильтрация → поиск импульсов → статистика) с
+кэшированием результатов каждого этапа на диске. Ключ кэша строится из идентичности
+входного файла (путь, размер, время изменения), параметров этапа, текста функции этапа
+и вызываемых ею вспомогательных функций, а также ключей этапов, от которых он зависит. Поэтому при изменении параметра одного этапа
+пересчитываются только он и зависящие от него этапы. Когда кэш превышает заданный
+размер, удаляются давно не использованные записи.
+"""
+
+import os
+import json
+import time
+import pickle
+import hashlib
+import inspect
+import numpy as np
+from scipy.integrate import trapezoid
+
+
+directory = '../sample_data'
+cache_directory = 'stage_cache'
+max_cache_bytes = 200 * 2**20  # Предельный размер кэша
+
+
+def split_experimental_data_into_batches(data, batch_size, overlap=0):
+    batches = []
+    data_length = len(data['t'])
+
+    for i in range(0, data_length, batch_size):
+        start = max(i - overlap, 0)
+        end = min(i + batch_size + overlap, data_length)
+
+        batch = {
+            't': data['t'][start:end],
+            'v': data['v'][start:end],
+            'i': data['i'][start:end],
+            'batch_index': len(batches),
+            'start': start
+        }
+        batches.append(batch)
+
+    return batches
+
+
+def advanced_filter(batch_data, chunk_size=50, overlap=14, q_threshold=0.007515, h_threshold=0.025):
+    data = np.asarray(batch_data)
+    data_shifted = data - np.mean(data)
+
+    # Проверяем по амплитуде
+    if np.max(data_shifted) > h_threshold or np.min(data_shifted) < -h_threshold:
+        return True, []
+
+    # Проверяем по площади в сегментах и собираем потенциальные события
+    potential_events = []
+    step = chunk_size - overlap
+    for start in range(0, len(data_shifted) - chunk_size + 1, step):
+        chunk = data_shifted[start:start + chunk_size]
+        area = np.trapezoid(chunk)
+        if abs(area) > q_threshold:
+            potential_events.append([start, start + chunk_size])
+            return True, potential_events
+
+    return False, []
+
+
+# Этапы обработки. Каждый получает результаты этапов-зависимостей и свои параметры
+
+def load_stage(filepath):
+    with np.load(filepath) as data:
+        raw_data = data['data']
+    return {'t': raw_data[0], 'v': raw_data[1], 'i': raw_data[2] / 50}  # Конвертируем в амперы
+
+
+def filter_stage(load, batch_size, overlap, q_threshold, h_threshold):
+    batches = split_experimental_data_into_batches(load, batch_size=batch_size, overlap=overlap)
+    flagged = []
+    for batch in batches:
+        verdict, potential_events = advanced_filter(batch['i'], q_threshold=q_threshold, h_threshold=h_threshold)
+        if verdict:
+            flagged.append((batch['batch_index'], batch['start'], potential_events))
+    return flagged
+
+
+def detect_stage(load, current_threshold, derivative_threshold, noise_threshold, min_duration, padding):
+    i = load['i']
+    di_dt = np.diff(i)
+    above_current_threshold = np.abs(i) > current_threshold
+    at_noise_level = np.abs(i) <= noise_threshold
+    impulse_starts = []
+    impulse_ends = []
+    in_impulse = False
+    for idx, (is_above, is_noise) in enumerate(zip(above_current_threshold, at_noise_level)):
+        if is_above and not in_impulse:
+            start_idx = idx
+            while start_idx > 0 and np.abs(di_dt[start_idx-1]) > derivative_threshold:
+                start_idx -= 1
+            impulse_starts.append(start_idx)
+            in_impulse = True
+        elif (not is_above or is_noise) and in_impulse:
+            end_idx = idx
+            while end_idx < len(di_dt) and np.abs(di_dt[end_idx]) > derivative_threshold:
+                end_idx += 1
+            impulse_ends.append(end_idx)
+            in_impulse = False
+
+    return [(max(0, start - padding), min(len(i), end + padding))
+            for start, end in zip(impulse_starts, impulse_ends) if end - start >= min_duration]
+
+
+def stats_stage(load, detect):
+    t = load['t']
+    i = load['i']
+    return [{'start': start, 'end': end,
+             'charge': trapezoid(i[start:end], t[start:end]),
+             'duration': t[end - 1] - t[start],
+             'amplitude': np.max(np.abs(i[start:end]))}
+            for start, end in detect]
+
+
+# Описание цепочки: функция, параметры, зависимости и нужно ли кэшировать результат.
+# В helpers перечислены функции, которые вызывает этап: их текст тоже входит в ключ,
+# иначе после исправления advanced_filter из кэша читались бы старые результаты.
+# Загрузка не кэшируется - исходный файл и так лежит на диске
+pipeline = {
+    'load': {'function': load_stage, 'params': {}, 'depends': [], 'cache': False},
+    'filter': {'function': filter_stage, 'depends': ['load'], 'cache': True,
+               'helpers': [split_experimental_data_into_batches, advanced_filter],
+               'params': {'batch_size': 10000, 'overlap': 100, 'q_threshold': 0.007515, 'h_threshold': 0.025}},
+    'detect': {'function': detect_stage, 'depends': ['load'], 'cache': True,
+               'params': {'current_threshold': 0.001, 'derivative_threshold': 0.0003,
+                          'noise_threshold': 0.0005, 'min_duration': 10, 'padding': 5}},
+    'stats': {'function': stats_stage, 'params': {}, 'depends': ['load', 'detect'], 'cache': True},
+}
+
+
+def file_identity(filepath):
+    stat = os.stat(filepath)
+    return f"{os.path.abspath(filepath)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+
+def stage_key(name, input_keys):
+    """Ключ этапа: хэш от имени, параметров, текста функции и ее помощников и ключей входных данных"""
+    stage = pipeline[name]
+    content = json.dumps({
+        'stage': name,
+        'params': stage['params'],
+        'code': [inspect.getsource(function) for function in [stage['function']] + stage.get('helpers', [])],
+        'inputs': input_keys
+    }, sort_keys=True)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def evict_cache():
+    """Удаляет самые давно использованные записи, пока кэш не станет меньше max_cache_bytes"""
+    entries = []
+    for filename in os.listdir(cache_directory):
+        path = os.path.join(cache_directory, filename)
+        stat = os.stat(path)
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_cache_bytes:
+            break
+        os.remove(path)
+        total -= size
+
+
+def run_pipeline(filepath, targets, counters):
+    """Вычисляет этапы targets для файла, используя кэш. Возвращает словарь результатов"""
+    results = {}
+    keys = {}
+
+    def key_of(name):
+        # Ключ считается без вычисления самих этапов: по цепочке зависимостей до файла
+        if name not in keys:
+            depends = pipeline[name]['depends']
+            input_keys = [key_of(dependency) for dependency in depends] if depends else [file_identity(filepath)]
+            keys[name] = stage_key(name, input_keys)
+        return keys[name]
+
+    def compute(name):
+        if name in results:
+            return results[name]
+        stage = pipeline[name]
+        path = os.path.join(cache_directory, f"{name}_{key_of(name)}.pkl")
+
+        if stage['cache'] and os.path.exists(path):
+            with open(path, 'rb') as f:
+                results[name] = pickle.load(f)
+            os.utime(path)  # Отмечаем запись как недавно использованную
+            counters['hits'] += 1
+            return results[name]
+
+        # Промах: вычисляем зависимости и сам этап
+        inputs = [compute(dependency) for dependency in stage['depends']]
+        if not stage['depends']:
+            inputs = [filepath]
+        start_time = time.perf_counter()
+        results[name] = stage['function'](*inputs, **stage['params'])
+        counters['compute_time'][name] = counters['compute_time'].get(name, 0.0) + time.perf_counter() - start_time
+
+        if stage['cache']:
+            # Пишем во временный файл и переименовываем: прерванная запись или параллельный
+            # запуск не оставят в кэше недописанный файл под настоящим именем
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, 'wb') as f:
+                pickle.dump(results[name], f)
+            os.replace(temp_path, path)
+            counters['misses'] += 1
+        return results[name]
+
+    for target in targets:
+        compute(target)
+    return results
+
+
+def run_all(npz_files, label):
+    counters = {'hits': 0, 'misses': 0, 'compute_time': {}}
+    start_time = time.perf_counter()
+    n_impulses = 0
+    n_flagged = 0
+    for filename in npz_files:
+        try:
+            results = run_pipeline(os.path.join(directory, filename), ['filter', 'stats'], counters)
+        except Exception as e:
+            print(f"Ошибка при обработке файла {filename}: {e}")
+            continue
+        n_impulses += len(results['stats'])
+        n_flagged += len(results['filter'])
+    evict_cache()
+
+    elapsed = time.perf_counter() - start_time
+    computed = ', '.join(f"{name} {t:.2f} с" for name, t in counters['compute_time'].items()) or 'ничего'
+    print(f"{label}: {elapsed:.2f} с, попаданий в кэш {counters['hits']}, промахов {counters['misses']}")
+    print(f"  Пересчитано: {computed}")
+    print(f"  Промежутков с импульсами: {n_flagged}, импульсов: {n_impulses}")
+
+
+os.makedirs(cache_directory, exist_ok=True)
+npz_files = [f for f in os.listdir(directory) if f.endswith('.npz')]
+npz_files.sort()
+
+run_all(npz_files, "Первый запуск")
+run_all(npz_files, "Повторный запуск")
+
+# Меняем параметр поиска импульсов: фильтрация остается в кэше, пересчитываются detect и stats
+pipeline['detect']['params']['current_threshold'] = 0.002
+run_all(npz_files, "Изменен порог тока")
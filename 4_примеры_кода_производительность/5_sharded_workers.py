@@ -0,0 +1,292 @@
+"""
+Распределяет обработку датасета между независимыми процессами-обработчиками, которые
+могут работать на разных машинах с общей файловой системой. Список файлов делится на
+части (шарды); обработчик берет шард, создавая файл аренды в общей директории, и
+периодически продлевает аренду. Если обработчик упал, его аренда устаревает и шард
+забирает другой. Частичные результаты шардов (пределы тока, каталог импульсов,
+гистограмма амплитуд) затем объединяются на этапе свертки.
+
+Запуск:
+    python3 5_sharded_workers.py              - локальная проверка на одной машине
+    python3 5_sharded_workers.py worker <имя>  - один обработчик (на любой машине)
+    python3 5_sharded_workers.py reduce       - объединение результатов
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import random
+import threading
+import numpy as np
+from multiprocessing import Process
+
+
+directory = '../sample_data'
+work_directory = 'shared_run'  # Должна быть доступна всем машинам
+shard_size = 4                 # Файлов в одном шарде
+lease_timeout = 10.0           # Через столько секунд без продления аренда считается брошенной
+n_workers = 4
+histogram_edges = np.linspace(-0.02, 0.02, 81)  # Общие границы, чтобы гистограммы можно было складывать
+
+
+def find_impulses(i, current_threshold=0.001, derivative_threshold=0.0003, noise_threshold=0.0005, min_duration=10, padding=5):
+    """Цикл поиска импульсов из find_and_save_impulses без сохранения в файлы"""
+    di_dt = np.diff(i)
+    above_current_threshold = np.abs(i) > current_threshold
+    at_noise_level = np.abs(i) <= noise_threshold
+    impulse_starts = []
+    impulse_ends = []
+    in_impulse = False
+    for idx, (is_above, is_noise) in enumerate(zip(above_current_threshold, at_noise_level)):
+        if is_above and not in_impulse:
+            start_idx = idx
+            while start_idx > 0 and np.abs(di_dt[start_idx-1]) > derivative_threshold:
+                start_idx -= 1
+            impulse_starts.append(start_idx)
+            in_impulse = True
+        elif (not is_above or is_noise) and in_impulse:
+            end_idx = idx
+            while end_idx < len(di_dt) and np.abs(di_dt[end_idx]) > derivative_threshold:
+                end_idx += 1
+            impulse_ends.append(end_idx)
+            in_impulse = False
+
+    return [(max(0, start - padding), min(len(i), end + padding))
+            for start, end in zip(impulse_starts, impulse_ends) if end - start >= min_duration]
+
+
+def list_shards():
+    """Шарды строятся из отсортированного списка файлов, поэтому одинаковы у всех обработчиков"""
+    npz_files = sorted(f for f in os.listdir(directory) if f.endswith('.npz'))
+    return [npz_files[start:start + shard_size] for start in range(0, len(npz_files), shard_size)]
+
+
+def write_atomic(path, content):
+    """Записывает файл целиком: сначала во временный, затем переименованием"""
+    temporary = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(temporary, 'w') as f:
+        f.write(content)
+    os.replace(temporary, path)
+
+
+def try_acquire(lease_path, owner):
+    """
+    Пытается взять аренду. Новый файл создается атомарно (O_EXCL). Устаревшая аренда
+    перезаписывается, после чего проверяется, что она принадлежит нам. Если два
+    обработчика одновременно заберут один шард, он просто посчитается дважды:
+    результат шарда не зависит от обработчика и записывается атомарно.
+    """
+    try:
+        fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        with os.fdopen(fd, 'w') as f:
+            f.write(owner)
+        return True
+    except FileExistsError:
+        pass
+
+    try:
+        age = time.time() - os.path.getmtime(lease_path)
+    except FileNotFoundError:
+        return False
+    if age < lease_timeout:
+        return False
+
+    # Аренда брошена - забираем ее
+    write_atomic(lease_path, owner)
+    time.sleep(0.05)
+    try:
+        with open(lease_path, 'r') as f:
+            return f.read() == owner
+    except FileNotFoundError:
+        return False
+
+
+def renew(lease_path):
+    os.utime(lease_path)
+
+
+def keep_lease(lease_path, stop):
+    """
+    Продлевает аренду каждые lease_timeout / 4 секунд, пока не выставлен stop. Работает
+    в отдельном потоке, поэтому аренда не устаревает, даже если один файл обрабатывается
+    дольше lease_timeout, и шард не забирает второй обработчик
+    """
+    while not stop.wait(lease_timeout / 4):
+        try:
+            renew(lease_path)
+        except FileNotFoundError:
+            return
+
+
+def process_shard(files):
+    """Обрабатывает файлы шарда и возвращает частичный результат"""
+    result = {'files': [], 'errors': [], 'min_current': float('inf'), 'max_current': -float('inf'),
+              'histogram': np.zeros(len(histogram_edges) - 1, dtype=int), 'events': []}
+
+    for filename in files:
+        try:
+            with np.load(os.path.join(directory, filename)) as data:
+                raw_data = data['data']
+                t = raw_data[0]
+                i = raw_data[2] / 50  # Конвертируем в амперы
+        except Exception as e:
+            result['errors'].append(f"{filename}: {e}")
+            continue
+
+        impulses = find_impulses(i)
+        amplitudes = [float(i[start:end][np.argmax(np.abs(i[start:end]))]) for start, end in impulses]
+
+        result['files'].append(filename)
+        result['min_current'] = min(result['min_current'], float(np.min(i)))
+        result['max_current'] = max(result['max_current'], float(np.max(i)))
+        result['histogram'] += np.histogram(amplitudes, bins=histogram_edges)[0]
+        result['events'].extend([[filename, start, end, float(t[start]), amplitude]
+                                 for (start, end), amplitude in zip(impulses, amplitudes)])
+
+    result['histogram'] = result['histogram'].tolist()
+    return result
+
+
+def run_worker(name, crash_after_acquire=False):
+    """Берет свободные шарды, пока они не закончатся"""
+    leases = os.path.join(work_directory, 'leases')
+    results = os.path.join(work_directory, 'results')
+    os.makedirs(leases, exist_ok=True)
+    os.makedirs(results, exist_ok=True)
+
+    owner = f"{name}@{socket.gethostname()}:{os.getpid()}"
+    shards = list_shards()
+    processed = 0
+
+    while True:
+        pending = [n for n in range(len(shards))
+                   if not os.path.exists(os.path.join(results, f"shard_{n:05d}.json"))]
+        if not pending:
+            break
+
+        # Обработчики перебирают шарды в разном порядке, чтобы реже сталкиваться
+        random.Random(owner).shuffle(pending)
+        acquired = None
+        for number in pending:
+            lease_path = os.path.join(leases, f"shard_{number:05d}.lease")
+            if try_acquire(lease_path, owner):
+                acquired = number
+                break
+
+        if acquired is None:
+            # Все оставшиеся шарды в работе: ждем, пока они завершатся или их аренда устареет
+            time.sleep(min(1.0, lease_timeout / 4))
+            continue
+
+        if crash_after_acquire:
+            # Имитация падения: аренда остается, но больше не продлевается
+            print(f"[{name}] взял шард {acquired} и упал")
+            os._exit(1)
+
+        lease_path = os.path.join(leases, f"shard_{acquired:05d}.lease")
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=keep_lease, args=(lease_path, stop), daemon=True)
+        heartbeat.start()
+        try:
+            result = process_shard(shards[acquired])
+        finally:
+            stop.set()
+            heartbeat.join()
+        result['worker'] = owner
+        write_atomic(os.path.join(results, f"shard_{acquired:05d}.json"), json.dumps(result))
+        try:
+            os.remove(lease_path)
+        except FileNotFoundError:
+            pass
+        processed += 1
+
+    print(f"[{name}] обработано шардов: {processed}")
+
+
+def reduce_results():
+    """Объединяет частичные результаты всех шардов"""
+    shards = list_shards()
+    results_directory = os.path.join(work_directory, 'results')
+
+    summary = {'min_current': float('inf'), 'max_current': -float('inf'),
+               'histogram': np.zeros(len(histogram_edges) - 1, dtype=int), 'files': 0, 'errors': []}
+    events = []
+    workers = {}
+    missing = []
+    for number in range(len(shards)):
+        path = os.path.join(results_directory, f"shard_{number:05d}.json")
+        if not os.path.exists(path):
+            missing.append(number)
+            continue
+        with open(path, 'r') as f:
+            result = json.load(f)
+        summary['min_current'] = min(summary['min_current'], result['min_current'])
+        summary['max_current'] = max(summary['max_current'], result['max_current'])
+        summary['histogram'] += np.array(result['histogram'])
+        summary['files'] += len(result['files'])
+        summary['errors'].extend(result['errors'])
+        events.extend(result['events'])
+        workers[result['worker']] = workers.get(result['worker'], 0) + 1
+
+    events.sort(key=lambda event: (event[0], event[1]))
+    summary['events'] = len(events)
+    summary['histogram'] = summary['histogram'].tolist()
+    summary['histogram_edges'] = histogram_edges.tolist()
+
+    with open(os.path.join(work_directory, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=1)
+    with open(os.path.join(work_directory, 'events.csv'), 'w') as f:
+        f.write('file,start,end,time,amplitude\n')
+        for event in events:
+            f.write(','.join(str(value) for value in event) + '\n')
+
+    print(f"Обработано файлов: {summary['files']}, импульсов: {summary['events']}")
+    print(f"Ток: от {summary['min_current']:.6f} до {summary['max_current']:.6f} А")
+    for worker, count in sorted(workers.items()):
+        print(f"  {worker}: {count} шардов")
+    for error in summary['errors']:
+        print(f"  Ошибка: {error}")
+    if missing:
+        print(f"Не обработаны шарды: {missing}")
+
+
+def run_local(count, crash_first=False):
+    """Запускает count обработчиков на этой машине с чистой рабочей директорией"""
+    for subdirectory in ('leases', 'results'):
+        path = os.path.join(work_directory, subdirectory)
+        if os.path.isdir(path):
+            for filename in os.listdir(path):
+                os.remove(os.path.join(path, filename))
+
+    start_time = time.perf_counter()
+    if crash_first:
+        crashed = Process(target=run_worker, args=('worker-crash', True))
+        crashed.start()
+        crashed.join()
+
+    workers = [Process(target=run_worker, args=(f"worker-{n}",)) for n in range(count)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start_time
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 3 and sys.argv[1] == 'worker':
+        run_worker(sys.argv[2])
+    elif len(sys.argv) >= 2 and sys.argv[1] == 'reduce':
+        reduce_results()
+    else:
+        # Локальная проверка: сравниваем скорость при разном числе обработчиков,
+        # затем запускаем обработчик, который падает, взяв шард
+        n_files = sum(len(files) for files in list_shards())
+        for count in sorted({1, n_workers}):
+            elapsed = run_local(count)
+            print(f"Обработчиков: {count}, {elapsed:.2f} с, {n_files / elapsed:.1f} файлов/с\n")
+
+        elapsed = run_local(n_workers, crash_first=True)
+        print(f"С упавшим обработчиком: {elapsed:.2f} с (включая ожидание аренды {lease_timeout:.0f} с)\n")
+        reduce_results()
@@ -0,0 +1,403 @@
+"""
+Собирает таблицу найденных импульсов и таблицу файлов (сопротивление, напряжение,
+частота, номер записи) и отвечает на запросы к ним без циклов по файлам. Таблицы
+хранятся по столбцам (словарь массивов NumPy), таблица импульсов соединяется с
+параметрами файлов по номеру файла. Для абсолютного времени и позиции строятся
+сортированные индексы, для интервалов импульсов - интервальный индекс, а агрегаты по
+группам считаются векторно. В конце таблица размножается до нескольких миллионов
+импульсов, чтобы замерить время ответа на запросы.
+"""
+
+import os
+import re
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.signal import find_peaks
+
+
+directories = ['../sample_data']
+# Синтетические записи (2_generate_synthetic_data.py) добавляются только по явному выбору:
+# directories = ['../sample_data', 'synthetic_data']. Имена их файлов совпадают с sample_data,
+# поэтому файлы различаются по директории
+benchmark_rows = 5_000_000  # До скольких строк размножить таблицу для замеров
+
+
+def extract_parameters_from_filename(filename):
+    # Паттерн для извлечения параметров из имени файла
+    match = re.search(r'(\d+)Ohm_(\d+)V_(\d+)kHz_(\d+)', filename)
+    if match:
+        return int(match.group(1)), int(match.group(2)), int(match.group(3)), int(match.group(4))
+    return None, None, None, None
+
+
+def find_impulses(i, current_threshold=0.001, derivative_threshold=0.0003, noise_threshold=0.0005, min_duration=10, padding=5):
+    """Цикл поиска импульсов из find_and_save_impulses без сохранения в файлы"""
+    di_dt = np.diff(i)
+    above_current_threshold = np.abs(i) > current_threshold
+    at_noise_level = np.abs(i) <= noise_threshold
+    impulse_starts = []
+    impulse_ends = []
+    in_impulse = False
+    for idx, (is_above, is_noise) in enumerate(zip(above_current_threshold, at_noise_level)):
+        if is_above and not in_impulse:
+            start_idx = idx
+            while start_idx > 0 and np.abs(di_dt[start_idx-1]) > derivative_threshold:
+                start_idx -= 1
+            impulse_starts.append(start_idx)
+            in_impulse = True
+        elif (not is_above or is_noise) and in_impulse:
+            end_idx = idx
+            while end_idx < len(di_dt) and np.abs(di_dt[end_idx]) > derivative_threshold:
+                end_idx += 1
+            impulse_ends.append(end_idx)
+            in_impulse = False
+
+    return [(max(0, start - padding), min(len(i), end + padding))
+            for start, end in zip(impulse_starts, impulse_ends) if end - start >= min_duration]
+
+
+def scan_file(filepath):
+    """Находит в файле импульсы и пики напряжения"""
+    with np.load(filepath) as data:
+        raw_data = data['data']
+        t = raw_data[0]
+        v = raw_data[1]
+        i = raw_data[2] / 50  # Конвертируем в амперы
+
+    impulses = find_impulses(i)
+    # Детектор может вернуть один импульс дважды - оставляем первый
+    starts = set()
+    unique = []
+    for start, end in impulses:
+        if start not in starts:
+            starts.add(start)
+            unique.append((start, end))
+    bounds = np.array(unique, dtype=np.int64).reshape(-1, 2)
+
+    peaks = []
+    charges = []
+    for start, end in bounds:
+        peaks.append(start + np.argmax(np.abs(i[start:end])))
+        charges.append(np.trapezoid(i[start:end], t[start:end]))
+
+    dt = t[1] - t[0]
+    period = 1 / (extract_parameters_from_filename(os.path.basename(filepath))[2] * 1000)
+    voltage_peaks, _ = find_peaks(v, distance=int(0.9 * period / dt), height=0.5 * np.max(v))
+
+    return {
+        'directory': os.path.dirname(filepath),
+        'filename': os.path.basename(filepath),
+        't0': t[0],
+        'dt': dt,
+        'n_samples': len(t),
+        'start': bounds[:, 0],
+        'end': bounds[:, 1],
+        'peak': np.array(peaks, dtype=np.int64),
+        'amplitude': i[np.array(peaks, dtype=np.int64)],
+        'charge': np.array(charges),
+        'voltage_peaks': voltage_peaks
+    }
+
+
+def build_tables(scans):
+    """
+    Таблица файлов, таблица импульсов и таблица пиков напряжения. Абсолютное время
+    записи считается по ее номеру: записи одной серии (одна директория и одинаковые R, V, F)
+    идут подряд, серии - друг за другом. Серия занимает (наибольший номер + 1) длительностей
+    записи, даже если часть записей отсутствует. Если известны настоящие времена начала
+    записей, их нужно записать в files['start_time'].
+    """
+    files = {'directory': [], 'filename': [], 'resistance': [], 'voltage': [], 'frequency': [], 'capture': [],
+             'n_samples': [], 'dt': [], 'start_time': []}
+    for scan in scans:
+        resistance, voltage, frequency, capture = extract_parameters_from_filename(scan['filename'])
+        files['directory'].append(scan['directory'])
+        files['filename'].append(scan['filename'])
+        files['resistance'].append(resistance)
+        files['voltage'].append(voltage)
+        files['frequency'].append(frequency)
+        files['capture'].append(capture)
+        files['n_samples'].append(scan['n_samples'])
+        files['dt'].append(scan['dt'])
+    files = {name: np.array(column) for name, column in files.items()}
+
+    duration = files['n_samples'] * files['dt']
+    _, directory_id = np.unique(files['directory'], return_inverse=True)
+    series = np.stack((directory_id, files['resistance'], files['voltage'], files['frequency']), axis=1)
+    _, series_id = np.unique(series, axis=0, return_inverse=True)
+    series_id = series_id.ravel()
+    series_span = np.zeros(series_id.max() + 1 if len(series_id) else 0)
+    np.maximum.at(series_span, series_id, (files['capture'] + 1) * duration)
+    series_offset = np.cumsum(np.r_[0, series_span])[:-1]
+    files['start_time'] = series_offset[series_id] + files['capture'] * duration
+
+    counts = [len(scan['start']) for scan in scans]
+    file_id = np.repeat(np.arange(len(scans)), counts)
+    events = {name: np.concatenate([scan[name] for scan in scans]) for name in ('start', 'end', 'peak', 'amplitude', 'charge')}
+    events['file_id'] = file_id
+    events['time'] = files['start_time'][file_id] + events['peak'] * files['dt'][file_id]
+    events['time_start'] = files['start_time'][file_id] + events['start'] * files['dt'][file_id]
+    events['time_end'] = files['start_time'][file_id] + events['end'] * files['dt'][file_id]
+
+    peak_counts = [len(scan['voltage_peaks']) for scan in scans]
+    peak_file_id = np.repeat(np.arange(len(scans)), peak_counts)
+    peak_position = np.concatenate([scan['voltage_peaks'] for scan in scans]).astype(np.int64)
+    voltage_peaks = {
+        'file_id': peak_file_id,
+        'position': peak_position,
+        'time': files['start_time'][peak_file_id] + peak_position * files['dt'][peak_file_id]
+    }
+    return files, events, voltage_peaks
+
+
+def join(table, files, columns):
+    """Добавляет к таблице столбцы файла, к которому относится строка"""
+    joined = dict(table)
+    for column in columns:
+        joined[column] = files[column][table['file_id']]
+    return joined
+
+
+def take(table, rows):
+    return {name: column[rows] for name, column in table.items()}
+
+
+def build_sorted_index(table, column):
+    """Сортированный индекс: порядок строк и отсортированные значения"""
+    order = np.argsort(table[column], kind='stable')
+    return {'column': column, 'order': order, 'values': table[column][order]}
+
+
+def build_interval_index(table, start_column, end_column):
+    """
+    Интервальный индекс: интервалы отсортированы по началу, и для каждой позиции
+    хранится наибольший конец среди предыдущих интервалов. Этот максимум не убывает,
+    поэтому первый кандидат на пересечение тоже находится двоичным поиском.
+    """
+    order = np.argsort(table[start_column], kind='stable')
+    ends = table[end_column][order]
+    return {'order': order, 'starts': table[start_column][order], 'ends': ends,
+            'max_end': np.maximum.accumulate(ends)}
+
+
+def expand_ranges(lo, hi):
+    """Склеивает диапазоны [lo, hi) в один массив индексов и номер диапазона для каждого"""
+    lengths = hi - lo
+    owner = np.repeat(np.arange(len(lo)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return lo[owner] + offsets, owner
+
+
+def range_query(index, low, high):
+    """Строки, где значение столбца лежит в [low, high]; low и high могут быть массивами"""
+    low = np.atleast_1d(low)
+    high = np.atleast_1d(high)
+    lo = np.searchsorted(index['values'], low, side='left')
+    hi = np.searchsorted(index['values'], high, side='right')
+    positions, owner = expand_ranges(lo, hi)
+    return index['order'][positions], owner
+
+
+def overlap_query(index, low, high):
+    """Строки, интервалы которых пересекаются с [low, high]"""
+    lo = np.searchsorted(index['max_end'], low, side='left')
+    hi = np.searchsorted(index['starts'], high, side='right')
+    candidates = np.arange(lo, max(lo, hi))
+    return index['order'][candidates[index['ends'][candidates] >= low]]
+
+
+def group_by(table, keys, aggregates):
+    """
+    Векторная группировка. aggregates: {имя результата: (столбец, функция)},
+    функции: count, sum, mean, min, max
+    """
+    # Целые ключи с небольшим диапазоном значений объединяются в один код без сортировки
+    n_rows = len(table[keys[0]])
+    if n_rows and all(np.issubdtype(table[key].dtype, np.integer) for key in keys):
+        lows = [table[key].min() for key in keys]
+        sizes = [int(table[key].max() - low) + 1 for key, low in zip(keys, lows)]
+        if np.prod(sizes, dtype=float) <= 4 * n_rows + 1024:
+            codes = np.zeros(n_rows, dtype=np.int64)
+            for key, low, size in zip(keys, lows, sizes):
+                codes = codes * size + (table[key] - low)
+            return group_by_dense(table, keys, codes, lows, sizes, aggregates)
+
+    key_columns = [table[key] for key in keys]
+    order = np.lexsort(key_columns[::-1])
+    sorted_keys = [column[order] for column in key_columns]
+    change = np.zeros(len(order), dtype=bool)
+    if len(order):
+        change[0] = True
+    for column in sorted_keys:
+        change[1:] |= column[1:] != column[:-1]
+    boundaries = np.flatnonzero(change)
+    counts = np.diff(np.r_[boundaries, len(order)])
+
+    result = {key: column[boundaries] for key, column in zip(keys, sorted_keys)}
+    for name, (column, how) in aggregates.items():
+        if how == 'count':
+            result[name] = counts
+            continue
+        values = table[column][order]
+        if how in ('sum', 'mean'):
+            sums = np.add.reduceat(values, boundaries) if len(boundaries) else values[:0]
+            result[name] = sums / counts if how == 'mean' else sums
+        elif how == 'min':
+            result[name] = np.minimum.reduceat(values, boundaries) if len(boundaries) else values[:0]
+        elif how == 'max':
+            result[name] = np.maximum.reduceat(values, boundaries) if len(boundaries) else values[:0]
+        else:
+            raise ValueError(f"Неизвестная функция агрегации: {how}")
+    return result
+
+
+def group_by_dense(table, keys, codes, lows, sizes, aggregates):
+    """Группировка по составному целому коду через bincount"""
+    n_codes = int(np.prod(sizes))
+    counts = np.bincount(codes, minlength=n_codes)
+    present = np.flatnonzero(counts)
+    result = {}
+    remainder = present
+    for key, low, size in reversed(list(zip(keys, lows, sizes))):
+        remainder, value = np.divmod(remainder, size)
+        result[key] = value + low
+    result = {key: result[key] for key in keys}
+    for name, (column, how) in aggregates.items():
+        if how == 'count':
+            result[name] = counts[present]
+        elif how in ('sum', 'mean'):
+            sums = np.bincount(codes, weights=table[column], minlength=n_codes)[present]
+            result[name] = sums / counts[present] if how == 'mean' else sums
+        elif how in ('min', 'max'):
+            function = np.minimum if how == 'min' else np.maximum
+            extreme = np.full(n_codes, np.inf if how == 'min' else -np.inf)
+            function.at(extreme, codes, table[column])
+            result[name] = extreme[present]
+        else:
+            raise ValueError(f"Неизвестная функция агрегации: {how}")
+    return result
+
+
+def replicate(files, events, voltage_peaks, n_rows):
+    """Размножает таблицы со сдвигом по времени, пока импульсов не станет не меньше n_rows"""
+    copies = max(1, -(-n_rows // max(1, len(events['file_id']))))
+    span = np.max(files['start_time'] + files['n_samples'] * files['dt'])
+    n_files = len(files['filename'])
+
+    big_files = {name: np.tile(column, copies) for name, column in files.items()}
+    big_files['start_time'] = big_files['start_time'] + np.repeat(np.arange(copies), n_files) * span
+
+    def shift(table, time_columns):
+        n = len(table['file_id'])
+        big = {name: np.tile(column, copies) for name, column in table.items()}
+        copy_number = np.repeat(np.arange(copies), n)
+        big['file_id'] = big['file_id'] + copy_number * n_files
+        for column in time_columns:
+            big[column] = big[column] + copy_number * span
+        return big
+
+    return (big_files, shift(events, ['time', 'time_start', 'time_end']),
+            shift(voltage_peaks, ['time']))
+
+
+def timed(function, *args, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start_time)
+    return result, best
+
+
+def events_after_voltage_peaks(files, events, time_index, voltage_peaks, voltage, window):
+    """Импульсы в течение window секунд после каждого пика напряжения записей с заданным напряжением"""
+    peaks = take(voltage_peaks, files['voltage'][voltage_peaks['file_id']] == voltage)
+    rows, owner = range_query(time_index, peaks['time'], peaks['time'] + window)
+    # Окно не должно выходить за пределы записи, в которой найден пик
+    same_file = events['file_id'][rows] == peaks['file_id'][owner]
+    return rows[same_file], owner[same_file]
+
+
+def rate_per_voltage(files, events):
+    """
+    Частота импульсов для каждого уровня напряжения: число импульсов на секунду записи.
+    Импульсы сначала считаются по файлам, и только короткая таблица файлов группируется
+    по напряжению
+    """
+    per_file = dict(files)
+    per_file['events'] = np.bincount(events['file_id'], minlength=len(files['filename']))
+    per_file['duration'] = files['n_samples'] * files['dt']
+    totals = group_by(per_file, ['voltage'], {'events': ('events', 'sum'), 'duration': ('duration', 'sum')})
+    return totals['voltage'], totals['events'].astype(int), totals['events'] / totals['duration']
+
+
+def run_queries(files, events, voltage_peaks, label):
+    print(f"\n{label}: файлов {len(files['filename'])}, импульсов {len(events['file_id'])}")
+
+    (time_index, interval_index, position_index), build_time = timed(
+        lambda: (build_sorted_index(events, 'time'),
+                 build_interval_index(events, 'time_start', 'time_end'),
+                 build_sorted_index(events, 'peak')), repeat=1)
+    print(f"  Построение индексов: {build_time * 1000:.1f} мс")
+
+    voltages = np.unique(files['voltage'])
+    voltage = 2000 if 2000 in voltages else voltages[0]
+    (rows, owner), elapsed = timed(events_after_voltage_peaks, files, events, time_index, voltage_peaks, voltage, 5e-6)
+    print(f"  Импульсы в течение 5 мкс после пиков напряжения записей {voltage} В: {len(rows)} "
+          f"(по {len(np.unique(owner))} пикам), {elapsed * 1000:.2f} мс")
+
+    (voltage_levels, counts, rates), elapsed = timed(rate_per_voltage, files, events)
+    print(f"  Частота импульсов по напряжениям ({elapsed * 1000:.2f} мс):")
+    for level, count, rate in zip(voltage_levels, counts, rates):
+        print(f"    {level} В: {count} импульсов, {rate:.3g} имп/с")
+
+    middle = np.median(events['time'])
+    rows, elapsed = timed(overlap_query, interval_index, middle, middle + 1e-3)
+    print(f"  Импульсы, пересекающиеся с окном 1 мс: {len(rows)}, {elapsed * 1000:.2f} мс")
+
+    (rows, _), elapsed = timed(range_query, position_index, 40000, 40100)
+    print(f"  Импульсы с пиком в отсчетах 40000-40100 любого файла: {len(rows)}, {elapsed * 1000:.2f} мс")
+
+    amplitudes = dict(events)
+    amplitudes['abs_amplitude'] = np.abs(events['amplitude'])
+    stats, elapsed = timed(group_by, amplitudes, ['file_id'],
+                           {'events': ('abs_amplitude', 'count'), 'mean_amplitude': ('abs_amplitude', 'mean'),
+                            'max_amplitude': ('abs_amplitude', 'max'), 'total_charge': ('charge', 'sum')})
+    stats = join(stats, files, ['voltage'])
+    busiest = np.argmax(stats['events'])
+    busiest_file = stats['file_id'][busiest]
+    print(f"  Статистика по файлам ({len(stats['events'])} групп), {elapsed * 1000:.2f} мс; "
+          f"больше всего импульсов в {os.path.join(files['directory'][busiest_file], files['filename'][busiest_file])} "
+          f"({stats['voltage'][busiest]} В): "
+          f"{stats['events'][busiest]}, средняя амплитуда {stats['mean_amplitude'][busiest]:.6f} А")
+
+    joined = join(events, files, ['voltage', 'capture'])
+    stats, elapsed = timed(group_by, joined, ['voltage', 'capture'], {'events': ('amplitude', 'count')})
+    print(f"  Число импульсов по напряжению и номеру записи ({len(stats['events'])} групп), {elapsed * 1000:.2f} мс")
+
+
+if __name__ == '__main__':
+    paths = []
+    for directory in directories:
+        if os.path.isdir(directory):
+            npz_files = [f for f in os.listdir(directory) if f.endswith('.npz')]
+            npz_files.sort()
+            paths.extend(os.path.join(directory, f) for f in npz_files)
+
+    scans = []
+    start_time = time.perf_counter()
+    with ProcessPoolExecutor() as executor:
+        futures = [executor.submit(scan_file, path) for path in paths]
+        for path, future in zip(paths, futures):
+            try:
+                scans.append(future.result())
+            except Exception as e:
+                print(f"Ошибка при обработке файла {path}: {e}")
+    print(f"Просмотрено {len(scans)} файлов за {time.perf_counter() - start_time:.2f} с")
+
+    files, events, voltage_peaks = build_tables(scans)
+    run_queries(files, events, voltage_peaks, "Исходная таблица")
+
+    big_files, big_events, big_voltage_peaks = replicate(files, events, voltage_peaks, benchmark_rows)
+    run_queries(big_files, big_events, big_voltage_peaks, "Размноженная таблица")
@@ -0,0 +1,388 @@
+"""
+Потоковые версии детекторов: поиск импульсов (find_and_save_impulses), поиск плато
+срезанных импульсов и advanced_filter по временным промежуткам. Данные подаются
+кусками фиксированного размера, а состояние между кусками (незакрытый импульс, начало
+участка крутой производной, импульсы, для которых еще ищется конец, незакрытое плато,
+хвост незавершенного промежутка) хранится в словаре детектора. Готовые события
+выдаются сразу после закрытия. Результаты совпадают с обработкой всего массива
+целиком, а память не зависит от длины записи.
+"""
+
+import os
+import time
+import zipfile
+import tracemalloc
+import numpy as np
+
+
+directories = ['../sample_data', 'synthetic_data']  # synthetic_data создается 2_generate_synthetic_data.py
+chunk_sizes = [97, 4096, 65536]  # Размеры кусков для проверки совпадения с обработкой целиком
+global_max = 0.0158561733376     # Предел шкалы по току (max_current_actual из current_limits.json)
+long_capture_repeats = 3         # Сколько раз прогнать все файлы одной длинной записью для замера памяти
+
+
+def iter_current_chunks(filepath, chunk_size):
+    """
+    Читает канал тока из npz по кускам, не загружая файл целиком. Для сжатых архивов
+    и массивов в порядке Fortran соседние отсчеты тока не лежат подряд - тогда файл
+    загружается полностью.
+    """
+    with zipfile.ZipFile(filepath) as archive:
+        with archive.open('data.npy') as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if fortran_order or archive.getinfo('data.npy').compress_type != zipfile.ZIP_STORED:
+                f.seek(0)
+                i = np.lib.format.read_array(f)[2] / 50
+                for start in range(0, len(i), chunk_size):
+                    yield i[start:start + chunk_size]
+                return
+
+            n_samples = shape[1]
+            f.seek(f.tell() + 2 * n_samples * dtype.itemsize)  # Пропускаем время и напряжение
+            for start in range(0, n_samples, chunk_size):
+                count = min(chunk_size, n_samples - start)
+                yield np.frombuffer(f.read(count * dtype.itemsize), dtype=dtype) / 50  # Конвертируем в амперы
+
+
+# Поиск импульсов
+
+def create_impulse_detector(current_threshold=0.001, derivative_threshold=0.0003, noise_threshold=0.0005, min_duration=10, padding=5):
+    return {
+        'current_threshold': current_threshold,
+        'derivative_threshold': derivative_threshold,
+        'noise_threshold': noise_threshold,
+        'min_duration': min_duration,
+        'padding': padding,
+        'position': 0,             # Сколько отсчетов уже получено
+        'last_sample': None,       # Последний отсчет, нужен для производной на стыке
+        'steep_run_start': None,   # Начало участка крутой производной, если он продолжается
+        'in_impulse': False,
+        'open_start': None,
+        'queue': []                # [начало, конец или None, отсчет, с которого ищется конец]
+    }
+
+
+def feed_impulse_detector(detector, chunk):
+    """Обрабатывает очередной кусок и возвращает импульсы, которые уже можно выдать"""
+    g = detector['position']
+    chunk = np.asarray(chunk)
+    if len(chunk) == 0:
+        return []
+
+    above = np.abs(chunk) > detector['current_threshold']
+    leave = ~above | (np.abs(chunk) <= detector['noise_threshold'])
+
+    # Производная в тех же точках, что и np.diff по всему массиву; d[0] - производная в отсчете d_offset
+    if detector['last_sample'] is None:
+        d = np.diff(chunk)
+        d_offset = g
+    else:
+        d = np.diff(np.concatenate(([detector['last_sample']], chunk)))
+        d_offset = g - 1
+    steep = np.abs(d) > detector['derivative_threshold']
+
+    # Начало участка крутой производной, в который входит каждая точка производной
+    indices = np.arange(len(d))
+    last_flat = np.maximum.accumulate(np.where(~steep, indices, -1)) if len(d) else indices
+    carried = detector['steep_run_start'] if detector['steep_run_start'] is not None else d_offset
+    run_start = np.where(last_flat >= 0, last_flat + 1 + d_offset, carried)
+    flat_positions = np.flatnonzero(~steep) + d_offset
+
+    # Переключения состояния ищутся двоичным поиском, а не перебором каждого отсчета
+    above_positions = np.flatnonzero(above) + g
+    leave_positions = np.flatnonzero(leave) + g
+    queue = detector['queue']
+    pos = g
+    while True:
+        if not detector['in_impulse']:
+            k = np.searchsorted(above_positions, pos)
+            if k == len(above_positions):
+                break
+            idx = above_positions[k]
+            # Граница уточняется назад, пока производная крутая
+            detector['open_start'] = 0 if idx == 0 else int(run_start[idx - 1 - d_offset])
+            detector['in_impulse'] = True
+        else:
+            k = np.searchsorted(leave_positions, pos)
+            if k == len(leave_positions):
+                break
+            idx = leave_positions[k]
+            queue.append([detector['open_start'], None, int(idx)])
+            detector['in_impulse'] = False
+        pos = idx + 1
+
+    # Конец импульса - первая точка после выхода, где производная уже не крутая
+    for item in queue:
+        if item[1] is None:
+            k = np.searchsorted(flat_positions, item[2])
+            if k < len(flat_positions):
+                item[1] = int(flat_positions[k])
+
+    if len(d):
+        detector['steep_run_start'] = int(run_start[-1]) if steep[-1] else None
+    detector['last_sample'] = chunk[-1]
+    detector['position'] = g + len(chunk)
+    return emit_impulses(detector, None)
+
+
+def emit_impulses(detector, n_samples):
+    """Выдает закрытые импульсы по порядку; n_samples известно только в конце записи"""
+    queue = detector['queue']
+    padding = detector['padding']
+    emitted = []
+    while queue:
+        start, end, _ = queue[0]
+        if end is None:
+            break
+        if end - start >= detector['min_duration']:
+            if n_samples is None and detector['position'] < end + padding:
+                break  # Еще неизвестно, не обрежет ли конец записи добавочные точки
+            limit = n_samples if n_samples is not None else end + padding
+            emitted.append((max(0, start - padding), min(limit, end + padding)))
+        queue.pop(0)
+    return emitted
+
+
+def finish_impulse_detector(detector):
+    """Конец записи: у незакрытых концов крутая производная дошла до последней точки"""
+    n_samples = detector['position']
+    for item in detector['queue']:
+        if item[1] is None:
+            item[1] = max(item[2], n_samples - 1)
+    return emit_impulses(detector, n_samples)
+
+
+# Плато срезанных импульсов
+
+def create_plateau_detector(max_current_value, min_plateau_length=3):
+    return {'max_current_value': max_current_value, 'min_plateau_length': min_plateau_length,
+            'position': 0, 'run_start': None}
+
+
+def feed_plateau_detector(detector, chunk):
+    g = detector['position']
+    if len(chunk) == 0:
+        return []
+    clipped = np.isclose(chunk, detector['max_current_value'], rtol=1e-10, atol=1e-15)
+    previous = 1 if detector['run_start'] is not None else 0
+    changes = np.diff(np.concatenate(([previous], clipped.astype(np.int8))))
+    starts = list(np.flatnonzero(changes == 1) + g)
+    ends = np.flatnonzero(changes == -1) + g
+
+    if detector['run_start'] is not None:
+        starts.insert(0, detector['run_start'])
+    plateaus = [(int(start), int(end)) for start, end in zip(starts, ends)
+                if end - start >= detector['min_plateau_length']]
+    detector['run_start'] = int(starts[-1]) if clipped[-1] else None
+    detector['position'] = g + len(chunk)
+    return plateaus
+
+
+def finish_plateau_detector(detector):
+    start = detector['run_start']
+    if start is not None and detector['position'] - start >= detector['min_plateau_length']:
+        return [(start, detector['position'])]
+    return []
+
+
+# advanced_filter по временным промежуткам
+
+def advanced_filter(batch_data, chunk_size=50, overlap=14, q_threshold=0.007515, h_threshold=0.025):
+    data = np.asarray(batch_data)
+    data_shifted = data - np.mean(data)
+
+    # Проверяем по амплитуде
+    if np.max(data_shifted) > h_threshold or np.min(data_shifted) < -h_threshold:
+        return True, []
+
+    # Проверяем по площади в сегментах и собираем потенциальные события
+    potential_events = []
+    step = chunk_size - overlap
+    for start in range(0, len(data_shifted) - chunk_size + 1, step):
+        chunk = data_shifted[start:start + chunk_size]
+        area = np.trapezoid(chunk)
+        if abs(area) > q_threshold:
+            potential_events.append([start, start + chunk_size])
+            return True, potential_events
+
+    return False, []
+
+
+def create_batch_filter(batch_size=10000, overlap=100):
+    return {'batch_size': batch_size, 'overlap': overlap, 'position': 0,
+            'buffer': np.empty(0), 'buffer_start': 0, 'batch_index': 0}
+
+
+def run_ready_batches(state, n_samples):
+    """Фильтрует промежутки, для которых уже получены все точки с перекрытием"""
+    size = state['batch_size']
+    overlap = state['overlap']
+    results = []
+    while True:
+        first = state['batch_index'] * size
+        if n_samples is None:
+            if state['position'] < first + size + overlap:
+                break
+            last = first + size + overlap
+        else:
+            if first >= n_samples:
+                break
+            last = min(first + size + overlap, n_samples)
+        start = max(first - overlap, 0)
+        batch = state['buffer'][start - state['buffer_start']:last - state['buffer_start']]
+        verdict, potential_events = advanced_filter(batch)
+        results.append((state['batch_index'], verdict, potential_events))
+        state['batch_index'] += 1
+
+    # Хвост буфера нужен только следующему промежутку
+    keep_from = max(state['batch_index'] * size - overlap, 0)
+    state['buffer'] = state['buffer'][keep_from - state['buffer_start']:]
+    state['buffer_start'] = keep_from
+    return results
+
+
+def feed_batch_filter(state, chunk):
+    state['buffer'] = np.concatenate((state['buffer'], chunk))
+    state['position'] += len(chunk)
+    return run_ready_batches(state, None)
+
+
+def finish_batch_filter(state):
+    return run_ready_batches(state, state['position'])
+
+
+def stream_file(chunks, max_current_value):
+    """Прогоняет куски через все три детектора"""
+    impulse_detector = create_impulse_detector()
+    plateau_detector = create_plateau_detector(max_current_value)
+    batch_filter = create_batch_filter()
+    impulses, plateaus, batches = [], [], []
+    for chunk in chunks:
+        impulses.extend(feed_impulse_detector(impulse_detector, chunk))
+        plateaus.extend(feed_plateau_detector(plateau_detector, chunk))
+        batches.extend(feed_batch_filter(batch_filter, chunk))
+    impulses.extend(finish_impulse_detector(impulse_detector))
+    plateaus.extend(finish_plateau_detector(plateau_detector))
+    batches.extend(finish_batch_filter(batch_filter))
+    return impulses, plateaus, batches
+
+
+# Исходные детекторы, работающие со всем массивом, - для проверки
+
+def find_impulses(i, current_threshold=0.001, derivative_threshold=0.0003, noise_threshold=0.0005, min_duration=10, padding=5):
+    """Цикл поиска импульсов из find_and_save_impulses без сохранения в файлы"""
+    di_dt = np.diff(i)
+    above_current_threshold = np.abs(i) > current_threshold
+    at_noise_level = np.abs(i) <= noise_threshold
+    impulse_starts = []
+    impulse_ends = []
+    in_impulse = False
+    for idx, (is_above, is_noise) in enumerate(zip(above_current_threshold, at_noise_level)):
+        if is_above and not in_impulse:
+            start_idx = idx
+            while start_idx > 0 and np.abs(di_dt[start_idx-1]) > derivative_threshold:
+                start_idx -= 1
+            impulse_starts.append(start_idx)
+            in_impulse = True
+        elif (not is_above or is_noise) and in_impulse:
+            end_idx = idx
+            while end_idx < len(di_dt) and np.abs(di_dt[end_idx]) > derivative_threshold:
+                end_idx += 1
+            impulse_ends.append(end_idx)
+            in_impulse = False
+
+    return [(max(0, start - padding), min(len(i), end + padding))
+            for start, end in zip(impulse_starts, impulse_ends) if end - start >= min_duration]
+
+
+def find_plateaus(i, max_current_value, min_plateau_length=3):
+    """Цикл поиска плато из find_and_save_clipped_impulses"""
+    clipped_points = np.isclose(i, max_current_value, rtol=1e-10, atol=1e-15)
+    clipped_impulses = []
+    current_sequence_start = None
+    current_sequence_length = 0
+    for idx, is_clipped in enumerate(clipped_points):
+        if is_clipped:
+            if current_sequence_start is None:
+                current_sequence_start = idx
+                current_sequence_length = 1
+            else:
+                current_sequence_length += 1
+        else:
+            if current_sequence_start is not None:
+                if current_sequence_length >= min_plateau_length:
+                    clipped_impulses.append((current_sequence_start, idx))
+                current_sequence_start = None
+                current_sequence_length = 0
+    if current_sequence_start is not None and current_sequence_length >= min_plateau_length:
+        clipped_impulses.append((current_sequence_start, len(i)))
+    return clipped_impulses
+
+
+def filter_batches(i, batch_size=10000, overlap=100):
+    """split_experimental_data_into_batches и advanced_filter для каждого промежутка"""
+    results = []
+    for n, first in enumerate(range(0, len(i), batch_size)):
+        start = max(first - overlap, 0)
+        end = min(first + batch_size + overlap, len(i))
+        verdict, potential_events = advanced_filter(i[start:end])
+        results.append((n, verdict, potential_events))
+    return results
+
+
+if __name__ == '__main__':
+    paths = []
+    for directory in directories:
+        if os.path.isdir(directory):
+            npz_files = [f for f in os.listdir(directory) if f.endswith('.npz')]
+            npz_files.sort()
+            paths.extend(os.path.join(directory, f) for f in npz_files)
+
+    # Проверка: потоковая обработка при разных размерах кусков совпадает с обработкой целиком
+    mismatches = 0
+    checked = []
+    totals = [0, 0, 0]
+    for path in paths:
+        try:
+            with np.load(path) as data:
+                i = data['data'][2] / 50
+        except Exception as e:
+            print(f"Ошибка при загрузке файла {path}: {e}")
+            continue
+
+        expected = (find_impulses(i), find_plateaus(i, global_max), filter_batches(i))
+        sizes = chunk_sizes + [1] if not checked else chunk_sizes  # Куски по одному отсчету - только на первом файле
+        for chunk_size in sizes:
+            result = stream_file(iter_current_chunks(path, chunk_size), global_max)
+            if result != expected:
+                mismatches += 1
+                print(f"Расхождение: {path}, размер куска {chunk_size}")
+        checked.append(path)
+        for n in range(3):
+            totals[n] += len(expected[n])
+
+    print(f"Проверено файлов: {len(checked)}, размеры кусков: {chunk_sizes} (и 1 на первом файле)")
+    print(f"Импульсов: {totals[0]}, плато: {totals[1]}, промежутков: {totals[2]}, расхождений: {mismatches}")
+
+    # Все файлы подряд как одна длинная запись: память не растет с ее длиной
+    def long_capture(chunk_size):
+        for _ in range(long_capture_repeats):
+            for path in checked:
+                yield from iter_current_chunks(path, chunk_size)
+
+    for chunk_size in (4096, 65536):
+        tracemalloc.start()
+        start_time = time.perf_counter()
+        impulses, plateaus, batches = stream_file(long_capture(chunk_size), global_max)
+        elapsed = time.perf_counter() - start_time
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        n_samples = long_capture_repeats * len(checked) * 100000
+        print(f"Длинная запись, {n_samples} отсчетов, куски по {chunk_size}: {elapsed:.2f} с, "
+              f"{n_samples / elapsed / 1e6:.1f} млн отсчетов/с, пик памяти {peak / 2**20:.2f} МБ "
+              f"(вся запись заняла бы {n_samples * 8 / 2**20:.0f} МБ); "
+              f"импульсов {len(impulses)}, плато {len(plateaus)}, промежутков {len(batches)}")
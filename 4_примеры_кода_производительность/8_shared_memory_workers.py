@@ -0,0 +1,260 @@
+"""
+Параллельная обработка без копирования данных между процессами. Записи загружаются
+обработчиками прямо в общий сегмент памяти (multiprocessing.shared_memory), результаты
+пишутся в общие массивы фиксированного размера, а в задачах передаются только короткие
+описания: имя сегмента, форма, тип и номер записи. Общий массив записей рассчитан на
+trace_slots записей и заполняется заново для каждой следующей группы файлов, поэтому
+память не растет с числом файлов. Импульсы ищет векторный детектор из
+7_streaming_detectors.py, результат совпадает с find_and_save_impulses. Сегменты создаются и удаляются
+главным процессом в одном месте, даже если обработка завершилась ошибкой. Для сравнения
+та же обработка выполняется обычным пулом процессов, который передает массивы целиком.
+"""
+
+import os
+import ast
+import time
+import pickle
+import zipfile
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+
+
+directory = '../sample_data'
+n_workers = os.cpu_count()
+trace_slots = 2 * n_workers  # Сколько записей одновременно лежит в общей памяти
+event_capacity = 4096        # Сколько импульсов файла помещается в общий массив результатов
+
+attached = {}  # Сегменты, уже подключенные в процессе-обработчике
+
+
+@contextmanager
+def shared_arena():
+    """Владеет всеми созданными сегментами и удаляет их при выходе"""
+    arena = {'segments': []}
+    try:
+        yield arena
+    finally:
+        for segment in arena['segments']:
+            segment.close()
+            segment.unlink()
+
+
+def allocate(arena, shape, dtype):
+    """Создает общий массив; возвращает его описание для обработчиков и сам массив"""
+    dtype = np.dtype(dtype)
+    size = max(1, int(np.prod(shape)) * dtype.itemsize)
+    segment = shared_memory.SharedMemory(create=True, size=size)
+    arena['segments'].append(segment)
+    descriptor = {'name': segment.name, 'shape': tuple(shape), 'dtype': dtype.str}
+    return descriptor, np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+
+
+def attach(descriptor):
+    """Подключает общий массив в обработчике; подключение переиспользуется между задачами"""
+    name = descriptor['name']
+    if name not in attached:
+        attached[name] = shared_memory.SharedMemory(name=name)
+    return np.ndarray(descriptor['shape'], dtype=descriptor['dtype'], buffer=attached[name].buf)
+
+
+def read_header(f):
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        return np.lib.format.read_array_header_1_0(f)
+    return np.lib.format.read_array_header_2_0(f)
+
+
+def load_into_slot(task):
+    """Читает файл прямо в свою строку общего массива записей, без промежуточного массива"""
+    traces_descriptor, slot, filepath = task
+    traces = attach(traces_descriptor)
+    try:
+        with zipfile.ZipFile(filepath) as archive:
+            with archive.open('data.npy') as f:
+                shape, fortran_order, dtype = read_header(f)
+                if shape != traces.shape[1:] or dtype != traces.dtype:
+                    return f"форма {shape} {dtype} не совпадает с {traces.shape[1:]} {traces.dtype}"
+                if fortran_order:
+                    f.seek(0)
+                    traces[slot] = np.lib.format.read_array(f)
+                else:
+                    view = memoryview(traces[slot]).cast('B')
+                    read = 0
+                    while read < len(view):
+                        count = f.readinto(view[read:])
+                        if not count:
+                            return "файл обрезан"
+                        read += count
+    except Exception as e:
+        return str(e)
+    return None
+
+
+# Поиск импульсов: векторный детектор из 7_streaming_detectors.py, вся запись подается одним куском
+
+def load_functions(script, *names):
+    """
+    Берет функции из скрипта репозитория. Выполняются только импорты скрипта и
+    определения функций, а пример на уровне модуля (загрузка файлов, графики) не запускается
+    """
+    with open(script, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=script)
+    nodes = [node for node in tree.body
+             if isinstance(node, (ast.Import, ast.ImportFrom))
+             or (isinstance(node, ast.FunctionDef) and node.name in names)]
+    namespace = {}
+    exec(compile(ast.Module(body=nodes, type_ignores=[]), script, 'exec'), namespace)
+    return tuple(namespace[name] for name in names)
+
+
+# Функции загружаются в одно пространство имен: feed и finish вызывают emit_impulses
+create_impulse_detector, feed_impulse_detector, emit_impulses, finish_impulse_detector = load_functions(
+    '7_streaming_detectors.py', 'create_impulse_detector', 'feed_impulse_detector', 'emit_impulses',
+    'finish_impulse_detector')
+
+
+def detect_and_measure(t, i):
+    """
+    Импульсы, найденные так же, как в find_and_save_impulses (с отступом padding).
+    Для каждого: начало, конец, амплитуда со знаком и заряд по формуле трапеций
+    """
+    detector = create_impulse_detector()
+    impulses = feed_impulse_detector(detector, i) + finish_impulse_detector(detector)
+    events = np.zeros((len(impulses), 4))
+    if len(impulses) == 0:
+        return events
+
+    # Окна импульсов могут перекрываться, поэтому суммы считаются через накопленную сумму
+    runs = np.array(impulses, dtype=np.int64)
+    starts = runs[:, 0]
+    ends = runs[:, 1]
+    dt = t[1] - t[0]
+    cumulative = np.concatenate(([0.0], np.cumsum(i)))
+    sums = cumulative[ends] - cumulative[starts]
+    peak_positions = [start + np.argmax(np.abs(i[start:end])) for start, end in runs]
+
+    events[:, 0] = starts
+    events[:, 1] = ends
+    events[:, 2] = i[peak_positions]
+    events[:, 3] = (sums - (i[starts] + i[ends - 1]) / 2) * dt
+    return events
+
+
+def analyze_slot(task):
+    """Обрабатывает запись из общего массива и пишет импульсы в общий массив результатов"""
+    traces_descriptor, results_descriptor, counts_descriptor, slot = task
+    traces = attach(traces_descriptor)
+    results = attach(results_descriptor)
+    counts = attach(counts_descriptor)
+
+    raw_data = traces[slot]
+    events = detect_and_measure(raw_data[0], raw_data[2] / 50)  # Конвертируем в амперы
+    stored = min(len(events), event_capacity)
+    results[slot, :stored] = events[:stored]
+    counts[slot] = len(events)  # Если импульсов больше, чем помещается, это видно по счетчику
+
+
+def analyze_array(raw_data):
+    """То же для обычного пула: массив приходит и результат уходит через pickle"""
+    return detect_and_measure(raw_data[0], raw_data[2] / 50)
+
+
+def run_shared(paths, n_samples):
+    events = {}
+    overflow = []
+    load_time = 0.0
+    analyze_time = 0.0
+    task_bytes = 0
+    with shared_arena() as arena:
+        n_slots = min(trace_slots, len(paths))
+        traces_descriptor, traces = allocate(arena, (n_slots, 4, n_samples), np.float64)
+        results_descriptor, results = allocate(arena, (n_slots, event_capacity, 4), np.float64)
+        counts_descriptor, counts = allocate(arena, (n_slots,), np.int64)
+
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            # Файлы проходят группами по n_slots: группа загружается в слоты, обрабатывается,
+            # ее результаты копируются, и слоты заполняет следующая группа
+            for first in range(0, len(paths), n_slots):
+                group = paths[first:first + n_slots]
+
+                start_time = time.perf_counter()
+                load_tasks = [(traces_descriptor, slot, path) for slot, path in enumerate(group)]
+                errors = list(executor.map(load_into_slot, load_tasks))
+                load_time += time.perf_counter() - start_time
+
+                start_time = time.perf_counter()
+                valid = [slot for slot, error in enumerate(errors) if error is None]
+                tasks = [(traces_descriptor, results_descriptor, counts_descriptor, slot) for slot in valid]
+                list(executor.map(analyze_slot, tasks))
+                analyze_time += time.perf_counter() - start_time
+
+                if tasks:
+                    task_bytes = len(pickle.dumps(tasks[0]))
+                for slot, error in enumerate(errors):
+                    if error is not None:
+                        print(f"Ошибка при загрузке файла {group[slot]}: {error}")
+                for slot in valid:
+                    events[first + slot] = results[slot, :min(counts[slot], event_capacity)].copy()
+                    if counts[slot] > event_capacity:
+                        overflow.append(group[slot])
+
+    if overflow:
+        print(f"Не поместились все импульсы для {len(overflow)} файлов, увеличьте event_capacity")
+    return events, load_time, analyze_time, task_bytes
+
+
+def run_pickled(paths):
+    events = {}
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        start_time = time.perf_counter()
+        arrays = {}
+        for slot, path in enumerate(paths):
+            try:
+                with np.load(path) as data:
+                    arrays[slot] = data['data']
+            except Exception as e:
+                print(f"Ошибка при загрузке файла {path}: {e}")
+        load_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        slots = list(arrays)
+        for slot, result in zip(slots, executor.map(analyze_array, [arrays[slot] for slot in slots])):
+            events[slot] = result
+        analyze_time = time.perf_counter() - start_time
+
+    task_bytes = len(pickle.dumps(arrays[slots[0]])) if slots else 0
+    return events, load_time, analyze_time, task_bytes
+
+
+if __name__ == '__main__':
+    npz_files = [f for f in os.listdir(directory) if f.endswith('.npz')]
+    npz_files.sort()
+    paths = [os.path.join(directory, f) for f in npz_files]
+
+    # Размер записи берется из заголовка первого читаемого файла
+    n_samples = None
+    for path in paths:
+        try:
+            with zipfile.ZipFile(path) as archive, archive.open('data.npy') as f:
+                n_samples = read_header(f)[0][1]
+            break
+        except Exception:
+            continue
+    if n_samples is None:
+        print("Не найдено ни одного читаемого файла")
+        exit(1)
+
+    print(f"Файлов: {len(paths)}, обработчиков: {n_workers}")
+    shared_events, shared_load, shared_analyze, shared_bytes = run_shared(paths, n_samples)
+    pickled_events, pickled_load, pickled_analyze, pickled_bytes = run_pickled(paths)
+
+    same = (shared_events.keys() == pickled_events.keys() and
+            all(np.array_equal(shared_events[slot], pickled_events[slot]) for slot in shared_events))
+    n_events = sum(len(events) for events in shared_events.values())
+    print(f"Импульсов: {n_events}, результаты совпадают: {same}")
+    print(f"Общая память:  загрузка {shared_load:.2f} с, обработка {shared_analyze:.2f} с, "
+          f"задача занимает {shared_bytes} байт")
+    print(f"Обычный пул:   загрузка {pickled_load:.2f} с, обработка {pickled_analyze:.2f} с, "
+          f"задача занимает {pickled_bytes / 2**20:.1f} МБ")
@@ -0,0 +1,297 @@
+"""
+Обработка данных по мере их поступления с осциллографа, без промежуточных npz файлов.
+Осциллограф заменяет встроенный имитатор: отдельный процесс, который с заданной
+скоростью отправляет блоки отсчетов тока через локальный сокет (Unix или TCP).
+Приемник на asyncio читает блоки в заранее выделенный кольцевой буфер, а потоковые
+детекторы импульсов и плато на обоих пределах шкалы (из 7_streaming_detectors.py)
+обрабатывают каждый блок в отдельном потоке, чтобы чтение сокета не останавливалось. Для каждой скорости
+выводятся задержка от отправки блока до конца его обработки, число блоков, не
+поместившихся в буфер, и число блоков, потерянных по дороге.
+"""
+
+import os
+import ast
+import time
+import socket
+import struct
+import asyncio
+import tempfile
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+directory = '../sample_data'
+socket_kind = 'unix' if hasattr(socket, 'AF_UNIX') else 'tcp'
+tcp_port = 50555
+block_size = 10000                     # Отсчетов в блоке
+ring_slots = 64                        # Блоков в кольцевом буфере
+input_rates = [5e6, 20e6, 100e6]       # Скорость имитатора, отсчетов в секунду
+run_duration = 3.0                     # Сколько секунд имитатор отправляет данные на каждой скорости
+send_buffer_limit = 4 * 2**20          # Сколько байт имитатор держит неотправленными, дальше блоки теряются
+global_max = 0.0158561733376           # Верхний предел шкалы по току (max_current_actual из current_limits.json)
+global_min = -0.0029321733376          # Нижний предел (min_current_actual); его достигает каждая запись sample_data
+
+header = struct.Struct('<qdq')         # Номер блока, время отправки, число отсчетов (0 - конец передачи)
+
+
+# Потоковые детекторы импульсов и плато из 7_streaming_detectors.py
+
+def load_functions(script, *names):
+    """
+    Берет функции из скрипта репозитория. Выполняются только импорты скрипта и
+    определения функций, а пример на уровне модуля (загрузка файлов, графики) не запускается
+    """
+    with open(script, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=script)
+    nodes = [node for node in tree.body
+             if isinstance(node, (ast.Import, ast.ImportFrom))
+             or (isinstance(node, ast.FunctionDef) and node.name in names)]
+    namespace = {}
+    exec(compile(ast.Module(body=nodes, type_ignores=[]), script, 'exec'), namespace)
+    return tuple(namespace[name] for name in names)
+
+
+# Функции загружаются в одно пространство имен: feed и finish вызывают emit_impulses
+(create_impulse_detector, feed_impulse_detector, emit_impulses, finish_impulse_detector,
+ create_plateau_detector, feed_plateau_detector, finish_plateau_detector) = load_functions(
+    '7_streaming_detectors.py', 'create_impulse_detector', 'feed_impulse_detector', 'emit_impulses',
+    'finish_impulse_detector', 'create_plateau_detector', 'feed_plateau_detector', 'finish_plateau_detector')
+
+
+# Имитатор осциллографа
+
+def load_current_blocks(paths):
+    """Канал тока всех читаемых файлов в исходных единицах, нарезанный на блоки"""
+    blocks = []
+    for path in paths:
+        try:
+            with np.load(path) as data:
+                raw_current = data['data'][2]
+        except Exception as e:
+            print(f"Ошибка при загрузке файла {path}: {e}")
+            continue
+        for start in range(0, len(raw_current) - block_size + 1, block_size):
+            blocks.append(raw_current[start:start + block_size].copy())
+    return blocks
+
+
+async def simulate(address, blocks, rate, ready):
+    """
+    Отправляет блоки по кругу с заданной скоростью. Как и настоящий прибор, имитатор не
+    ждет приемника: если неотправленных данных больше send_buffer_limit, блок теряется
+    """
+    done = asyncio.Event()
+
+    async def serve(reader, writer):
+        interval = block_size / rate
+        next_time = time.monotonic()
+        end_time = next_time + run_duration
+        seq = 0
+        while next_time < end_time:
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if writer.transport.get_write_buffer_size() < send_buffer_limit:
+                block = blocks[seq % len(blocks)]
+                writer.write(header.pack(seq, time.monotonic(), len(block)) + block.tobytes())
+            seq += 1
+            next_time += interval
+            if writer.transport.get_write_buffer_size() >= send_buffer_limit:
+                await asyncio.sleep(0)  # Даем циклу событий отправить данные
+        writer.write(header.pack(seq, time.monotonic(), 0))  # Конец передачи: номер - сколько блоков было
+        await writer.drain()
+        writer.close()
+        done.set()
+
+    if socket_kind == 'unix':
+        server = await asyncio.start_unix_server(serve, path=address)
+    else:
+        server = await asyncio.start_server(serve, host='127.0.0.1', port=address)
+    ready.set()
+    async with server:
+        await done.wait()
+
+
+def run_simulator(address, blocks, rate, ready):
+    asyncio.run(simulate(address, blocks, rate, ready))
+
+
+# Приемник
+
+def create_ring():
+    """Кольцевой буфер: место под блоки выделяется один раз"""
+    return {
+        'data': np.empty((ring_slots, block_size)),
+        'seq': np.zeros(ring_slots, dtype=np.int64),
+        'sent': np.zeros(ring_slots),
+        'head': 0,      # Сколько блоков записано
+        'tail': 0,      # Сколько блоков обработано
+        'dropped': 0,   # Блоки, которые пришли, когда буфер был полон
+    }
+
+
+def create_detectors(position=0):
+    """Детектор импульсов и детекторы плато на верхнем ('max') и нижнем ('min') пределах шкалы"""
+    impulse_detector = create_impulse_detector()
+    impulse_detector['position'] = position
+    # На нижнем пределе записи sample_data стоят ровно один отсчет (85 касаний, все по одному
+    # отсчету), поэтому там считается каждое касание, а не только плато от трех отсчетов
+    plateau_detectors = {'max': create_plateau_detector(global_max),
+                         'min': create_plateau_detector(global_min, min_plateau_length=1)}
+    for detector in plateau_detectors.values():
+        detector['position'] = position
+    return {'impulse': impulse_detector, 'plateau': plateau_detectors, 'next_seq': position // block_size}
+
+
+def feed_plateaus(detectors, i, plateaus):
+    for rail, detector in detectors['plateau'].items():
+        plateaus[rail].extend(feed_plateau_detector(detector, i))
+
+
+def finish_plateaus(detectors, plateaus):
+    for rail, detector in detectors['plateau'].items():
+        plateaus[rail].extend(finish_plateau_detector(detector))
+
+
+def process_block(state, ring, slot):
+    """Прогоняет блок через детекторы; выполняется в потоке обработки"""
+    seq = int(ring['seq'][slot])
+    if seq != state['detectors']['next_seq']:
+        # Пропущенные блоки: закрываем начатые события и продолжаем с правильной позиции
+        state['impulses'].extend(finish_impulse_detector(state['detectors']['impulse']))
+        finish_plateaus(state['detectors'], state['plateaus'])
+        state['detectors'] = create_detectors(seq * block_size)
+        state['gaps'] += 1
+
+    i = ring['data'][slot] / 50  # Конвертируем в амперы
+    state['impulses'].extend(feed_impulse_detector(state['detectors']['impulse'], i))
+    feed_plateaus(state['detectors'], i, state['plateaus'])
+    state['detectors']['next_seq'] = seq + 1
+    return time.monotonic() - ring['sent'][slot]
+
+
+async def receive(reader, ring, wake, stats):
+    """Читает блоки из сокета в кольцевой буфер, пока имитатор не сообщит о конце передачи"""
+    scratch = np.empty(block_size)
+    while True:
+        seq, sent, n = header.unpack(await reader.readexactly(header.size))
+        if n == 0:
+            stats['generated'] = seq
+            break
+        payload = await reader.readexactly(n * 8)
+        stats['received'] += 1
+        if ring['head'] - ring['tail'] == ring_slots:
+            ring['dropped'] += 1  # Обработка не успевает - блок не во что записать
+            scratch[:n] = np.frombuffer(payload, dtype=np.float64)
+            continue
+        slot = ring['head'] % ring_slots
+        ring['data'][slot, :n] = np.frombuffer(payload, dtype=np.float64)
+        ring['seq'][slot] = seq
+        ring['sent'][slot] = sent
+        ring['head'] += 1
+        wake.set()
+    stats['finished'] = True
+    wake.set()
+
+
+async def process(ring, wake, stats, state, executor):
+    """Забирает блоки из буфера и обрабатывает их в отдельном потоке"""
+    loop = asyncio.get_running_loop()
+    while True:
+        if ring['tail'] == ring['head']:
+            if stats['finished']:
+                break
+            wake.clear()
+            await wake.wait()
+            continue
+        slot = ring['tail'] % ring_slots
+        latency = await loop.run_in_executor(executor, process_block, state, ring, slot)
+        stats['latencies'].append(latency)
+        ring['tail'] += 1  # Место освобождается только после обработки блока
+    state['impulses'].extend(finish_impulse_detector(state['detectors']['impulse']))
+    finish_plateaus(state['detectors'], state['plateaus'])
+
+
+async def ingest(address):
+    for _ in range(100):
+        try:
+            if socket_kind == 'unix':
+                reader, writer = await asyncio.open_unix_connection(address)
+            else:
+                reader, writer = await asyncio.open_connection('127.0.0.1', address)
+            break
+        except OSError:
+            await asyncio.sleep(0.05)
+    else:
+        raise ConnectionError(f"Не удалось подключиться к имитатору: {address}")
+
+    ring = create_ring()
+    wake = asyncio.Event()
+    stats = {'received': 0, 'generated': 0, 'finished': False, 'latencies': []}
+    state = {'detectors': create_detectors(), 'impulses': [], 'plateaus': {'max': [], 'min': []}, 'gaps': 0}
+    start_time = time.monotonic()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        await asyncio.gather(receive(reader, ring, wake, stats), process(ring, wake, stats, state, executor))
+    stats['elapsed'] = time.monotonic() - start_time
+    writer.close()
+    return ring, stats, state
+
+
+def run_at_rate(blocks, rate):
+    """Запускает имитатор в отдельном процессе и принимает его данные"""
+    if socket_kind == 'unix':
+        address = os.path.join(tempfile.mkdtemp(), 'scope.sock')
+    else:
+        address = tcp_port
+    ready = multiprocessing.Event()
+    simulator = multiprocessing.Process(target=run_simulator, args=(address, blocks, rate, ready))
+    simulator.start()
+    try:
+        ready.wait(timeout=10)
+        return asyncio.run(ingest(address))
+    finally:
+        simulator.join(timeout=run_duration + 10)
+        if simulator.is_alive():
+            simulator.terminate()
+        if socket_kind == 'unix' and os.path.exists(address):
+            os.remove(address)
+            os.rmdir(os.path.dirname(address))
+
+
+if __name__ == '__main__':
+    npz_files = [f for f in os.listdir(directory) if f.endswith('.npz')]
+    npz_files.sort()
+    blocks = load_current_blocks([os.path.join(directory, f) for f in npz_files])
+    if not blocks:
+        print("Нет ни одного читаемого файла")
+        exit(1)
+    print(f"Блоков в имитаторе: {len(blocks)} по {block_size} отсчетов, сокет: {socket_kind}, "
+          f"буфер: {ring_slots} блоков")
+
+    for rate in input_rates:
+        ring, stats, state = run_at_rate(blocks, rate)
+        latencies = np.array(stats['latencies']) * 1000
+        lost = stats['generated'] - stats['received']
+        processed = ring['tail']
+        print(f"\nСкорость {rate / 1e6:.0f} млн отсчетов/с: сгенерировано {stats['generated']} блоков, "
+              f"обработано {processed} ({processed * block_size / stats['elapsed'] / 1e6:.1f} млн отсчетов/с)")
+        print(f"  Потеряно имитатором: {lost}, не поместилось в буфер: {ring['dropped']}, разрывов потока: {state['gaps']}")
+        if len(latencies):
+            print(f"  Задержка от отправки до конца обработки: медиана {np.median(latencies):.2f} мс, "
+                  f"99% {np.percentile(latencies, 99):.2f} мс, максимум {np.max(latencies):.2f} мс")
+        print(f"  Импульсов: {len(state['impulses'])}, плато на верхнем пределе: {len(state['plateaus']['max'])}, "
+              f"касаний нижнего предела: {len(state['plateaus']['min'])}")
+
+        # Без потерь поток совпадает с подряд идущими блоками имитатора - сверяем с обработкой без сокета
+        if lost == 0 and ring['dropped'] == 0:
+            detectors = create_detectors()
+            impulses, plateaus = [], {'max': [], 'min': []}
+            for seq in range(stats['generated']):
+                i = blocks[seq % len(blocks)] / 50
+                impulses.extend(feed_impulse_detector(detectors['impulse'], i))
+                feed_plateaus(detectors, i, plateaus)
+            impulses.extend(finish_impulse_detector(detectors['impulse']))
+            finish_plateaus(detectors, plateaus)
+            same = state['impulses'] == impulses and state['plateaus'] == plateaus
+            print(f"  Совпадает с обработкой тех же блоков без сокета: {same}")